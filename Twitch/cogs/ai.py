@@ -265,7 +265,7 @@ Use is_7tv_emote tool to check if a word is a 7tv emote.
         chunks.append(" ".join(current_chunk))
 
         for chunk in chunks:
-            await self.bot.msg_q.send(ctx, chunk)
+            await self.bot.msg_q.send(ctx, chunk, coalesce=True)
 
     @commands.cooldown(rate=2, per=10, bucket=commands.Bucket.member)
     @commands.command(aliases=("gemini",))
@@ -1,20 +1,46 @@
 from datetime import datetime, UTC
+import os
 from typing import TYPE_CHECKING
 
 import twitchio
-from twitchio.ext import commands
+from twitchio.ext import commands, routines
 
 from shared.database.twitch import channels, messages
 from shared.util.formatting import format_timedelta
 from Twitch.exceptions import ValidationError
+from Twitch.logger import logger
 
 if TYPE_CHECKING:
     from Twitch.twitchbot import Bot
 
 
+PARTITION_MONTHS_AHEAD = 3
+
+
 class Message(commands.Cog):
     def __init__(self, bot: "Bot") -> None:
         self.bot = bot
+        self.maintain_partitions.start(stop_on_error=False)
+
+    @routines.routine(hours=12)
+    async def maintain_partitions(self):
+        """
+        Keeps the monthly partitions of the message log created ahead of time and drops the months older than
+        MESSAGE_RETENTION_MONTHS when it's set
+        """
+        created = await messages.create_partitions(self.bot.con_pool, PARTITION_MONTHS_AHEAD)
+        if len(created) > 0:
+            logger.info("Created message partitions %s", ", ".join(created))
+
+        retention_months = os.getenv("MESSAGE_RETENTION_MONTHS", "")
+        if retention_months == "":
+            return
+        now = datetime.now(UTC)
+        months = now.year * 12 + now.month - 1 - int(retention_months)
+        cutoff = datetime(months // 12, months % 12 + 1, 1, tzinfo=UTC)
+        dropped = await messages.drop_partitions(self.bot.con_pool, cutoff)
+        if len(dropped) > 0:
+            logger.info("Dropped message partitions %s", ", ".join(dropped))
 
     async def cog_check(self, ctx: commands.Context) -> bool:
         channel_config = await channels.channel_config(self.bot.con_pool, ctx.channel.name)
@@ -188,7 +214,7 @@ class Message(commands.Cog):
     async def topchatters(self, ctx: commands.Context):
         """Sorts and shows the top 10 of the chatters of the current channel by the number of messages they have sent"""
         channel_id = await channels.channel_id(self.bot.con_pool, ctx.channel.name)
-        chatters = await messages.top_chatters(self.bot.con_pool, channel_id, str(self.bot.nick))
+        chatters = await messages.top_chatters(self.bot.con_pool, channel_id, str(self.bot.nick), 10)
         top_10 = chatters.most_common(10)
         users = [user[0] for user in top_10]
         message = " | ".join([f"{i}. {chatter[0]} - {chatter[1]}" for i, chatter in enumerate(top_10, 1)])
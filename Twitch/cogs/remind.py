@@ -7,6 +7,7 @@ from typing import TYPE_CHECKING
 import twitchio
 from twitchio.ext import commands, routines
 
+from handlers.message_queue import Priority
 from shared.apis import seventv
 from shared.database.twitch import channels, reminders, timers, users
 from shared.util.formatting import format_timedelta
@@ -41,7 +42,9 @@ class Remind(commands.Cog):
             else:
                 continue
             message, targets = await rem.formatted_message(sender_name, target_name)
-            await self.bot.msg_q.send_message(channel_config.username, message, targets)
+            await self.bot.msg_q.send_message(
+                channel_config.username, message, targets, priority=Priority.REMINDER, coalesce=True
+            )
             await reminders.set_reminder_as_sent(self.bot.con_pool, rem.id)
 
     @routines.routine(seconds=1, wait_first=True)
@@ -51,7 +54,7 @@ class Remind(commands.Cog):
             channel_config = await channels.channel_config(self.bot.con_pool, timer.channel_name)
             if not channel_config.reminds_online and channel_config.currently_online:
                 continue
-            await self.bot.msg_q.send_message(timer.channel_name, timer.message)
+            await self.bot.msg_q.send_message(timer.channel_name, timer.message, priority=Priority.TIMER)
 
     @commands.cooldown(rate=3, per=10, bucket=commands.Bucket.member)
     @commands.command()
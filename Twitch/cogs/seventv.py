@@ -1,4 +1,4 @@
-from datetime import datetime, UTC
+from datetime import datetime, timedelta, UTC
 import random
 import re
 from typing import TYPE_CHECKING
@@ -132,8 +132,11 @@ class SevenTV(commands.Cog):
 
     @commands.cooldown(rate=3, per=10, bucket=commands.Bucket.member)
     @commands.command()
-    async def ecount(self, ctx: commands.Context, emote: str):
-        """Shows the number of times the specified emote has been used in the channel; {prefix}ecount <emote>"""
+    async def ecount(self, ctx: commands.Context, emote: str, days: int | None):
+        """
+        Shows the number of times the specified emote has been used in the channel; {prefix}ecount <emote> <days>;
+        leave days empty to count over all time
+        """
         channel_config = await channels.channel_config(self.bot.con_pool, ctx.channel.name)
         if not channel_config.logging:
             raise ValidationError("This channel isn't being logged")
@@ -142,8 +145,24 @@ class SevenTV(commands.Cog):
         if emote not in emote_names:
             await self.bot.msg_q.send(ctx, "Emote not found in the current set")
             return
-        count = await messages.emote_count(self.bot.con_pool, channel_config.channel_id, emote)
-        await self.bot.msg_q.send(ctx, f"{emote} has been used {count} times")
+        # Days are counted in UTC and include today
+        since = None
+        if days is not None:
+            days = max(days, 1)
+            since = datetime.now(UTC).date() - timedelta(days=days - 1)
+        count = await messages.emote_count(self.bot.con_pool, channel_config.channel_id, emote, since)
+        count += self.bot.emote_counter.pending(channel_config.channel_id, emote, since)
+        # The counts only have the uses since the bot started counting them, unless older logs have been backfilled
+        counted_from = await messages.emote_usage_counted_from(self.bot.con_pool, channel_config.channel_id)
+        start = None if since is None else datetime(since.year, since.month, since.day, tzinfo=UTC)
+        if counted_from is not None and (start or datetime.min.replace(tzinfo=UTC)) < counted_from:
+            await self.bot.msg_q.send(
+                ctx, f"{emote} has been used {count} times since {counted_from:%Y-%m-%d}, when it started being counted"
+            )
+        elif days is None:
+            await self.bot.msg_q.send(ctx, f"{emote} has been used {count} times")
+        else:
+            await self.bot.msg_q.send(ctx, f"{emote} has been used {count} times in the last {days} days")
 
     @commands.cooldown(rate=4, per=10, bucket=commands.Bucket.member)
     @commands.command(aliases=("randomemote", "randemote", "rem"))
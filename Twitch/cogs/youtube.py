@@ -5,6 +5,7 @@ from typing import TYPE_CHECKING
 import twitchio
 from twitchio.ext import commands, routines
 
+from handlers.message_queue import Priority
 from shared.apis import seventv, youtube
 from shared.database.twitch import channels, notifications
 from Twitch.exceptions import ValidationError
@@ -50,6 +51,7 @@ class Youtube(commands.Cog):
                     await self.bot.msg_q.send_message(
                         channel_config.username,
                         f"{channel_name} uploaded a new {'short' if duration <= 62 else 'video'}: {video_title} youtu.be/{video_id} {emote} {' '.join(pings)}",
+                        priority=Priority.NOTIFICATION,
                     )
 
     @commands.cooldown(rate=2, per=10, bucket=commands.Bucket.member)
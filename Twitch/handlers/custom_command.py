@@ -5,6 +5,7 @@ from asyncpg import Pool
 import twitchio
 from twitchio.ext import commands
 
+from handlers.parsed_message import ParsedMessage
 from shared.apis import twitch # TODO: use twitch
 from shared.database.twitch import channels, counters, custom_commands, custom_patterns
 
@@ -69,21 +70,15 @@ async def parse_message_content(
 
 
 async def handle_custom_command(ctx: commands.Context) -> None:
-    assert isinstance(ctx.message.content, str)
     assert isinstance(ctx.author, twitchio.Chatter)
 
-    message = ctx.message.content
-    channel_prefixes = await ctx.bot.prefixes(ctx.channel.name)  # type: ignore
-    for prefix in channel_prefixes:
-        if message.startswith(prefix):
-            message = message.replace(prefix, "", 1).strip()
-            break
-    if not message:
+    parsed: ParsedMessage = ctx.parsed  # type: ignore
+    if parsed.command_name is None:
         return
-    cmd_name, *args = message.split()
+    cmd_name, args = parsed.command_name, parsed.command_args
 
     channel_id = await channels.channel_id(ctx.bot.con_pool, ctx.channel.name)  # type: ignore
-    command = await custom_commands.show_custom_command(ctx.bot.con_pool, channel_id, cmd_name.lower())  # type: ignore
+    command = await custom_commands.show_custom_command(ctx.bot.con_pool, channel_id, cmd_name)  # type: ignore
     if command is None:
         return
 
@@ -121,17 +116,15 @@ async def handle_custom_command(ctx: commands.Context) -> None:
     await ctx.bot.msg_q.send_message(ctx.channel.name, cmd_message)  # type: ignore
 
 
-async def custom_pattern_message(message: twitchio.Message, con_pool: Pool) -> str | None:
-    assert isinstance(message.content, str)
-
+async def custom_pattern_message(message: twitchio.Message, parsed: ParsedMessage, con_pool: Pool) -> str | None:
     channel_id = await channels.channel_id(con_pool, message.channel.name)
     patterns = await custom_patterns.list_custom_patterns(con_pool, channel_id)
     for pattern in patterns:
         if (
-            pattern.regex and re.compile(pattern.pattern).match(message.content)
-        ) or pattern.pattern in message.content:
+            pattern.regex and re.compile(pattern.pattern).match(parsed.text)
+        ) or pattern.pattern in parsed.text:
             if pattern.probability > random.random():
                 pattern_message = await parse_message_content(
-                    message, con_pool, channel_id, pattern.message, message.content.split()
+                    message, con_pool, channel_id, pattern.message, parsed.tokens
                 )
                 return pattern_message
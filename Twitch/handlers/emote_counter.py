@@ -0,0 +1,139 @@
+import asyncio
+from asyncio import Task
+from collections import Counter, deque
+from datetime import date, datetime, UTC
+import time
+
+from asyncpg import Pool
+
+from handlers.parsed_message import ParsedMessage
+from shared.apis import seventv
+from shared.apis.exceptions import APIRequestError
+from shared.database.exceptions import DatabaseError
+from shared.database.twitch import messages
+from Twitch.logger import logger
+
+
+# Messages kept per channel until its emotes have been fetched for the first time; the oldest ones are dropped
+# beyond it and the channel counts as counted from the oldest one kept
+MAX_UNMATCHED = 1000
+
+
+class EmoteCounter:
+    """
+    Counts the 7tv emotes used in chat per channel and day in memory and adds the counts to the emote usage
+    rollup once per flush interval, so reading how many times an emote has been used doesn't need to go
+    through the message log. Counts that fail to be written are kept for the next flush.
+
+    The emote names of a channel are fetched in the background, so a message never waits for 7tv; until the first
+    fetch succeeds, the channel's messages are kept aside and counted afterwards, and the channel is only recorded
+    as counted from the first message that got counted. When a fetch fails, the last known emotes are used and the
+    fetch is retried after a shorter interval.
+    """
+
+    def __init__(
+        self,
+        con_pool: Pool,
+        loop: asyncio.AbstractEventLoop,
+        *,
+        flush_interval: float = 60.0,
+        emote_refresh_interval: float = 300.0,
+        emote_retry_interval: float = 60.0,
+    ) -> None:
+        self.con_pool = con_pool
+        self.loop = loop
+        self.flush_interval = flush_interval
+        self.emote_refresh_interval = emote_refresh_interval
+        self.emote_retry_interval = emote_retry_interval
+        self._counts: Counter[tuple[str, str, date]] = Counter()
+        # When the channels were first counted, until it has been written with their counts
+        self._counting_since: dict[str, datetime] = {}
+        self._recorded: set[str] = set()
+        # The 7tv cache returns deep copies of the emote sets, so the names are kept as a set
+        self._emote_sets: dict[str, frozenset[str]] = {}
+        self._next_fetch: dict[str, float] = {}
+        self._refreshing: dict[str, Task] = {}
+        self._unmatched: dict[str, deque[tuple[list[str], datetime]]] = {}
+        self._task: Task = loop.create_task(self._flush_periodically())
+
+    def count(self, channel_id: str, message: ParsedMessage) -> None:
+        now = datetime.now(UTC)
+        if time.monotonic() >= self._next_fetch.get(channel_id, 0.0):
+            self._refresh(channel_id)
+        emotes = self._emote_sets.get(channel_id)
+        if emotes is None:
+            unmatched = self._unmatched.setdefault(channel_id, deque(maxlen=MAX_UNMATCHED))
+            if len(unmatched) == MAX_UNMATCHED:
+                logger.warning("Dropped an uncounted message in %s while its 7tv emotes are unknown", channel_id)
+            unmatched.append((message.tokens, now))
+            return
+        self._add(channel_id, emotes, message.tokens, now.date())
+
+    def _add(self, channel_id: str, emotes: frozenset[str], tokens: list[str], day: date) -> None:
+        if len(emotes) == 0:
+            return
+        for token in tokens:
+            if token in emotes:
+                self._counts[(channel_id, token, day)] += 1
+
+    def pending(self, channel_id: str, emote: str, since: date | None = None) -> int:
+        """Returns the uses of the emote that haven't been written into the rollup yet"""
+        return sum(
+            count
+            for (counted_channel, counted_emote, day), count in self._counts.items()
+            if counted_channel == channel_id and counted_emote == emote and (since is None or day >= since)
+        )
+
+    async def close(self) -> None:
+        self._task.cancel()
+        for task in self._refreshing.values():
+            task.cancel()
+        await self.flush()
+
+    async def flush(self) -> None:
+        if len(self._counts) == 0:
+            return
+        counts = self._counts
+        self._counts = Counter()
+        counting_since = list(self._counting_since.items())
+        try:
+            await messages.add_emote_usage(
+                self.con_pool,
+                [(channel_id, emote, day, count) for (channel_id, emote, day), count in counts.items()],
+                counting_since,
+            )
+        except DatabaseError as e:
+            logger.error("Failed to write the counts of %d emotes: %s %s", len(counts), e.message, str(e.source))
+            self._counts.update(counts)
+            return
+        for channel_id, _ in counting_since:
+            self._recorded.add(channel_id)
+            self._counting_since.pop(channel_id, None)
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def _refresh(self, channel_id: str) -> None:
+        if channel_id not in self._refreshing:
+            self._refreshing[channel_id] = self.loop.create_task(self._fetch_emote_names(channel_id))
+
+    async def _fetch_emote_names(self, channel_id: str) -> None:
+        try:
+            try:
+                names = frozenset(await seventv.emote_names(channel_id, include_global=True))
+            except APIRequestError as e:
+                logger.warning("Failed to fetch the 7tv emotes of %s: %s %s", channel_id, e.message, str(e.source))
+                # The unmatched messages are kept until a fetch succeeds
+                self._next_fetch[channel_id] = time.monotonic() + self.emote_retry_interval
+                return
+            self._next_fetch[channel_id] = time.monotonic() + self.emote_refresh_interval
+            self._emote_sets[channel_id] = names
+            unmatched = self._unmatched.pop(channel_id, deque())
+            if channel_id not in self._recorded:
+                self._counting_since.setdefault(channel_id, unmatched[0][1] if unmatched else datetime.now(UTC))
+            for tokens, sent_at in unmatched:
+                self._add(channel_id, names, tokens, sent_at.date())
+        finally:
+            del self._refreshing[channel_id]
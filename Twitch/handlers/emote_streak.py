@@ -1,5 +1,6 @@
 from asyncpg import Pool
 
+from handlers.parsed_message import ParsedMessage
 from shared.apis import seventv
 from shared.database.twitch import channels
 
@@ -12,7 +13,7 @@ class EmoteStreaks:
 
     # Only one message from emote patterns is allowed: pyramid > stairs > streak
     # Those that overlap are reset by a former pattern to avoid multiple messages
-    async def streak_message(self, channel: str, sender: str, message: str) -> tuple[str, list[str]] | None:
+    async def streak_message(self, channel: str, sender: str, message: ParsedMessage) -> tuple[str, list[str]] | None:
         pyramid_completion_message = await self.pyramids.increase(channel, sender, message)
         if pyramid_completion_message:
             self.streaks.reset(channel)
@@ -64,12 +65,11 @@ class Streaks:
         if channel in self._streaks:
             del self._streaks[channel]
 
-    async def increase(self, channel: str, sender: str, message: str) -> tuple[str, list[str]] | None:
-        words = message.split()
+    async def increase(self, channel: str, sender: str, message: ParsedMessage) -> tuple[str, list[str]] | None:
         channel_id = await channels.channel_id(self.con_pool, channel)
         emote_names = await seventv.emote_names(channel_id, include_global=True)
 
-        emotes_in_message = set(word for word in words if word in emote_names)
+        emotes_in_message = set(word for word in message.tokens if word in emote_names)
         current_streak = self._streaks.get(channel)
         if current_streak is None:
             self._streaks[channel] = Streak(emotes_in_message)
@@ -135,23 +135,17 @@ class Pyramids:
         if channel in self._pyramids:
             del self._pyramids[channel]
 
-    async def increase(self, channel: str, sender: str, message: str) -> tuple[str, list[str]] | None:
-        words = message.split()
+    async def increase(self, channel: str, sender: str, message: ParsedMessage) -> tuple[str, list[str]] | None:
         channel_id = await channels.channel_id(self.con_pool, channel)
         emote_names = await seventv.emote_names(channel_id, include_global=True)
 
-        if not words[0] in emote_names:
+        if not message.tokens[0] in emote_names:
             if channel in self._pyramids:
                 del self._pyramids[channel]
             return
         else:
-            emote = words[0]
-            count = 0
-            for word in words:
-                if word == emote:
-                    count += 1
-                else:
-                    break
+            emote = message.tokens[0]
+            count = message.leading_repeats
 
         current_pyramid = self._pyramids.get(channel)
         if current_pyramid is None:
@@ -220,22 +214,16 @@ class Stairs:
         if channel in self._stairs:
             del self._stairs[channel]
 
-    async def increase(self, channel: str, sender: str, message: str) -> tuple[str, list[str]] | None:
-        words = message.split()
+    async def increase(self, channel: str, sender: str, message: ParsedMessage) -> tuple[str, list[str]] | None:
         channel_id = await channels.channel_id(self.con_pool, channel)
         emote_names = await seventv.emote_names(channel_id)
 
-        if not words[0] in emote_names:
+        if not message.tokens[0] in emote_names:
             emote = None
             count = 0
         else:
-            emote = words[0]
-            count = 0
-            for word in words:
-                if word == emote:
-                    count += 1
-                else:
-                    break
+            emote = message.tokens[0]
+            count = message.leading_repeats
 
         current_stairs = self._stairs.get(channel)
         if current_stairs is None:
@@ -3,9 +3,13 @@ from datetime import datetime, timedelta, UTC
 import os
 from typing import TYPE_CHECKING
 
+from aiohttp import web
 import twitchio
 from twitchio.ext import commands, eventsub
 
+from handlers.message_queue import MessageQueues, Priority
+from handlers.metrics import metrics
+from handlers.send_scheduler import scheduler
 from shared.apis import seventv, twitch
 from shared.database.twitch import channels, notifications
 from Twitch.logger import logger
@@ -23,6 +27,19 @@ esclient = eventsub.EventSubClient(
 )
 
 last_online: dict[str, datetime] = {}
+# The queues of the bot the handlers are registered for, whose dropped messages are exported with the metrics
+message_queues: MessageQueues | None = None
+
+
+async def metrics_endpoint(request: web.Request) -> web.Response:
+    body = metrics.render() + scheduler.render()
+    if message_queues is not None:
+        body += message_queues.render()
+    return web.Response(body=body.encode(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
+# The reverse proxy only forwards the callback route, so this is reachable from the internal network only
+esclient.router.add_get("/metrics", metrics_endpoint)
 
 
 async def subscribe_stream_start(target_id: str | int) -> bool:
@@ -53,6 +70,9 @@ async def subscribe_user_updated(user_id: str | int) -> bool:
 
 
 def register_eventsub_handlers(bot: "Bot") -> None:
+    global message_queues
+    message_queues = bot.msg_q
+
     @esbot.event()
     async def event_eventsub_notification_stream_start(payload: eventsub.NotificationEvent) -> None:
         data: eventsub.StreamOnlineData = payload.data  # type: ignore
@@ -87,6 +107,7 @@ def register_eventsub_handlers(bot: "Bot") -> None:
             await bot.msg_q.send_message(
                 channel_config.username,
                 f"@{channel.username} went live streaming {category}: {title} {channel.profile_URL} {emote} {' '.join(pings)}",
+                priority=Priority.NOTIFICATION,
             )
 
         # This does nothing if the bot isn't currently in the channel
@@ -125,4 +146,4 @@ def register_eventsub_handlers(bot: "Bot") -> None:
             await bot.join_channels([updated_name])
             bot.msg_q.add_channel(updated_name)
 
-            await bot.msg_q.send_message(updated_name, "Stare")
+            await bot.msg_q.send_message(updated_name, "Stare", priority=Priority.NOTIFICATION)
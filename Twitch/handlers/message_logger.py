@@ -0,0 +1,196 @@
+import asyncio
+from asyncio import Event, Lock, Queue, QueueFull, Task
+from datetime import datetime, UTC
+import os
+
+import asyncpg
+from asyncpg import Pool
+
+from handlers.message_spool import MessageRecord, MessageSpool, SpoolFull
+from shared.database.exceptions import DatabaseError
+from shared.database.twitch import messages
+from Twitch.logger import logger
+
+
+DEFAULT_SPOOL_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "spool", "messages.spool")
+# Errors after which the same messages can be written later, when the database is reachable again
+TRANSIENT_ERRORS = (
+    OSError,
+    asyncio.TimeoutError,
+    asyncpg.InterfaceError,
+    asyncpg.exceptions.PostgresConnectionError,
+    asyncpg.exceptions.OperatorInterventionError,
+    asyncpg.exceptions.InsufficientResourcesError,
+    asyncpg.exceptions.TransactionRollbackError,
+)
+
+
+def is_transient(error: DatabaseError) -> bool:
+    return isinstance(error.source, TRANSIENT_ERRORS)
+
+
+class MessageLogger:
+    """
+    Write-behind logger for chat messages. Messages are buffered in memory and written in batches with COPY
+    once enough of them have gathered or the flush interval has passed. The buffer is bounded; when the
+    database is down or can't keep up within the latency budget, messages go to an on-disk spool instead,
+    which is replayed into the database in order once it recovers. A batch that fails for any other reason is
+    written one message at a time, and the messages the database rejects are moved to a separate spool of
+    rejected messages, so they don't hold up the ones behind them.
+    """
+
+    def __init__(
+        self,
+        con_pool: Pool,
+        loop: asyncio.AbstractEventLoop,
+        *,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        max_queued: int = 50_000,
+        latency_budget: float = 0.05,
+        replay_interval: float = 5.0,
+        spool_path: str | None = None,
+    ) -> None:
+        self.con_pool = con_pool
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.latency_budget = latency_budget
+        self.replay_interval = replay_interval
+        spool_path = spool_path or os.getenv("MESSAGE_SPOOL_PATH", DEFAULT_SPOOL_PATH)
+        self.spool = MessageSpool(spool_path)
+        self.rejected = MessageSpool(f"{spool_path}.rejected", capacity=8 * 1024 * 1024)
+        self._queue: Queue[MessageRecord | None] = Queue(maxsize=max_queued)
+        self._batch_ready = Event()
+        self._replay_lock = Lock()
+        self._closed = False
+        self._task: Task = loop.create_task(self._run())
+        self._replay_task: Task = loop.create_task(self._replay_periodically())
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    @property
+    def spooled_bytes(self) -> int:
+        return self.spool.pending_bytes
+
+    async def log(
+        self, channel_id: str, sender: str, message: str, channel_online: bool, twitch_id: str | None = None
+    ) -> None:
+        """Queues a message; the sender's Twitch id keeps its messages together when it's renamed"""
+        if self._closed:
+            return
+        record = (channel_id, sender, message, channel_online, datetime.now(UTC), twitch_id)
+        try:
+            self._queue.put_nowait(record)
+        except QueueFull:
+            try:
+                await asyncio.wait_for(self._queue.put(record), self.latency_budget)
+            except asyncio.TimeoutError:
+                self._spool([record])
+                return
+        if self._queue.qsize() >= self.batch_size:
+            self._batch_ready.set()
+
+    async def close(self) -> None:
+        """Flushes everything that is still queued and stops the logger"""
+        if self._closed:
+            return
+        self._closed = True
+        await self._queue.put(None)
+        self._batch_ready.set()
+        await self._task
+        self._replay_task.cancel()
+        try:
+            await self._replay_task
+        except asyncio.CancelledError:
+            pass
+        await self._replay()
+        self.spool.close()
+        self.rejected.close()
+
+    async def _run(self) -> None:
+        while True:
+            first = await self._queue.get()
+            if first is not None and self._queue.qsize() < self.batch_size - 1:
+                self._batch_ready.clear()
+                try:
+                    await asyncio.wait_for(self._batch_ready.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+            batch: list[MessageRecord] = []
+            record = first
+            while record is not None:
+                batch.append(record)
+                if len(batch) >= self.batch_size or self._queue.empty():
+                    break
+                record = self._queue.get_nowait()
+
+            if len(batch) > 0:
+                await self._flush(batch)
+            if record is None:
+                return
+
+    async def _flush(self, batch: list[MessageRecord]) -> None:
+        # Older messages are still waiting in the spool, so these have to queue up behind them
+        if self.spool.pending_bytes > 0:
+            self._spool(batch)
+            await self._replay()
+            return
+        try:
+            await messages.log_messages(self.con_pool, batch)
+        except DatabaseError as e:
+            if is_transient(e):
+                logger.error("Failed to log %d messages, spooling them: %s %s", len(batch), e.message, str(e.source))
+                self._spool(batch)
+                return
+            for i, record in enumerate(batch):
+                if not await self._log_or_reject(record):
+                    self._spool(batch[i:])
+                    return
+
+    def _spool(self, records: list[MessageRecord]) -> None:
+        try:
+            self.spool.append(records)
+        except SpoolFull:
+            logger.error("Message spool is full, dropped %d messages", len(records))
+
+    async def _log_or_reject(self, record: MessageRecord) -> bool:
+        """Logs a single message and rejects it if the database refuses it; returns false on a transient error"""
+        try:
+            await messages.log_messages(self.con_pool, [record])
+        except DatabaseError as e:
+            if is_transient(e):
+                return False
+            logger.error("Rejected a message in %s from %s: %s %s", record[0], record[1], e.message, str(e.source))
+            try:
+                self.rejected.append([record])
+            except SpoolFull:
+                logger.error("Rejected message spool is full, dropped the message")
+        return True
+
+    async def _replay(self) -> None:
+        # The same chunk must not be replayed twice by the periodic task and a flush at once
+        async with self._replay_lock:
+            while self.spool.pending_bytes > 0:
+                records, offset = self.spool.read(self.batch_size)
+                try:
+                    await messages.log_messages(self.con_pool, records)
+                except DatabaseError as e:
+                    if is_transient(e):
+                        return
+                    # Each message is consumed on its own, so a transient error later on doesn't replay it again
+                    for _ in records:
+                        (record,), offset = self.spool.read(1)
+                        if not await self._log_or_reject(record):
+                            return
+                        self.spool.consume(offset)
+                    continue
+                self.spool.consume(offset)
+                logger.debug("Replayed %d spooled messages, %d bytes left", len(records), self.spool.pending_bytes)
+
+    async def _replay_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.replay_interval)
+            await self._replay()
@@ -1,21 +1,46 @@
 from abc import ABC, abstractmethod
-from asyncio import Queue, sleep, Task
+from asyncio import PriorityQueue, Task
+from collections import Counter
 from datetime import datetime, timedelta, UTC
+from enum import IntEnum
 from functools import partial
-import re
-from typing import Any, Callable, Coroutine, TYPE_CHECKING
+from itertools import count
+import time
+from typing import Any, Callable, Coroutine, NamedTuple, TYPE_CHECKING
 
 import twitchio
 from twitchio.ext import commands
 
+from handlers.metrics import metrics
+from handlers.outgoing_filter import insert_null_character, OutgoingFilter, WHITESPACE
+from handlers.send_scheduler import scheduler
 from shared.apis import twitch # TODO: use twitch
-from shared.database.twitch import channels, messages, users
+from shared.database.twitch import messages, users
 from Twitch.logger import logger
 
 if TYPE_CHECKING:
     from Twitch.twitchbot import Bot
 
 
+class Priority(IntEnum):
+    """Order in which queued messages are sent, the lowest first"""
+
+    COMMAND = 0
+    REMINDER = 1
+    NOTIFICATION = 2
+    TIMER = 3
+
+
+# Seconds a message may wait in the queue before it's dropped; replies, reminders and afk messages are never dropped
+DEFAULT_DEADLINES: dict[Priority, float] = {Priority.NOTIFICATION: 600.0, Priority.TIMER: 60.0}
+MAX_MESSAGE_LENGTH = 500
+# Messages that allow it are merged with the ones queued after them when at least this many are waiting
+COALESCE_BACKLOG = 3
+COALESCE_SEPARATOR = " | "
+# Twitch refuses to relay the same message twice in this many seconds unless the bot is a moderator or a VIP
+DUPLICATE_WINDOW = 30.0
+
+
 class Action:
     def __init__(
         self,
@@ -107,25 +132,48 @@ class ActionStorage:
         return action
 
 
+class LastSent(NamedTuple):
+    message: str
+    # Monotonic time the message was sent at
+    sent_at: float
+
+
 class SendableMessage(ABC):
     def __init__(self, *args, **kwargs) -> None:
         self.message: str
         self.channel: str
         self.bot_is_mod_or_vip: bool
+        self.priority: Priority
+        # Monotonic time after which the message isn't worth sending anymore
+        self.deadline: float | None
+        # Whether the message may be merged with the ones around it into one send when the queue backs up
+        self.coalesce: bool
+
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() > self.deadline
+
+    async def send(self, last_sent: dict[str, LastSent]) -> None:
+        """Sends the message and records it as the last one sent to its channel"""
+        await self._send()
+        last_sent[self.channel] = LastSent(self.message, time.monotonic())
 
     @abstractmethod
-    async def send(self) -> None:
+    async def _send(self) -> None:
         pass
 
 
 class CommandMessage(SendableMessage):
-    def __init__(self, action: Action, bot_is_mod_or_vip: bool) -> None:
+    def __init__(self, action: Action, bot_is_mod_or_vip: bool, coalesce: bool = False) -> None:
         self.action = action
         self.message = action.message
         self.channel = action.channel
         self.bot_is_mod_or_vip = bot_is_mod_or_vip
+        self.priority = Priority.COMMAND
+        self.deadline = None
+        # A reply is attached to the message it answers, so it can't be merged with anything
+        self.coalesce = coalesce and not action.reply
 
-    async def send(self) -> None:
+    async def _send(self) -> None:
         if self.action.reply:
             await self.action.ctx.reply(self.message)
         else:
@@ -133,39 +181,115 @@ class CommandMessage(SendableMessage):
 
 
 class Message(SendableMessage):
-    def __init__(self, bot: "Bot", channel: str, message: str, bot_is_mod_or_vip: bool) -> None:
+    def __init__(
+        self,
+        bot: "Bot",
+        channel: str,
+        message: str,
+        bot_is_mod_or_vip: bool,
+        priority: Priority = Priority.COMMAND,
+        deadline: float | None = None,
+        coalesce: bool = False,
+    ) -> None:
         self.bot = bot
         self.channel = channel
         self.message = message
         self.bot_is_mod_or_vip = bot_is_mod_or_vip
+        self.priority = priority
+        self.deadline = deadline
+        self.coalesce = coalesce
 
-    async def send(self) -> None:
+    async def _send(self) -> None:
         self.current_channel = self.bot.get_channel(self.channel)
         assert self.current_channel is not None
         await self.current_channel.send(self.message)
 
 
+def _truncate(message: str) -> str:
+    if len(message) > MAX_MESSAGE_LENGTH:
+        return message[: MAX_MESSAGE_LENGTH - 4] + " ..."
+    return message
+
+
 class MessageQueues:
+    """
+    A queue of outgoing messages per channel, sent in the order of their priority and then in the order they were
+    queued. Messages that have waited past their deadline are dropped instead of sent and counted per channel and
+    priority, so a backlog of notifications or timers doesn't hold up the replies to commands. When the queue backs
+    up, messages that allow it are merged with the ones that follow them, so the backlog takes fewer sends.
+    """
+
     def __init__(self, bot: "Bot", initial_channels: list[str]) -> None:
         self.bot = bot
         self.actions = ActionStorage()
-        self._queues: dict[str, Queue[SendableMessage]] = {}
+        self.filter = OutgoingFilter()
+        self.dropped: Counter[tuple[str, Priority]] = Counter()
+        self.last_sent: dict[str, LastSent] = {}
+        # The sequence number keeps the messages of the same priority in order
+        self._queues: dict[str, PriorityQueue[tuple[Priority, int, SendableMessage]]] = {}
+        self._sequence = count()
         self._tasks: dict[str, Task] = {}
         for channel in initial_channels:
             self.add_channel(channel)
 
     async def _clear_queue(self, channel: str) -> None:
+        queue = self._queues[channel]
         while True:
-            message = await self._queues[channel].get()
-            await message.send()
-            if not message.bot_is_mod_or_vip:
-                await sleep(1.2)
-            else:
-                await sleep(0.1)
+            _, _, message = await queue.get()
+            if self._drop_if_expired(message):
+                continue
+            if message.coalesce and queue.qsize() >= COALESCE_BACKLOG:
+                self._coalesce(message)
+            await scheduler.acquire(channel, message.bot_is_mod_or_vip)
+            if not scheduler.is_elevated(channel, message.bot_is_mod_or_vip):
+                self._avoid_duplicate(message)
+            await message.send(self.last_sent)
+
+    def _drop_if_expired(self, message: SendableMessage) -> bool:
+        if not message.expired():
+            return False
+        self.dropped[(message.channel, message.priority)] += 1
+        logger.debug("Dropped an expired %s message in %s", message.priority.name.lower(), message.channel)
+        return True
+
+    def _coalesce(self, first: SendableMessage) -> None:
+        """Appends the messages queued next to the first one for as long as they allow it and fit into one message"""
+        queue = self._queues[first.channel]
+        parts = [first.message]
+        length = len(first.message)
+        while not queue.empty():
+            entry = queue.get_nowait()
+            message = entry[2]
+            if self._drop_if_expired(message):
+                continue
+            if not message.coalesce or length + len(COALESCE_SEPARATOR) + len(message.message) > MAX_MESSAGE_LENGTH:
+                # Putting it back with its own sequence number keeps it at the front of the queue
+                queue.put_nowait(entry)
+                break
+            parts.append(message.message)
+            length += len(COALESCE_SEPARATOR) + len(message.message)
+        first.message = COALESCE_SEPARATOR.join(parts)
+
+    def _avoid_duplicate(self, message: SendableMessage) -> None:
+        """Changes the message invisibly if it's the same as the last one sent to the channel"""
+        last = self.last_sent.get(message.channel)
+        if last is not None and last.message == message.message and time.monotonic() - last.sent_at <= DUPLICATE_WINDOW:
+            message.message = _truncate(insert_null_character(message.message))
+
+    def render(self) -> str:
+        """Formats the numbers of dropped messages in the Prometheus text exposition format"""
+        name = "twitch_bot_dropped_messages_total"
+        lines = [
+            f"# HELP {name} Messages dropped because they waited in the queue past their deadline",
+            f"# TYPE {name} counter",
+        ]
+        for (channel, priority), dropped in sorted(self.dropped.items()):
+            lines.append(f'{name}{{channel="{channel}",priority="{priority.name.lower()}"}} {dropped}')
+        return "\n".join(lines) + "\n"
 
     def add_channel(self, channel: str) -> None:
         if channel not in self._queues:
-            self._queues[channel] = Queue()
+            self._queues[channel] = PriorityQueue()
         if channel not in self._tasks:
             self._tasks[channel] = self.bot.loop.create_task(self._clear_queue(channel))
 
@@ -176,62 +300,56 @@ class MessageQueues:
             del self._tasks[channel]
         if channel in self._queues:
             del self._queues[channel]
+        self.last_sent.pop(channel, None)
+        scheduler.remove_channel(channel)
 
     async def _add_to_queue(self, msg: SendableMessage, targets: list[str] | tuple[str, ...]) -> None:
+        with metrics.span("add_to_queue", msg.channel):
+            await self._process(msg, targets)
+            await self._queues[msg.channel].put((msg.priority, next(self._sequence), msg))
+
+    async def _process(self, msg: SendableMessage, targets: list[str] | tuple[str, ...]) -> None:
         """Processing of the message before it is added to the queue."""
-        msg.message = re.sub(r"\s+", " ", msg.message.strip())
-
-        blocked_words = await messages.blocked_terms(self.bot.con_pool)
-        replacement_word = "<pleep>"
-        for word in blocked_words:
-            if word.regex:
-                try:
-                    msg.message = re.sub(word.pattern, replacement_word, msg.message)
-                except re.error as e:
-                    logger.warning(
-                        "Invalid regex in blocked words: %s (id: %d) %s",
-                        word.pattern,
-                        word.id,
-                        str(e),
-                    )
-            else:
-                msg.message = msg.message.replace(word.pattern, replacement_word)
-
-        def insert_null_character(string: str) -> str:
-            if len(string) == 0:
-                return string
-            return string[:2] + "\U000E0000" + string[2:]
+        msg.message = WHITESPACE.sub(" ", msg.message.strip())
+
+        with metrics.span("add_to_queue.blocked_terms", msg.channel):
+            blocked_terms = await messages.blocked_terms(self.bot.con_pool)
+            msg.message = self.filter.censor(msg.message, blocked_terms)
 
         if isinstance(msg, CommandMessage) and msg.action.reply:
-            user_config = await users.user_config(self.bot.con_pool, msg.action.actor_id)
+            with metrics.span("add_to_queue.user_config", msg.channel):
+                user_config = await users.user_config(self.bot.con_pool, msg.action.actor_id)
             if user_config.no_replies:
                 msg.action.reply = False
                 msg.message = f"{insert_null_character(msg.action.actor)}, {msg.message}"
 
-        for user in targets:
-            msg.message = re.sub(rf"\b@?{user}[,.:-]?\b", insert_null_character(user), msg.message)
-
-        if not msg.bot_is_mod_or_vip:
-            channel_id = await channels.channel_id(self.bot.con_pool, msg.channel)
-            bot_last_message = await messages.last_seen(self.bot.con_pool, channel_id, self.bot.nick)  # type: ignore
-            if (
-                bot_last_message is not None
-                and bot_last_message.message == msg.message
-                and (datetime.now(UTC) - bot_last_message.sent_at).seconds <= 30
-            ):
-                msg.message = insert_null_character(msg.message)
-
-        if len(msg.message) > 500:
-            msg.message = msg.message[:496] + " ..."
+        msg.message = _truncate(self.filter.mask_pings(msg.message, targets))
 
-        await self._queues[msg.channel].put(msg)
-
-    async def send_message(self, channel: str, message: str, targets: list[str] | tuple[str, ...] = tuple()):
+    async def send_message(
+        self,
+        channel: str,
+        message: str,
+        targets: list[str] | tuple[str, ...] = tuple(),
+        *,
+        priority: Priority = Priority.COMMAND,
+        deadline: float | None = None,
+        coalesce: bool = False,
+    ):
+        """
+        Queues a message that isn't a reply to a command; the deadline is the number of seconds it may wait in the
+        queue and defaults to the one of its priority. Messages that don't need to be sent on their own can allow
+        being merged with other ones when the queue backs up.
+        """
         # mods_and_vips = await ivr.modvip(ctx.channel.name)
         # bot_is_mod_or_vip = self.bot.nick in [user.username for user in mods_and_vips.vips + mods_and_vips.mods]
         current_channel = self.bot.get_channel(channel)
         bot_is_mod_or_vip = bool(current_channel._bot_is_mod()) if current_channel is not None else False
-        await self._add_to_queue(Message(self.bot, channel, message, bot_is_mod_or_vip), targets)
+        if deadline is None:
+            deadline = DEFAULT_DEADLINES.get(priority)
+        expires_at = time.monotonic() + deadline if deadline is not None else None
+        await self._add_to_queue(
+            Message(self.bot, channel, message, bot_is_mod_or_vip, priority, expires_at, coalesce), targets
+        )
 
     async def send(
         self,
@@ -240,13 +358,14 @@ class MessageQueues:
         targets: list[str] | tuple[str, ...] = tuple(),
         undo_callback: Callable[..., Coroutine[Any, Any, Any]] | None = None,
         *undo_args,
+        coalesce: bool = False,
         **undo_kwargs,
     ) -> None:
         action = self.actions.create_and_add_action(ctx, message, False, undo_callback, *undo_args, **undo_kwargs)
         # mods_and_vips = await ivr.modvip(ctx.channel.name)
         # bot_is_mod_or_vip = self.bot.nick in [user.username for user in mods_and_vips.vips + mods_and_vips.mods]
         bot_is_mod_or_vip = bool(ctx.channel._bot_is_mod())
-        await self._add_to_queue(CommandMessage(action, bot_is_mod_or_vip), targets)
+        await self._add_to_queue(CommandMessage(action, bot_is_mod_or_vip, coalesce), targets)
 
     async def reply(
         self,
@@ -0,0 +1,135 @@
+from datetime import datetime, timedelta, UTC
+import mmap
+import os
+import struct
+
+from Twitch.logger import logger
+
+
+# channel id, sender login, message, online, sent_at and the sender's Twitch id when it's known
+MessageRecord = tuple[str, str, str, bool, datetime, str | None]
+
+EPOCH = datetime.fromtimestamp(0, UTC)
+
+
+class SpoolFull(Exception):
+    pass
+
+
+class MessageSpool:
+    """
+    Append-only on-disk spool for chat messages that couldn't be written to the database. The file has a fixed
+    capacity and is memory-mapped; its header holds the read and write offsets, so records written before a
+    restart are still replayed, in the order they were appended.
+    """
+
+    _MAGIC = b"PLS2"
+    _HEADER = struct.Struct("<4sQQ")
+    # sent_at in microseconds, online flag and the lengths of channel id, sender, message and Twitch id
+    _RECORD = struct.Struct("<qBIIII")
+    _LENGTH = struct.Struct("<I")
+    # Spools written before the records had the Twitch id are converted when they are opened
+    _LEGACY_MAGIC = b"PLSP"
+    _LEGACY_RECORD = struct.Struct("<qBIII")
+
+    def __init__(self, path: str, capacity: int = 64 * 1024 * 1024) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, "a+b")
+        if os.path.getsize(path) < capacity:
+            self._file.truncate(capacity)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        self.capacity = len(self._map)
+
+        magic, self._read_offset, self._write_offset = self._HEADER.unpack_from(self._map, 0)
+        if magic == self._LEGACY_MAGIC:
+            self._convert_legacy()
+        elif magic != self._MAGIC:
+            if magic != b"\x00" * 4:
+                logger.warning("Message spool %s had an unknown header and was reset", path)
+            self._read_offset = self._write_offset = self._HEADER.size
+            self._write_header()
+
+    @property
+    def pending_bytes(self) -> int:
+        return self._write_offset - self._read_offset
+
+    def append(self, records: list[MessageRecord]) -> None:
+        encoded = b"".join(self._encode(record) for record in records)
+        if self._write_offset + len(encoded) > self.capacity:
+            self._compact()
+            if self._write_offset + len(encoded) > self.capacity:
+                raise SpoolFull(f"{len(records)} messages don't fit in the spool")
+        self._map[self._write_offset : self._write_offset + len(encoded)] = encoded
+        # The records are on disk before the header makes them visible
+        self._map.flush()
+        self._write_offset += len(encoded)
+        self._write_header()
+
+    def read(self, max_records: int) -> tuple[list[MessageRecord], int]:
+        """Returns the oldest records and the offset to pass to `consume` once they have been stored"""
+        records = []
+        offset = self._read_offset
+        while offset < self._write_offset and len(records) < max_records:
+            (length,) = self._LENGTH.unpack_from(self._map, offset)
+            offset += self._LENGTH.size
+            records.append(self._decode(offset))
+            offset += length
+        return records, offset
+
+    def consume(self, offset: int) -> None:
+        self._read_offset = offset
+        if self._read_offset == self._write_offset:
+            self._read_offset = self._write_offset = self._HEADER.size
+        self._write_header()
+
+    def close(self) -> None:
+        self._map.flush()
+        self._map.close()
+        self._file.close()
+
+    def _compact(self) -> None:
+        pending = self.pending_bytes
+        self._map.move(self._HEADER.size, self._read_offset, pending)
+        self._map.flush()
+        self._read_offset = self._HEADER.size
+        self._write_offset = self._HEADER.size + pending
+        self._write_header()
+
+    def _convert_legacy(self) -> None:
+        records = []
+        offset = self._read_offset
+        while offset < self._write_offset:
+            (length,) = self._LENGTH.unpack_from(self._map, offset)
+            offset += self._LENGTH.size
+            records.append(self._decode(offset, self._LEGACY_RECORD))
+            offset += length
+        self._read_offset = self._write_offset = self._HEADER.size
+        self._write_header()
+        if len(records) > 0:
+            self.append(records)
+
+    def _write_header(self) -> None:
+        self._HEADER.pack_into(self._map, 0, self._MAGIC, self._read_offset, self._write_offset)
+        self._map.flush(0, mmap.PAGESIZE)
+
+    def _encode(self, record: MessageRecord) -> bytes:
+        channel_id, sender, message, online, sent_at, twitch_id = record
+        fields = [channel_id.encode(), sender.encode(), message.encode(), (twitch_id or "").encode()]
+        online_flag = 2 if online is None else int(online)
+        sent_at_us = (sent_at - EPOCH) // timedelta(microseconds=1)
+        payload = self._RECORD.pack(sent_at_us, online_flag, *(len(field) for field in fields))
+        payload += b"".join(fields)
+        return self._LENGTH.pack(len(payload)) + payload
+
+    def _decode(self, offset: int, record: struct.Struct | None = None) -> MessageRecord:
+        record = record or self._RECORD
+        sent_at_us, online_flag, *lengths = record.unpack_from(self._map, offset)
+        offset += record.size
+        fields = []
+        for length in lengths:
+            fields.append(self._map[offset : offset + length].decode())
+            offset += length
+        online = None if online_flag == 2 else bool(online_flag)
+        twitch_id = fields[3] if len(fields) > 3 and fields[3] != "" else None
+        sent_at = EPOCH + timedelta(microseconds=sent_at_us)
+        return (fields[0], fields[1], fields[2], online, sent_at, twitch_id)  # type: ignore
@@ -0,0 +1,117 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+import random
+import time
+from typing import Iterator
+
+from Twitch.logger import logger
+
+
+# Upper bounds of the histogram buckets in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self) -> None:
+        # The last bucket counts everything above the largest bound
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Trace:
+    def __init__(self, channel: str) -> None:
+        self.channel = channel
+        self.started = time.perf_counter()
+        self.spans: list[tuple[str, float]] = []
+
+
+_current_trace: ContextVar[Trace | None] = ContextVar("current_trace", default=None)
+
+
+class LatencyMetrics:
+    """
+    Latency histograms per stage and channel, measured with the monotonic clock. Spans opened within a trace
+    are also recorded on it, and traces of slow messages are logged with their breakdown for a sample of them.
+    Each chat message is handled in its own task, so the current trace is kept in a context variable and reaches
+    the stages that run deeper in the call stack, like command dispatch and queueing the bot's responses.
+    """
+
+    def __init__(self, *, slow_threshold: float = 0.5, slow_sample_rate: float = 0.1) -> None:
+        self.slow_threshold = slow_threshold
+        self.slow_sample_rate = slow_sample_rate
+        self._histograms: dict[tuple[str, str], Histogram] = {}
+
+    def observe(self, stage: str, channel: str, duration: float) -> None:
+        histogram = self._histograms.get((stage, channel))
+        if histogram is None:
+            histogram = self._histograms[(stage, channel)] = Histogram()
+        histogram.observe(duration)
+
+    @contextmanager
+    def span(self, stage: str, channel: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - started
+            self.observe(stage, channel, duration)
+            trace = _current_trace.get()
+            if trace is not None:
+                trace.spans.append((stage, duration))
+
+    @contextmanager
+    def trace(self, stage: str, channel: str) -> Iterator[Trace]:
+        trace = Trace(channel)
+        token = _current_trace.set(trace)
+        try:
+            yield trace
+        finally:
+            _current_trace.reset(token)
+            duration = time.perf_counter() - trace.started
+            self.observe(stage, channel, duration)
+            if duration >= self.slow_threshold and random.random() < self.slow_sample_rate:
+                breakdown = ", ".join(f"{span} {span_duration * 1000:.1f} ms" for span, span_duration in trace.spans)
+                logger.warning("Slow %s in %s took %.1f ms: %s", stage, channel, duration * 1000, breakdown)
+
+    def reset(self) -> None:
+        self._histograms.clear()
+
+    def stage_totals(self) -> dict[str, tuple[int, float]]:
+        """Returns the number of spans and the total time spent in each stage over all channels"""
+        totals: dict[str, tuple[int, float]] = {}
+        for (stage, _), histogram in self._histograms.items():
+            count, total = totals.get(stage, (0, 0.0))
+            totals[stage] = (count + histogram.count, total + histogram.sum)
+        return totals
+
+    def render(self) -> str:
+        """Formats the histograms in the Prometheus text exposition format"""
+        name = "twitch_bot_stage_latency_seconds"
+        lines = [
+            f"# HELP {name} Time spent in each stage of handling chat messages",
+            f"# TYPE {name} histogram",
+        ]
+        for (stage, channel), histogram in sorted(self._histograms.items()):
+            labels = f'stage="{_escape(stage)}",channel="{_escape(channel)}"'
+            cumulative = 0
+            for bound, count in zip(BUCKETS, histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+            lines.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+            lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(label: str) -> str:
+    return label.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+metrics = LatencyMetrics()
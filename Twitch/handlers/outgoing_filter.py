@@ -0,0 +1,66 @@
+from functools import lru_cache
+import re
+
+from shared.database.twitch.models import BlockedTerm
+from Twitch.logger import logger
+
+
+REPLACEMENT = "<pleep>"
+WHITESPACE = re.compile(r"\s+")
+
+
+def insert_null_character(string: str) -> str:
+    if len(string) == 0:
+        return string
+    return string[:2] + "\U000E0000" + string[2:]
+
+
+@lru_cache(maxsize=1024)
+def _ping_pattern(targets: tuple[str, ...]) -> re.Pattern[str]:
+    # Longer names first, so a name isn't cut short by another one that it starts with
+    names = "|".join(re.escape(target) for target in sorted(targets, key=len, reverse=True))
+    return re.compile(rf"\b@?({names})[,.:-]?\b")
+
+
+class OutgoingFilter:
+    """
+    Censors the blocked terms in outgoing messages and masks the pings of their targets. The literal terms are
+    combined into one alternation and the regex terms are compiled once, both only when the blocked terms have
+    changed, so filtering a message doesn't compile anything.
+    """
+
+    def __init__(self) -> None:
+        self._terms: list[BlockedTerm] | None = None
+        self._literals: re.Pattern[str] | None = None
+        self._regexes: list[re.Pattern[str]] = []
+
+    def _compile(self, terms: list[BlockedTerm]) -> None:
+        literals = sorted({term.pattern for term in terms if not term.regex and len(term.pattern) > 0}, key=len)
+        # Longer terms first, so the whole of a term is replaced even if a shorter one is a part of it
+        self._literals = re.compile("|".join(map(re.escape, reversed(literals)))) if len(literals) > 0 else None
+        self._regexes = []
+        for term in terms:
+            if not term.regex:
+                continue
+            try:
+                self._regexes.append(re.compile(term.pattern))
+            except re.error as e:
+                logger.warning("Invalid regex in blocked words: %s (id: %d) %s", term.pattern, term.id, str(e))
+        self._terms = terms
+
+    def censor(self, message: str, terms: list[BlockedTerm]) -> str:
+        """Replaces the blocked terms in the message; the terms are compiled again when a different list is given"""
+        if terms is not self._terms:
+            self._compile(terms)
+        if self._literals is not None:
+            message = self._literals.sub(REPLACEMENT, message)
+        for regex in self._regexes:
+            message = regex.sub(REPLACEMENT, message)
+        return message
+
+    def mask_pings(self, message: str, targets: list[str] | tuple[str, ...]) -> str:
+        """Breaks up the mentions of the targets so they don't get pinged"""
+        if len(targets) == 0:
+            return message
+        pattern = _ping_pattern(tuple(sorted(set(targets))))
+        return pattern.sub(lambda match: insert_null_character(match.group(1)), message)
@@ -0,0 +1,81 @@
+from functools import lru_cache
+import re
+
+
+@lru_cache(maxsize=1024)
+def prefix_matcher(prefixes: tuple[str, ...]) -> re.Pattern[str]:
+    """
+    Compiles the prefixes of a channel into a single pattern. The channel config keeps its prefixes as a tuple,
+    so the pattern is only compiled again after they change. Alternatives are tried in the configured order,
+    the same way twitchio picks the prefix.
+    """
+    return re.compile("|".join(re.escape(prefix) for prefix in prefixes))
+
+
+class ParsedMessage:
+    """
+    A chat message split into its parts once, so every stage that handles the message can share them
+
+    `logged_text` is the normalized message that is logged, `text` the same without the invisible characters
+    that some chatters use to send the same message twice and `tokens` its words. `leading_repeats` is how many
+    times the first word is repeated at the start of the message. If the message starts with one of the channel
+    prefixes, `prefix` is set and `command_name`, `command_args` and `command_text` hold the command with the
+    name lowercased and leading underscores stripped from the arguments.
+    """
+
+    __slots__ = (
+        "logged_text",
+        "text",
+        "tokens",
+        "leading_repeats",
+        "prefix",
+        "command_name",
+        "command_args",
+        "command_text",
+    )
+
+    def __init__(self, content: str, prefixes: tuple[str, ...], *, nick: str | None = None, reply: bool = False):
+        self.logged_text = " ".join(content.split()).replace("ACTION ", "")
+        self.text = self.logged_text.replace("\U000E0000", "")
+        self.tokens = self.text.split()
+
+        self.leading_repeats = 0
+        for token in self.tokens:
+            if token != self.tokens[0]:
+                break
+            self.leading_repeats += 1
+
+        self.prefix: str | None = None
+        self.command_name: str | None = None
+        self.command_args: list[str] = []
+        self.command_text = self.text
+
+        # twitchio skips the @username that starts a reply
+        start = 1 if reply and len(self.tokens) > 1 else 0
+        if start >= len(self.tokens):
+            return
+        first = self.tokens[start]
+        command_tokens = self.tokens[start:]
+        # Using @ to ping the bot will trigger the bot's command
+        if nick is not None and len(prefixes) > 0 and first.startswith(f"@{nick}"):
+            first = prefixes[0] + first[1:]
+            command_tokens = [first, *command_tokens[1:]]
+
+        match = prefix_matcher(prefixes).match(first)
+        if match is None:
+            return
+        self.prefix = match.group()
+        # Allow a whitespace between prefix and the command name
+        if match.end() == len(first):
+            command_tokens = command_tokens[1:]
+        else:
+            command_tokens = [first[match.end() :], *command_tokens[1:]]
+        if len(command_tokens) == 0:
+            return
+
+        # Make commands case insensitive and allow using _ before targets
+        self.command_name = command_tokens[0].lower()
+        self.command_args = [arg.lstrip("_") for arg in command_tokens[1:]]
+        self.command_text = " ".join(
+            [*self.tokens[:start], self.prefix + self.command_name, *self.command_args]
+        )
@@ -0,0 +1,154 @@
+import asyncio
+from collections import deque
+import time
+
+
+# Messages the account may send in any window of 30 seconds, in channels where it's a regular user and in
+# channels where it's the broadcaster, a moderator or a VIP
+GLOBAL_LIMIT = 20
+ELEVATED_GLOBAL_LIMIT = 100
+GLOBAL_WINDOW = 30.0
+# Regular users can send one message per second in a channel, or one per slow mode interval
+CHANNEL_INTERVAL = 1.0
+# Added to the channel interval, so timer jitter and the server's clock don't get a message sent just too early
+CHANNEL_MARGIN = 0.2
+ELEVATED_BADGES = ("broadcaster/", "moderator/", "vip/")
+
+
+class TokenBucket:
+    """
+    A bucket of tokens where a spent token comes back a fixed time after it was spent. That is how Twitch counts
+    its limits, in a window sliding over the last messages, so a full bucket can't be spent twice within a window
+    like it could if it refilled at a constant rate.
+    """
+
+    def __init__(self, capacity: int, period: float) -> None:
+        self.capacity = capacity
+        self.period = period
+        self._spent: deque[float] = deque()
+
+    def _refill(self, now: float) -> None:
+        while len(self._spent) > 0 and self._spent[0] + self.period <= now:
+            self._spent.popleft()
+
+    def tokens(self, now: float) -> int:
+        self._refill(now)
+        return max(self.capacity - len(self._spent), 0)
+
+    def wait_time(self, now: float) -> float:
+        """Returns how long it takes until a token is available"""
+        self._refill(now)
+        if len(self._spent) < self.capacity:
+            return 0.0
+        return self._spent[len(self._spent) - self.capacity] + self.period - now
+
+    def take(self, now: float) -> None:
+        self._spent.append(now)
+
+
+class ChannelState:
+    def __init__(self) -> None:
+        # None until a USERSTATE has been received, then the message's own flag is used
+        self.elevated: bool | None = None
+        self.slow = 0
+        self.bucket = TokenBucket(1, self.interval())
+
+    def interval(self) -> float:
+        return max(CHANNEL_INTERVAL, float(self.slow)) + CHANNEL_MARGIN
+
+
+class SendScheduler:
+    """
+    Decides when the bot's messages may be sent, so the channel queues send as fast as Twitch allows instead of
+    sleeping a fixed time after every message. Every message takes a token from the account-wide bucket and, in
+    channels where the bot is a regular user, from the stricter account-wide bucket and from the channel's own
+    bucket, which gives a token back after a second or the slow mode interval. Whether the bot is elevated and the
+    slow mode interval are taken from the USERSTATE and ROOMSTATE messages Twitch sends.
+    """
+
+    def __init__(self) -> None:
+        self.elevated_global = TokenBucket(ELEVATED_GLOBAL_LIMIT, GLOBAL_WINDOW)
+        self.regular_global = TokenBucket(GLOBAL_LIMIT, GLOBAL_WINDOW)
+        self._channels: dict[str, ChannelState] = {}
+
+    def _channel(self, channel: str) -> ChannelState:
+        state = self._channels.get(channel)
+        if state is None:
+            state = self._channels[channel] = ChannelState()
+        return state
+
+    def remove_channel(self, channel: str) -> None:
+        self._channels.pop(channel, None)
+
+    def is_elevated(self, channel: str, fallback: bool = False) -> bool:
+        state = self._channels.get(channel)
+        if state is None or state.elevated is None:
+            return fallback
+        return state.elevated
+
+    def update_room_state(self, channel: str, tags: dict[str, str]) -> None:
+        # A ROOMSTATE after a change only has the tags that changed
+        if "slow" in tags:
+            state = self._channel(channel)
+            state.slow = int(tags["slow"] or 0)
+            state.bucket.period = state.interval()
+
+    def update_user_state(self, channel: str, tags: dict[str, str]) -> None:
+        badges = tags.get("badges", "")
+        self._channel(channel).elevated = tags.get("mod") == "1" or any(
+            badge in badges for badge in ELEVATED_BADGES
+        )
+
+    def _buckets(self, channel: str, elevated: bool) -> list[TokenBucket]:
+        if elevated:
+            return [self.elevated_global]
+        return [self.elevated_global, self.regular_global, self._channel(channel).bucket]
+
+    def tokens_left(self, channel: str, elevated: bool = False) -> int:
+        """Returns how many messages could be sent to the channel right now"""
+        now = time.monotonic()
+        return min(bucket.tokens(now) for bucket in self._buckets(channel, self.is_elevated(channel, elevated)))
+
+    async def acquire(self, channel: str, elevated: bool = False) -> None:
+        """
+        Waits until a message may be sent to the channel and takes its tokens. The elevated flag is only used
+        until Twitch has sent the bot's state in the channel.
+        """
+        while True:
+            now = time.monotonic()
+            buckets = self._buckets(channel, self.is_elevated(channel, elevated))
+            wait = max(bucket.wait_time(now) for bucket in buckets)
+            if wait <= 0:
+                for bucket in buckets:
+                    bucket.take(now)
+                return
+            await asyncio.sleep(wait)
+
+    def render(self) -> str:
+        """Formats the tokens left in the Prometheus text exposition format"""
+        now = time.monotonic()
+        name = "twitch_bot_send_tokens"
+        lines = [
+            f"# HELP {name} Messages the bot could send right now without exceeding the rate limits",
+            f"# TYPE {name} gauge",
+            f'{name}{{bucket="global_elevated"}} {self.elevated_global.tokens(now)}',
+            f'{name}{{bucket="global"}} {self.regular_global.tokens(now)}',
+        ]
+        for channel, state in sorted(self._channels.items()):
+            lines.append(f'{name}{{bucket="channel",channel="{channel}"}} {state.bucket.tokens(now)}')
+        return "\n".join(lines) + "\n"
+
+
+def parse_state(line: str) -> tuple[str, str, dict[str, str]] | None:
+    """Returns the command, channel and tags of a ROOMSTATE or USERSTATE line of IRC"""
+    if not line.startswith("@"):
+        return None
+    raw_tags, _, rest = line[1:].partition(" ")
+    parts = rest.split()
+    if len(parts) < 3 or parts[1] not in ("ROOMSTATE", "USERSTATE"):
+        return None
+    tags = dict(tag.partition("=")[::2] for tag in raw_tags.split(";"))
+    return parts[1], parts[2].lstrip("#"), tags
+
+
+scheduler = SendScheduler()
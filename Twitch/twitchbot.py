@@ -1,28 +1,44 @@
 from datetime import datetime, UTC
 import os
 import random
-import re
+import signal
 import sys
+from typing import Awaitable, Callable
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
+import asyncpg
 from dotenv import load_dotenv
 import twitchio
 from twitchio.ext import commands
 
 from handlers.custom_command import handle_custom_command, custom_pattern_message
+from handlers.emote_counter import EmoteCounter
 from handlers.emote_streak import EmoteStreaks
-from handlers.message_queue import MessageQueues
+from handlers.message_logger import MessageLogger
+from handlers.message_queue import MessageQueues, Priority
+from handlers.metrics import metrics
+from handlers.parsed_message import ParsedMessage
+from handlers.send_scheduler import parse_state, scheduler
 from logger import logger
 from shared import database
 from shared.apis.exceptions import SendableAPIRequestError
+from shared.database.listener import listener
 from shared.database.twitch import channels, messages, reminders, users
+from shared.database.twitch.message_context import message_context
+from shared.database.twitch.models import ChannelConfig, Reminder
 from Twitch.exceptions import ValidationError
 
 
 # TODO: join and leave methods
 class Bot(commands.Bot):
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        *,
+        load_modules: bool = True,
+        localhost: bool = False,
+        pool_init: Callable[[asyncpg.Connection], Awaitable[None]] | None = None,
+    ) -> None:
         async def prefix_callback(bot: commands.Bot, message: twitchio.Message) -> tuple[str, ...]:
             return await self.prefixes(message.channel.name)
 
@@ -32,21 +48,30 @@ class Bot(commands.Bot):
             nick=os.environ["BOT_NICK"],
             prefix=prefix_callback,
         )
-        self.loop.run_until_complete(self.__ainit__())
+        self.loop.run_until_complete(self.__ainit__(localhost, pool_init))
         self.msg_q = MessageQueues(self, self.initial_channels)
+        self.message_logger = MessageLogger(self.con_pool, self.loop)
         self.emote_streaks = EmoteStreaks(self.con_pool)
+        self.emote_counter = EmoteCounter(self.con_pool, self.loop)
         self.check(self.global_check)  # type: ignore
-
-        for filename in os.listdir(f"{os.path.realpath(os.path.dirname(__file__))}/cogs"):
-            if filename.endswith(".py"):
-                self.load_module(f"cogs.{filename[:-3]}")
-
-    async def __ainit__(self):
-        self.con_pool = await database.init_pool(self.loop)
+        # Stopping the loop lets run() close the bot cleanly when the container is stopped
+        self.loop.add_signal_handler(signal.SIGTERM, self.loop.stop)
+
+        if load_modules:
+            for filename in os.listdir(f"{os.path.realpath(os.path.dirname(__file__))}/cogs"):
+                if filename.endswith(".py"):
+                    self.load_module(f"cogs.{filename[:-3]}")
+
+    async def __ainit__(
+        self, localhost: bool, pool_init: Callable[[asyncpg.Connection], Awaitable[None]] | None
+    ) -> None:
+        self.con_pool = await database.init_pool(self.loop, localhost=localhost, init=pool_init)
+        await listener.start(self.loop, localhost=localhost)
         self.initial_channels = await channels.initial_channels(self.con_pool)
         if len(self.initial_channels) == 0:
             self.initial_channels.append(self.nick)  # type: ignore
             await channels.join_channel(self.con_pool, str(self.user_id), self.nick)  # type: ignore
+        await reminders.load_pending(self.con_pool)
 
     async def prefixes(self, channel: str) -> tuple[str, ...]:
         config = await channels.channel_config(self.con_pool, channel)
@@ -54,39 +79,71 @@ class Bot(commands.Bot):
             return (os.environ["GLOBAL_PREFIX"],)
         return config.prefixes
 
+    async def close(self) -> None:
+        await self.message_logger.close()
+        await self.emote_counter.close()
+        await super().close()
+
     async def event_ready(self) -> None:
         await self.join_channels(self.initial_channels)
         logger.debug("Logged in as %s", str(self.nick))
 
+    async def event_raw_data(self, data: str) -> None:
+        # The send limits depend on the slow mode and the bot's roles, which Twitch sends in ROOMSTATE and USERSTATE
+        for line in data.split("\r\n"):
+            state = parse_state(line)
+            if state is None:
+                continue
+            command, channel, tags = state
+            if command == "ROOMSTATE":
+                scheduler.update_room_state(channel, tags)
+            else:
+                scheduler.update_user_state(channel, tags)
+
     async def event_message(self, message: twitchio.Message) -> None:
-        assert isinstance(message.content, str)
-        message.content = re.sub(r"\s+", " ", message.content.strip()).replace("ACTION ", "")
+        with metrics.trace("event_message", message.channel.name):
+            await self._handle_message(message)
 
-        channel_config = await channels.channel_config(self.con_pool, message.channel.name)
+    async def _handle_message(self, message: twitchio.Message) -> None:
+        assert isinstance(message.content, str)
+        channel = message.channel.name
+        with metrics.span("event_message.config", channel):
+            channel_config = await channels.channel_config(self.con_pool, channel)
+            parsed = ParsedMessage(
+                message.content,
+                await self.prefixes(channel),
+                nick=self.nick,
+                reply=message.tags is not None and "reply-parent-msg-id" in message.tags,
+            )
 
         if message.echo:
             assert isinstance(self.nick, str)
-            await messages.log_message(
-                self.con_pool, channel_config.channel_id, self.nick, message.content, channel_config.currently_online
-            )
+            with metrics.span("event_message.log", channel):
+                await self.message_logger.log(
+                    channel_config.channel_id,
+                    self.nick,
+                    parsed.logged_text,
+                    channel_config.currently_online,
+                    None if self.user_id is None else str(self.user_id),
+                )
             return
 
         assert isinstance(message.author.name, str)
         if channel_config.logging:
-            await messages.log_message(
-                self.con_pool,
-                channel_config.channel_id,
-                message.author.name,
-                message.content,
-                channel_config.currently_online,
-            )
-
-        # Log the messge with the null character to make the detecting the same message easier
-        # and keeping the removed pings when a message is used in some commands,
-        # but remove it here just in case it might cause problems, mostly for commands
-        message.content = message.content.replace("\U000E0000", "")
-
-        if message.content == "":
+            # Log the messge with the null character to make the detecting the same message easier
+            # and keeping the removed pings when a message is used in some commands
+            with metrics.span("event_message.log", channel):
+                await self.message_logger.log(
+                    channel_config.channel_id,
+                    message.author.name,
+                    parsed.logged_text,
+                    channel_config.currently_online,
+                    message.author.id if isinstance(message.author, twitchio.Chatter) else None,
+                )
+            with metrics.span("event_message.emotes", channel):
+                self.emote_counter.count(channel_config.channel_id, parsed)
+
+        if len(parsed.tokens) == 0:
             return
 
         if not (isinstance(message.author, twitchio.Chatter) and message.author.id is not None):
@@ -95,42 +152,41 @@ class Bot(commands.Bot):
         if message.author.id in channel_config.banned_users:
             return
 
-        user_config = await users.user_config(self.con_pool, message.author.id)
-        if user_config.is_banned():
+        with metrics.span("event_message.context", channel):
+            context = await message_context(self.con_pool, channel, message.author.id)
+        if context.user_config.is_banned():
             return
 
-        afk_status = await reminders.afk_status(self.con_pool, channel_config.channel_id, message.author.id)
-
-        prefixes = await self.prefixes(message.channel.name)
         # # There's a 1.5% chance that the bot will trigger its command randomly
-        # if not channel_config.currently_online and not message.content.startswith(prefixes) and random.random() < 1.0 / 100:
+        # if not channel_config.currently_online and parsed.prefix is None and random.random() < 1.0 / 100:
         #     message.content = f"@{self.nick} " + message.content
 
-        # Using @ to ping the bot will trigger the bot's command
-        if message.content.startswith(f"@{self.nick}"):
-            message.content = message.content.replace("@", prefixes[0], 1)
-
-        await self.handle_commands(message)
+        await self.handle_commands(message, parsed)
 
-        if afk_status is not None:
-            msg, targets = await afk_status.formatted_message(message.author.name)
-            await self.msg_q.send_message(message.channel.name, msg, targets)
-            await reminders.set_afk_as_sent(self.con_pool, afk_status.id)
+        if context.afk_status is not None:
+            with metrics.span("event_message.afk", channel):
+                msg, targets = await context.afk_status.formatted_message(message.author.name)
+                await self.msg_q.send_message(channel, msg, targets, priority=Priority.REMINDER)
+                await reminders.set_afk_as_sent(self.con_pool, context.afk_status.id)
 
-        pattern_message = await custom_pattern_message(message, self.con_pool)
-        if pattern_message is not None:
-            await self.msg_q.send_message(message.channel.name, pattern_message)
+        with metrics.span("event_message.patterns", channel):
+            pattern_message = await custom_pattern_message(message, parsed, self.con_pool)
+            if pattern_message is not None:
+                await self.msg_q.send_message(channel, pattern_message)
 
         if channel_config.emote_streaks:
-            streak_result = await self.emote_streaks.streak_message(
-                message.channel.name, message.author.name, message.content
-            )
-            if streak_result is not None:
-                streak_message, targets = streak_result
-                await self.msg_q.send_message(message.channel.name, streak_message, targets)
-
-        rems = await reminders.sendable_not_timed_reminders(self.con_pool, message.author.id)
-        for rem in rems:
+            with metrics.span("event_message.streaks", channel):
+                streak_result = await self.emote_streaks.streak_message(channel, message.author.name, parsed)
+                if streak_result is not None:
+                    streak_message, targets = streak_result
+                    await self.msg_q.send_message(channel, streak_message, targets)
+
+        if len(context.reminders) > 0:
+            with metrics.span("event_message.reminders", channel):
+                await self._deliver_reminders(channel, channel_config, context.reminders)
+
+    async def _deliver_reminders(self, channel: str, channel_config: ChannelConfig, pending: list[Reminder]) -> None:
+        for rem in pending:
             if rem.channel_id != channel_config.channel_id:
                 # If the channel differs, check that the current channel and the origin channel both allow outside reminds
                 origin_channel_config = await channels.channel_config_from_id(self.con_pool, rem.channel_id)
@@ -144,20 +200,28 @@ class Bot(commands.Bot):
                 sender_name = "<unknown user>"
             target = [user for user in rem_users if user.id == int(rem.target_id)][0]
             msg, targets = await rem.formatted_message(sender_name, target.name)
-            await self.msg_q.send_message(message.channel.name, msg, targets)
+            await self.msg_q.send_message(channel, msg, targets, priority=Priority.REMINDER, coalesce=True)
             await reminders.set_reminder_as_sent(self.con_pool, rem.id)
 
-    async def handle_commands(self, message: twitchio.Message) -> None:
+    async def handle_commands(self, message: twitchio.Message, parsed: ParsedMessage | None = None) -> None:
         assert isinstance(message.content, str) and message.content != ""
-        # Allow a whitespace between prefix and the command name
-        if message.content.startswith(tuple(prefix + " " for prefix in await self.prefixes(message.channel.name))):
-            message.content = message.content.replace(" ", "", 1)
-        cmd_and_args = message.content.split(maxsplit=1)
-        # Make commands case insensitive
-        message.content = f"{cmd_and_args[0].lower()} {' '.join(cmd_and_args[1:])}"
-        # Allow using _ before targets
-        message.content = " ".join([word.lstrip("_") for word in message.content.split()])
-        await super().handle_commands(message)
+        channel = message.channel.name
+        with metrics.span("handle_commands", channel):
+            if parsed is None:
+                parsed = ParsedMessage(
+                    message.content,
+                    await self.prefixes(channel),
+                    reply="reply-parent-msg-id" in message.tags,
+                )
+            if parsed.command_name is None:
+                return
+            message.content = parsed.command_text
+            with metrics.span("handle_commands.context", channel):
+                context = await self.get_context(message)
+            # Custom commands are handled from the command error event and reuse the parsed message
+            context.parsed = parsed  # type: ignore
+            with metrics.span("handle_commands.invoke", channel):
+                await self.invoke(context)
 
     async def event_command_error(self, context: commands.Context, error: Exception) -> None:
         if isinstance(error, commands.CommandNotFound):
@@ -0,0 +1,31 @@
+-- migrate:up
+CREATE FUNCTION twitch.notify_channel_changed()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('channel_changed', OLD.channel_id);
+    ELSE
+        PERFORM pg_notify('channel_changed', NEW.channel_id);
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER notify_joined_channel_changed
+AFTER INSERT OR UPDATE OR DELETE ON twitch.joined_channels
+FOR EACH ROW
+EXECUTE FUNCTION twitch.notify_channel_changed();
+
+CREATE TRIGGER notify_channel_config_changed
+AFTER INSERT OR UPDATE OR DELETE ON twitch.channel_config
+FOR EACH ROW
+EXECUTE FUNCTION twitch.notify_channel_changed();
+
+
+-- migrate:down
+DROP TRIGGER notify_channel_config_changed ON twitch.channel_config;
+
+DROP TRIGGER notify_joined_channel_changed ON twitch.joined_channels;
+
+DROP FUNCTION twitch.notify_channel_changed();
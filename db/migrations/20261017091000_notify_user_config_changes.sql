@@ -0,0 +1,24 @@
+-- migrate:up
+CREATE FUNCTION twitch.notify_user_config_changed()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('user_config_changed', OLD.user_id);
+    ELSE
+        PERFORM pg_notify('user_config_changed', NEW.user_id);
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER notify_user_config_changed
+AFTER INSERT OR UPDATE OR DELETE ON twitch.user_config
+FOR EACH ROW
+EXECUTE FUNCTION twitch.notify_user_config_changed();
+
+
+-- migrate:down
+DROP TRIGGER notify_user_config_changed ON twitch.user_config;
+
+DROP FUNCTION twitch.notify_user_config_changed();
@@ -0,0 +1,48 @@
+-- migrate:up
+CREATE FUNCTION twitch.notify_afk_changed()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('pending_changed', 'afk:' || OLD.channel_id || ':' || OLD.target_id);
+    ELSE
+        PERFORM pg_notify('pending_changed', 'afk:' || NEW.channel_id || ':' || NEW.target_id);
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER notify_afk_changed
+AFTER INSERT OR UPDATE OR DELETE ON twitch.afks
+FOR EACH ROW
+EXECUTE FUNCTION twitch.notify_afk_changed();
+
+CREATE FUNCTION twitch.notify_reminder_changed()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        IF OLD.scheduled_at IS NULL THEN
+            PERFORM pg_notify('pending_changed', 'reminder:' || OLD.target_id);
+        END IF;
+    ELSIF NEW.scheduled_at IS NULL THEN
+        PERFORM pg_notify('pending_changed', 'reminder:' || NEW.target_id);
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER notify_reminder_changed
+AFTER INSERT OR UPDATE OR DELETE ON twitch.reminders
+FOR EACH ROW
+EXECUTE FUNCTION twitch.notify_reminder_changed();
+
+
+-- migrate:down
+DROP TRIGGER notify_reminder_changed ON twitch.reminders;
+
+DROP FUNCTION twitch.notify_reminder_changed();
+
+DROP TRIGGER notify_afk_changed ON twitch.afks;
+
+DROP FUNCTION twitch.notify_afk_changed();
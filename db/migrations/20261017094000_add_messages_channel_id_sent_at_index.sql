@@ -0,0 +1,6 @@
+-- migrate:up transaction:false
+CREATE INDEX CONCURRENTLY messages_channel_id_sent_at_idx ON twitch.messages (channel_id, sent_at);
+
+
+-- migrate:down transaction:false
+DROP INDEX CONCURRENTLY twitch.messages_channel_id_sent_at_idx;
@@ -0,0 +1,12 @@
+-- migrate:up
+ALTER SEQUENCE twitch.messages_id_seq AS bigint;
+
+-- Rewrites the whole table and its indexes under an exclusive lock, so it needs a maintenance window: the chat
+-- logs are spooled meanwhile, but it takes about as long as copying the message log
+ALTER TABLE twitch.messages ALTER COLUMN id TYPE bigint;
+
+
+-- migrate:down
+ALTER TABLE twitch.messages ALTER COLUMN id TYPE integer;
+
+ALTER SEQUENCE twitch.messages_id_seq AS integer;
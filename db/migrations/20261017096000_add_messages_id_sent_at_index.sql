@@ -0,0 +1,6 @@
+-- migrate:up transaction:false
+CREATE UNIQUE INDEX CONCURRENTLY messages_id_sent_at_key ON twitch.messages (id, sent_at);
+
+
+-- migrate:down transaction:false
+DROP INDEX CONCURRENTLY twitch.messages_id_sent_at_key;
@@ -0,0 +1,16 @@
+-- migrate:up
+-- Lets the partitioning migration attach the existing messages as a partition without scanning them under its
+-- lock. NOT VALID only takes the lock briefly; new messages are checked from here on, so the partitioning
+-- migration has to run before the month is over, as it does with the rest of these migrations
+DO $$
+BEGIN
+    EXECUTE format(
+        'ALTER TABLE twitch.messages ADD CONSTRAINT messages_sent_at_before_partitioning CHECK (sent_at < %L) NOT VALID',
+        (date_trunc('month', now() AT TIME ZONE 'UTC') + interval '1 month') AT TIME ZONE 'UTC'
+    );
+END;
+$$;
+
+
+-- migrate:down
+ALTER TABLE twitch.messages DROP CONSTRAINT IF EXISTS messages_sent_at_before_partitioning;
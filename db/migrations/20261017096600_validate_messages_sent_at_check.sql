@@ -0,0 +1,7 @@
+-- migrate:up
+-- Scans the messages in a transaction of its own, which doesn't block writing new messages
+ALTER TABLE twitch.messages VALIDATE CONSTRAINT messages_sent_at_before_partitioning;
+
+
+-- migrate:down
+-- The constraint is dropped by the migration that added it
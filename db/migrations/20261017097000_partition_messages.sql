@@ -0,0 +1,137 @@
+-- migrate:up
+CREATE FUNCTION twitch.create_message_partitions(months_ahead integer)
+RETURNS SETOF text AS $$
+DECLARE
+    month_start timestamp := date_trunc('month', now() AT TIME ZONE 'UTC');
+    partition_name text;
+BEGIN
+    FOR i IN 0..months_ahead LOOP
+        partition_name := 'messages_' || to_char(month_start, 'YYYY_MM');
+        IF to_regclass('twitch.' || partition_name) IS NULL THEN
+            BEGIN
+                EXECUTE format(
+                    'CREATE TABLE twitch.%I PARTITION OF twitch.messages FOR VALUES FROM (%L) TO (%L)',
+                    partition_name,
+                    month_start AT TIME ZONE 'UTC',
+                    (month_start + interval '1 month') AT TIME ZONE 'UTC'
+                );
+                RETURN NEXT partition_name;
+            EXCEPTION WHEN invalid_object_definition THEN
+                -- The month is still covered by the partition holding the messages from before partitioning
+                NULL;
+            END;
+        END IF;
+        month_start := month_start + interval '1 month';
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE FUNCTION twitch.drop_message_partitions(older_than timestamp with time zone)
+RETURNS SETOF text AS $$
+DECLARE
+    part record;
+BEGIN
+    FOR part IN
+        SELECT child.relname AS name, pg_get_expr(child.relpartbound, child.oid) AS bound
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        JOIN pg_namespace ON pg_namespace.oid = parent.relnamespace
+        WHERE pg_namespace.nspname = 'twitch' AND parent.relname = 'messages'
+    LOOP
+        IF substring(part.bound FROM 'TO \(''([^'']+)''\)')::timestamp with time zone <= older_than THEN
+            EXECUTE format('DROP TABLE twitch.%I', part.name);
+            RETURN NEXT part.name;
+        END IF;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+ALTER TABLE twitch.messages RENAME TO messages_legacy;
+
+ALTER TABLE twitch.messages_legacy ALTER COLUMN id DROP DEFAULT;
+
+ALTER TABLE twitch.messages_legacy DROP CONSTRAINT messages_pkey;
+
+ALTER INDEX twitch.messages_id_sent_at_key RENAME TO messages_legacy_pkey;
+
+ALTER TABLE twitch.messages_legacy ADD CONSTRAINT messages_legacy_pkey PRIMARY KEY USING INDEX messages_legacy_pkey;
+
+ALTER INDEX twitch.messages_channel_id_sender_sent_at_idx RENAME TO messages_legacy_channel_id_sender_sent_at_idx;
+
+ALTER INDEX twitch.messages_channel_id_sent_at_idx RENAME TO messages_legacy_channel_id_sent_at_idx;
+
+ALTER INDEX twitch.messages_search_idx RENAME TO messages_legacy_search_idx;
+
+CREATE TABLE twitch.messages (
+    id bigint DEFAULT nextval('twitch.messages_id_seq'::regclass) NOT NULL,
+    sender text NOT NULL,
+    message text NOT NULL,
+    sent_at timestamp with time zone DEFAULT CURRENT_TIMESTAMP NOT NULL,
+    channel_id text NOT NULL,
+    online boolean,
+    CONSTRAINT messages_pkey PRIMARY KEY (id, sent_at)
+) PARTITION BY RANGE (sent_at);
+
+ALTER SEQUENCE twitch.messages_id_seq OWNED BY twitch.messages.id;
+
+CREATE INDEX messages_channel_id_sender_sent_at_idx ON twitch.messages (channel_id, sender, sent_at);
+
+CREATE INDEX messages_channel_id_sent_at_idx ON twitch.messages (channel_id, sent_at);
+
+CREATE INDEX messages_search_idx ON twitch.messages USING GIN (to_tsvector('english', message));
+
+-- The existing messages stay in one partition up to the bound of the validated check constraint, which proves the
+-- partition bound so the attach doesn't scan them; monthly partitions follow it
+DO $$
+DECLARE
+    bound text;
+BEGIN
+    SELECT substring(pg_get_constraintdef(oid) FROM '''([^'']+)''') INTO bound
+    FROM pg_constraint
+    WHERE conrelid = 'twitch.messages_legacy'::regclass AND conname = 'messages_sent_at_before_partitioning';
+    EXECUTE format(
+        'ALTER TABLE twitch.messages ATTACH PARTITION twitch.messages_legacy FOR VALUES FROM (MINVALUE) TO (%L)',
+        bound
+    );
+END;
+$$;
+
+ALTER TABLE twitch.messages_legacy DROP CONSTRAINT messages_sent_at_before_partitioning;
+
+SELECT twitch.create_message_partitions(3);
+
+
+-- migrate:down
+CREATE TABLE twitch.messages_unpartitioned (
+    id bigint DEFAULT nextval('twitch.messages_id_seq'::regclass) NOT NULL,
+    sender text NOT NULL,
+    message text NOT NULL,
+    sent_at timestamp with time zone DEFAULT CURRENT_TIMESTAMP NOT NULL,
+    channel_id text NOT NULL,
+    online boolean
+);
+
+INSERT INTO twitch.messages_unpartitioned (id, sender, message, sent_at, channel_id, online)
+SELECT id, sender, message, sent_at, channel_id, online
+FROM twitch.messages;
+
+ALTER SEQUENCE twitch.messages_id_seq OWNED BY twitch.messages_unpartitioned.id;
+
+DROP TABLE twitch.messages;
+
+ALTER TABLE twitch.messages_unpartitioned RENAME TO messages;
+
+ALTER TABLE twitch.messages ADD CONSTRAINT messages_pkey PRIMARY KEY (id);
+
+CREATE UNIQUE INDEX messages_id_sent_at_key ON twitch.messages (id, sent_at);
+
+CREATE INDEX messages_channel_id_sender_sent_at_idx ON twitch.messages (channel_id, sender, sent_at);
+
+CREATE INDEX messages_channel_id_sent_at_idx ON twitch.messages (channel_id, sent_at);
+
+CREATE INDEX messages_search_idx ON twitch.messages USING GIN (to_tsvector('english', message));
+
+DROP FUNCTION twitch.drop_message_partitions(timestamp with time zone);
+
+DROP FUNCTION twitch.create_message_partitions(integer);
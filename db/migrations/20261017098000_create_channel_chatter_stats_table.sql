@@ -0,0 +1,41 @@
+-- migrate:up
+CREATE TABLE twitch.channel_chatter_stats (
+    channel_id          text NOT NULL,
+    sender              text NOT NULL,
+    message_count       bigint NOT NULL,
+    first_message_id    bigint NOT NULL,
+    first_sent_at       timestamptz NOT NULL,
+    last_message_id     bigint NOT NULL,
+    last_sent_at        timestamptz NOT NULL,
+    PRIMARY KEY (channel_id, sender)
+);
+
+CREATE INDEX channel_chatter_stats_channel_id_message_count_idx
+ON twitch.channel_chatter_stats (channel_id, message_count DESC);
+
+-- Keep new messages out until the backfill is done, the bot spools them meanwhile
+LOCK TABLE twitch.messages IN SHARE MODE;
+
+INSERT INTO twitch.channel_chatter_stats (
+    channel_id, sender, message_count, first_message_id, first_sent_at, last_message_id, last_sent_at
+)
+SELECT counts.channel_id, counts.sender, counts.message_count, firsts.id, firsts.sent_at, lasts.id, lasts.sent_at
+FROM (
+    SELECT channel_id, sender, COUNT(*) AS message_count
+    FROM twitch.messages
+    GROUP BY channel_id, sender
+) counts
+JOIN (
+    SELECT DISTINCT ON (channel_id, sender) channel_id, sender, id, sent_at
+    FROM twitch.messages
+    ORDER BY channel_id, sender, sent_at ASC, id ASC
+) firsts USING (channel_id, sender)
+JOIN (
+    SELECT DISTINCT ON (channel_id, sender) channel_id, sender, id, sent_at
+    FROM twitch.messages
+    ORDER BY channel_id, sender, sent_at DESC, id DESC
+) lasts USING (channel_id, sender);
+
+
+-- migrate:down
+DROP TABLE twitch.channel_chatter_stats;
@@ -0,0 +1,12 @@
+-- migrate:up
+CREATE TABLE twitch.emote_usage (
+    channel_id      text NOT NULL,
+    emote           text NOT NULL,
+    day             date NOT NULL,
+    count           bigint NOT NULL,
+    PRIMARY KEY (channel_id, emote, day)
+);
+
+
+-- migrate:down
+DROP TABLE twitch.emote_usage;
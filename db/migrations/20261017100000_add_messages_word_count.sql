@@ -0,0 +1,13 @@
+-- migrate:up
+-- Adding a stored column rewrites every partition, so the index is built in the same pass instead of concurrently
+ALTER TABLE twitch.messages
+ADD COLUMN word_count integer GENERATED ALWAYS AS (ARRAY_LENGTH(STRING_TO_ARRAY(message, ' '), 1)) STORED;
+
+CREATE INDEX messages_channel_id_word_count_idx ON twitch.messages (channel_id, word_count);
+
+
+-- migrate:down
+DROP INDEX twitch.messages_channel_id_word_count_idx;
+
+ALTER TABLE twitch.messages
+DROP COLUMN word_count;
@@ -0,0 +1,21 @@
+-- migrate:up
+CREATE EXTENSION IF NOT EXISTS btree_gin WITH SCHEMA public;
+
+-- Adding a stored column rewrites every partition, so the index is built in the same pass instead of concurrently
+ALTER TABLE twitch.messages
+ADD COLUMN tsv tsvector GENERATED ALWAYS AS (to_tsvector('english', message)) STORED;
+
+CREATE INDEX messages_channel_id_tsv_idx ON twitch.messages USING gin (channel_id, tsv);
+
+DROP INDEX twitch.messages_search_idx;
+
+
+-- migrate:down
+CREATE INDEX messages_search_idx ON twitch.messages USING gin (to_tsvector('english', message));
+
+DROP INDEX twitch.messages_channel_id_tsv_idx;
+
+ALTER TABLE twitch.messages
+DROP COLUMN tsv;
+
+DROP EXTENSION btree_gin;
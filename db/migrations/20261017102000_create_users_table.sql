@@ -0,0 +1,151 @@
+-- migrate:up
+-- A user is identified by its Twitch id; the login is what chat shows and changes when the user is renamed. The
+-- Twitch id of a user only known from the old chat logs is filled in once it chats again under that login.
+CREATE TABLE twitch.users (
+    id          serial PRIMARY KEY,
+    twitch_id   text UNIQUE,
+    login       text NOT NULL UNIQUE
+);
+
+-- Keep new messages out until they are copied over, the bot spools them meanwhile
+LOCK TABLE twitch.messages IN ACCESS EXCLUSIVE MODE;
+
+INSERT INTO twitch.users (login)
+SELECT sender FROM twitch.messages
+UNION
+SELECT username FROM twitch.watchtime
+ORDER BY 1;
+
+-- Updating every row and dropping the login column would leave the old row versions and the dropped column in
+-- the tables until a VACUUM FULL, so the tables are rebuilt instead. The partitions are detached, the emptied
+-- parent gets the new column and every partition is created again and filled from its old table. The indexes are
+-- built once the rows are in, which is much faster than keeping them up to date while copying.
+DROP INDEX twitch.messages_channel_id_sender_sent_at_idx;
+DROP INDEX twitch.messages_channel_id_sent_at_idx;
+DROP INDEX twitch.messages_channel_id_tsv_idx;
+DROP INDEX twitch.messages_channel_id_word_count_idx;
+ALTER TABLE twitch.messages DROP CONSTRAINT messages_pkey;
+
+CREATE TEMPORARY TABLE message_partitions ON COMMIT DROP AS
+SELECT child.relname AS name, pg_get_expr(child.relpartbound, child.oid) AS bound
+FROM pg_inherits
+JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+JOIN pg_namespace ON pg_namespace.oid = parent.relnamespace
+WHERE pg_namespace.nspname = 'twitch' AND parent.relname = 'messages';
+
+DO $$
+DECLARE
+    part record;
+BEGIN
+    FOR part IN SELECT name FROM message_partitions LOOP
+        EXECUTE format('ALTER TABLE twitch.messages DETACH PARTITION twitch.%I', part.name);
+        EXECUTE format('ALTER TABLE twitch.%I RENAME TO %I', part.name, part.name || '_by_login');
+    END LOOP;
+END;
+$$;
+
+ALTER TABLE twitch.messages DROP COLUMN sender;
+ALTER TABLE twitch.messages ADD COLUMN sender_id integer NOT NULL;
+
+-- The foreign keys are added to the partitions without checking the rows, since every sender has just been looked
+-- up in twitch.users; a later migration validates them and adds the one of the parent table
+DO $$
+DECLARE
+    part record;
+BEGIN
+    FOR part IN SELECT name, bound FROM message_partitions LOOP
+        EXECUTE format('CREATE TABLE twitch.%I PARTITION OF twitch.messages %s', part.name, part.bound);
+        EXECUTE format(
+            'INSERT INTO twitch.%I (id, message, sent_at, channel_id, online, sender_id)
+            SELECT m.id, m.message, m.sent_at, m.channel_id, m.online, u.id
+            FROM twitch.%I m
+            JOIN twitch.users u ON u.login = m.sender',
+            part.name,
+            part.name || '_by_login'
+        );
+        EXECUTE format('DROP TABLE twitch.%I', part.name || '_by_login');
+        EXECUTE format(
+            'ALTER TABLE twitch.%I ADD CONSTRAINT %I FOREIGN KEY (sender_id) REFERENCES twitch.users (id) NOT VALID',
+            part.name,
+            part.name || '_sender_id_fkey'
+        );
+    END LOOP;
+END;
+$$;
+
+ALTER TABLE twitch.messages ADD CONSTRAINT messages_pkey PRIMARY KEY (id, sent_at);
+CREATE INDEX messages_channel_id_sender_id_sent_at_idx ON twitch.messages (channel_id, sender_id, sent_at);
+CREATE INDEX messages_channel_id_sent_at_idx ON twitch.messages (channel_id, sent_at);
+CREATE INDEX messages_channel_id_tsv_idx ON twitch.messages USING gin (channel_id, tsv);
+CREATE INDEX messages_channel_id_word_count_idx ON twitch.messages (channel_id, word_count);
+
+CREATE TABLE twitch.channel_chatter_stats_by_id (
+    channel_id          text NOT NULL,
+    message_count       bigint NOT NULL,
+    first_message_id    bigint NOT NULL,
+    first_sent_at       timestamptz NOT NULL,
+    last_message_id     bigint NOT NULL,
+    last_sent_at        timestamptz NOT NULL,
+    sender_id           integer NOT NULL
+);
+INSERT INTO twitch.channel_chatter_stats_by_id (
+    channel_id, message_count, first_message_id, first_sent_at, last_message_id, last_sent_at, sender_id
+)
+SELECT s.channel_id, s.message_count, s.first_message_id, s.first_sent_at, s.last_message_id, s.last_sent_at, u.id
+FROM twitch.channel_chatter_stats s
+JOIN twitch.users u ON u.login = s.sender;
+DROP TABLE twitch.channel_chatter_stats;
+ALTER TABLE twitch.channel_chatter_stats_by_id RENAME TO channel_chatter_stats;
+ALTER TABLE twitch.channel_chatter_stats ADD PRIMARY KEY (channel_id, sender_id);
+CREATE INDEX channel_chatter_stats_channel_id_message_count_idx
+ON twitch.channel_chatter_stats (channel_id, message_count DESC);
+
+CREATE TABLE twitch.watchtime_by_id (
+    online_time int NOT NULL DEFAULT 0,
+    total_time  int NOT NULL DEFAULT 0,
+    channel_id  text NOT NULL,
+    user_id     integer NOT NULL
+);
+INSERT INTO twitch.watchtime_by_id (online_time, total_time, channel_id, user_id)
+SELECT w.online_time, w.total_time, w.channel_id, u.id
+FROM twitch.watchtime w
+JOIN twitch.users u ON u.login = w.username;
+DROP TABLE twitch.watchtime;
+ALTER TABLE twitch.watchtime_by_id RENAME TO watchtime;
+ALTER TABLE twitch.watchtime ADD PRIMARY KEY (channel_id, user_id);
+ALTER TABLE twitch.watchtime
+ADD CONSTRAINT watchtime_user_id_fkey FOREIGN KEY (user_id) REFERENCES twitch.users (id) NOT VALID;
+
+
+-- migrate:down
+LOCK TABLE twitch.messages IN SHARE MODE;
+
+ALTER TABLE twitch.watchtime ADD COLUMN username text;
+UPDATE twitch.watchtime w
+SET username = u.login
+FROM twitch.users u
+WHERE u.id = w.user_id;
+ALTER TABLE twitch.watchtime ALTER COLUMN username SET NOT NULL;
+ALTER TABLE twitch.watchtime DROP COLUMN user_id;
+ALTER TABLE twitch.watchtime ADD PRIMARY KEY (channel_id, username);
+
+ALTER TABLE twitch.channel_chatter_stats ADD COLUMN sender text;
+UPDATE twitch.channel_chatter_stats s
+SET sender = u.login
+FROM twitch.users u
+WHERE u.id = s.sender_id;
+ALTER TABLE twitch.channel_chatter_stats ALTER COLUMN sender SET NOT NULL;
+ALTER TABLE twitch.channel_chatter_stats DROP COLUMN sender_id;
+ALTER TABLE twitch.channel_chatter_stats ADD PRIMARY KEY (channel_id, sender);
+
+ALTER TABLE twitch.messages ADD COLUMN sender text;
+UPDATE twitch.messages m
+SET sender = u.login
+FROM twitch.users u
+WHERE u.id = m.sender_id;
+ALTER TABLE twitch.messages ALTER COLUMN sender SET NOT NULL;
+ALTER TABLE twitch.messages DROP COLUMN sender_id;
+CREATE INDEX messages_channel_id_sender_sent_at_idx ON twitch.messages (channel_id, sender, sent_at);
+
+DROP TABLE twitch.users;
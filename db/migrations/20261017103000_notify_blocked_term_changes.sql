@@ -0,0 +1,24 @@
+-- migrate:up
+CREATE FUNCTION twitch.notify_blocked_term_changed()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('blocked_term_changed', OLD.id::text);
+    ELSE
+        PERFORM pg_notify('blocked_term_changed', NEW.id::text);
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER notify_blocked_term_changed
+AFTER INSERT OR UPDATE OR DELETE ON twitch.blocked_terms
+FOR EACH ROW
+EXECUTE FUNCTION twitch.notify_blocked_term_changed();
+
+
+-- migrate:down
+DROP TRIGGER notify_blocked_term_changed ON twitch.blocked_terms;
+
+DROP FUNCTION twitch.notify_blocked_term_changed();
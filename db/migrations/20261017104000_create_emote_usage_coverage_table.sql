@@ -0,0 +1,11 @@
+-- migrate:up
+-- The time from which the emote usage of a channel has every use of its emotes; '-infinity' once the chat logs
+-- from before it have been backfilled
+CREATE TABLE twitch.emote_usage_coverage (
+    channel_id      text PRIMARY KEY,
+    counted_from    timestamp with time zone NOT NULL
+);
+
+
+-- migrate:down
+DROP TABLE twitch.emote_usage_coverage;
@@ -0,0 +1,81 @@
+-- migrate:up
+-- The chatter stats count every logged message, so the messages of a dropped partition are subtracted from them
+-- and the first messages that were in it are moved to the first ones left; a chatter's last message is never in
+-- a dropped partition while newer ones are left, since every older partition is dropped too
+CREATE OR REPLACE FUNCTION twitch.drop_message_partitions(older_than timestamp with time zone)
+RETURNS SETOF text AS $$
+DECLARE
+    part record;
+    upper_bound timestamp with time zone;
+BEGIN
+    FOR part IN
+        SELECT child.relname AS name, pg_get_expr(child.relpartbound, child.oid) AS bound
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        JOIN pg_namespace ON pg_namespace.oid = parent.relnamespace
+        WHERE pg_namespace.nspname = 'twitch' AND parent.relname = 'messages'
+    LOOP
+        upper_bound := substring(part.bound FROM 'TO \(''([^'']+)''\)')::timestamp with time zone;
+        IF upper_bound <= older_than THEN
+            EXECUTE format(
+                'UPDATE twitch.channel_chatter_stats s
+                SET message_count = s.message_count - d.message_count
+                FROM (
+                    SELECT channel_id, sender_id, COUNT(*) AS message_count
+                    FROM twitch.%I
+                    GROUP BY channel_id, sender_id
+                ) d
+                WHERE s.channel_id = d.channel_id AND s.sender_id = d.sender_id',
+                part.name
+            );
+            -- Without a message left in the database the first message stays the archived one, if it is archived
+            EXECUTE format(
+                'UPDATE twitch.channel_chatter_stats s
+                SET (first_message_id, first_sent_at) = (
+                    SELECT m.id, m.sent_at
+                    FROM twitch.messages m
+                    WHERE m.channel_id = s.channel_id AND m.sender_id = s.sender_id AND m.sent_at >= %2$L
+                    ORDER BY m.sent_at
+                    LIMIT 1
+                )
+                FROM twitch.%1$I d
+                WHERE d.id = s.first_message_id AND d.sent_at = s.first_sent_at
+                    AND EXISTS (
+                        SELECT 1
+                        FROM twitch.messages m
+                        WHERE m.channel_id = s.channel_id AND m.sender_id = s.sender_id AND m.sent_at >= %2$L
+                    )',
+                part.name,
+                upper_bound
+            );
+            DELETE FROM twitch.channel_chatter_stats WHERE message_count <= 0;
+            EXECUTE format('DROP TABLE twitch.%I', part.name);
+            RETURN NEXT part.name;
+        END IF;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- migrate:down
+CREATE OR REPLACE FUNCTION twitch.drop_message_partitions(older_than timestamp with time zone)
+RETURNS SETOF text AS $$
+DECLARE
+    part record;
+BEGIN
+    FOR part IN
+        SELECT child.relname AS name, pg_get_expr(child.relpartbound, child.oid) AS bound
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        JOIN pg_namespace ON pg_namespace.oid = parent.relnamespace
+        WHERE pg_namespace.nspname = 'twitch' AND parent.relname = 'messages'
+    LOOP
+        IF substring(part.bound FROM 'TO \(''([^'']+)''\)')::timestamp with time zone <= older_than THEN
+            EXECUTE format('DROP TABLE twitch.%I', part.name);
+            RETURN NEXT part.name;
+        END IF;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,25 @@
+-- migrate:up
+-- Validating a foreign key doesn't keep the bot from logging messages, unlike adding a checked one to the tables
+-- rebuilt when the users table was created
+DO $$
+DECLARE
+    foreign_key record;
+BEGIN
+    FOR foreign_key IN
+        SELECT conrelid::regclass AS table_name, conname AS name
+        FROM pg_constraint
+        WHERE contype = 'f' AND confrelid = 'twitch.users'::regclass AND NOT convalidated
+    LOOP
+        EXECUTE format('ALTER TABLE %s VALIDATE CONSTRAINT %I', foreign_key.table_name, foreign_key.name);
+    END LOOP;
+END;
+$$;
+
+-- The validated foreign keys of the partitions are attached to it instead of being checked again; only the
+-- partitions created since the rebuild are checked
+ALTER TABLE twitch.messages
+ADD CONSTRAINT messages_sender_id_fkey FOREIGN KEY (sender_id) REFERENCES twitch.users (id);
+
+
+-- migrate:down
+ALTER TABLE twitch.messages DROP CONSTRAINT messages_sender_id_fkey;
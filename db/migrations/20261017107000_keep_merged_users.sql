@@ -0,0 +1,14 @@
+-- migrate:up
+-- A user merged into another is kept under a placeholder login, since the message archive still refers to its key
+ALTER TABLE twitch.users
+ADD COLUMN merged_into integer REFERENCES twitch.users (id);
+
+CREATE INDEX users_merged_into_idx ON twitch.users (merged_into) WHERE merged_into IS NOT NULL;
+
+
+-- migrate:down
+DROP INDEX twitch.users_merged_into_idx;
+
+DELETE FROM twitch.users WHERE merged_into IS NOT NULL;
+
+ALTER TABLE twitch.users DROP COLUMN merged_into;
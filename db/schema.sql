@@ -16,6 +16,20 @@ SET row_security = off;
 CREATE SCHEMA twitch;
 
 
+--
+-- Name: btree_gin; Type: EXTENSION; Schema: -; Owner: -
+--
+
+CREATE EXTENSION IF NOT EXISTS btree_gin WITH SCHEMA public;
+
+
+--
+-- Name: EXTENSION btree_gin; Type: COMMENT; Schema: -; Owner: -
+--
+
+COMMENT ON EXTENSION btree_gin IS 'support for indexing common datatypes in GIN';
+
+
 --
 -- Name: afk_type; Type: TYPE; Schema: twitch; Owner: -
 --
@@ -73,6 +87,39 @@ END;
 $$;
 
 
+--
+-- Name: create_message_partitions(integer); Type: FUNCTION; Schema: twitch; Owner: -
+--
+
+CREATE FUNCTION twitch.create_message_partitions(months_ahead integer) RETURNS SETOF text
+    LANGUAGE plpgsql
+    AS $$
+DECLARE
+    month_start timestamp := date_trunc('month', now() AT TIME ZONE 'UTC');
+    partition_name text;
+BEGIN
+    FOR i IN 0..months_ahead LOOP
+        partition_name := 'messages_' || to_char(month_start, 'YYYY_MM');
+        IF to_regclass('twitch.' || partition_name) IS NULL THEN
+            BEGIN
+                EXECUTE format(
+                    'CREATE TABLE twitch.%I PARTITION OF twitch.messages FOR VALUES FROM (%L) TO (%L)',
+                    partition_name,
+                    month_start AT TIME ZONE 'UTC',
+                    (month_start + interval '1 month') AT TIME ZONE 'UTC'
+                );
+                RETURN NEXT partition_name;
+            EXCEPTION WHEN invalid_object_definition THEN
+                -- The month is still covered by the partition holding the messages from before partitioning
+                NULL;
+            END;
+        END IF;
+        month_start := month_start + interval '1 month';
+    END LOOP;
+END;
+$$;
+
+
 --
 -- Name: delete_disposable_reminder(); Type: FUNCTION; Schema: twitch; Owner: -
 --
@@ -108,6 +155,164 @@ END;
 $$;
 
 
+--
+-- Name: drop_message_partitions(timestamp with time zone); Type: FUNCTION; Schema: twitch; Owner: -
+--
+
+CREATE FUNCTION twitch.drop_message_partitions(older_than timestamp with time zone) RETURNS SETOF text
+    LANGUAGE plpgsql
+    AS $$
+DECLARE
+    part record;
+    upper_bound timestamp with time zone;
+BEGIN
+    FOR part IN
+        SELECT child.relname AS name, pg_get_expr(child.relpartbound, child.oid) AS bound
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        JOIN pg_namespace ON pg_namespace.oid = parent.relnamespace
+        WHERE pg_namespace.nspname = 'twitch' AND parent.relname = 'messages'
+    LOOP
+        upper_bound := substring(part.bound FROM 'TO \(''([^'']+)''\)')::timestamp with time zone;
+        IF upper_bound <= older_than THEN
+            EXECUTE format(
+                'UPDATE twitch.channel_chatter_stats s
+                SET message_count = s.message_count - d.message_count
+                FROM (
+                    SELECT channel_id, sender_id, COUNT(*) AS message_count
+                    FROM twitch.%I
+                    GROUP BY channel_id, sender_id
+                ) d
+                WHERE s.channel_id = d.channel_id AND s.sender_id = d.sender_id',
+                part.name
+            );
+            -- Without a message left in the database the first message stays the archived one, if it is archived
+            EXECUTE format(
+                'UPDATE twitch.channel_chatter_stats s
+                SET (first_message_id, first_sent_at) = (
+                    SELECT m.id, m.sent_at
+                    FROM twitch.messages m
+                    WHERE m.channel_id = s.channel_id AND m.sender_id = s.sender_id AND m.sent_at >= %2$L
+                    ORDER BY m.sent_at
+                    LIMIT 1
+                )
+                FROM twitch.%1$I d
+                WHERE d.id = s.first_message_id AND d.sent_at = s.first_sent_at
+                    AND EXISTS (
+                        SELECT 1
+                        FROM twitch.messages m
+                        WHERE m.channel_id = s.channel_id AND m.sender_id = s.sender_id AND m.sent_at >= %2$L
+                    )',
+                part.name,
+                upper_bound
+            );
+            DELETE FROM twitch.channel_chatter_stats WHERE message_count <= 0;
+            EXECUTE format('DROP TABLE twitch.%I', part.name);
+            RETURN NEXT part.name;
+        END IF;
+    END LOOP;
+END;
+$$;
+
+
+--
+-- Name: notify_afk_changed(); Type: FUNCTION; Schema: twitch; Owner: -
+--
+
+CREATE FUNCTION twitch.notify_afk_changed() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('pending_changed', 'afk:' || OLD.channel_id || ':' || OLD.target_id);
+    ELSE
+        PERFORM pg_notify('pending_changed', 'afk:' || NEW.channel_id || ':' || NEW.target_id);
+    END IF;
+
+    RETURN NULL;
+END;
+$$;
+
+
+--
+-- Name: notify_blocked_term_changed(); Type: FUNCTION; Schema: twitch; Owner: -
+--
+
+CREATE FUNCTION twitch.notify_blocked_term_changed() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('blocked_term_changed', OLD.id::text);
+    ELSE
+        PERFORM pg_notify('blocked_term_changed', NEW.id::text);
+    END IF;
+
+    RETURN NULL;
+END;
+$$;
+
+
+--
+-- Name: notify_channel_changed(); Type: FUNCTION; Schema: twitch; Owner: -
+--
+
+CREATE FUNCTION twitch.notify_channel_changed() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('channel_changed', OLD.channel_id);
+    ELSE
+        PERFORM pg_notify('channel_changed', NEW.channel_id);
+    END IF;
+
+    RETURN NULL;
+END;
+$$;
+
+
+--
+-- Name: notify_reminder_changed(); Type: FUNCTION; Schema: twitch; Owner: -
+--
+
+CREATE FUNCTION twitch.notify_reminder_changed() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        IF OLD.scheduled_at IS NULL THEN
+            PERFORM pg_notify('pending_changed', 'reminder:' || OLD.target_id);
+        END IF;
+    ELSIF NEW.scheduled_at IS NULL THEN
+        PERFORM pg_notify('pending_changed', 'reminder:' || NEW.target_id);
+    END IF;
+
+    RETURN NULL;
+END;
+$$;
+
+
+--
+-- Name: notify_user_config_changed(); Type: FUNCTION; Schema: twitch; Owner: -
+--
+
+CREATE FUNCTION twitch.notify_user_config_changed() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('user_config_changed', OLD.user_id);
+    ELSE
+        PERFORM pg_notify('user_config_changed', NEW.user_id);
+    END IF;
+
+    RETURN NULL;
+END;
+$$;
+
+
 --
 -- Name: remove_counter(); Type: FUNCTION; Schema: twitch; Owner: -
 --
@@ -206,6 +411,21 @@ CREATE SEQUENCE twitch.blocked_terms_id_seq
 ALTER SEQUENCE twitch.blocked_terms_id_seq OWNED BY twitch.blocked_terms.id;
 
 
+--
+-- Name: channel_chatter_stats; Type: TABLE; Schema: twitch; Owner: -
+--
+
+CREATE TABLE twitch.channel_chatter_stats (
+    channel_id text NOT NULL,
+    message_count bigint NOT NULL,
+    first_message_id bigint NOT NULL,
+    first_sent_at timestamp with time zone NOT NULL,
+    last_message_id bigint NOT NULL,
+    last_sent_at timestamp with time zone NOT NULL,
+    sender_id integer NOT NULL
+);
+
+
 --
 -- Name: channel_config; Type: TABLE; Schema: twitch; Owner: -
 --
@@ -299,6 +519,28 @@ CREATE TABLE twitch.custom_patterns (
 );
 
 
+--
+-- Name: emote_usage; Type: TABLE; Schema: twitch; Owner: -
+--
+
+CREATE TABLE twitch.emote_usage (
+    channel_id text NOT NULL,
+    emote text NOT NULL,
+    day date NOT NULL,
+    count bigint NOT NULL
+);
+
+
+--
+-- Name: emote_usage_coverage; Type: TABLE; Schema: twitch; Owner: -
+--
+
+CREATE TABLE twitch.emote_usage_coverage (
+    channel_id text NOT NULL,
+    counted_from timestamp with time zone NOT NULL
+);
+
+
 --
 -- Name: fights; Type: TABLE; Schema: twitch; Owner: -
 --
@@ -394,12 +636,63 @@ CREATE TABLE twitch.locations (
 --
 
 CREATE TABLE twitch.messages (
-    id integer NOT NULL,
-    sender text NOT NULL,
+    id bigint NOT NULL,
+    message text NOT NULL,
+    sent_at timestamp with time zone DEFAULT CURRENT_TIMESTAMP NOT NULL,
+    channel_id text NOT NULL,
+    online boolean,
+    word_count integer GENERATED ALWAYS AS (array_length(string_to_array(message, ' '::text), 1)) STORED,
+    tsv tsvector GENERATED ALWAYS AS (to_tsvector('english'::regconfig, message)) STORED,
+    sender_id integer NOT NULL
+)
+PARTITION BY RANGE (sent_at);
+
+
+--
+-- Name: messages_2026_11; Type: TABLE; Schema: twitch; Owner: -
+--
+
+CREATE TABLE twitch.messages_2026_11 (
+    id bigint DEFAULT nextval('twitch.messages_id_seq'::regclass) NOT NULL,
+    message text NOT NULL,
+    sent_at timestamp with time zone DEFAULT CURRENT_TIMESTAMP NOT NULL,
+    channel_id text NOT NULL,
+    online boolean,
+    word_count integer GENERATED ALWAYS AS (array_length(string_to_array(message, ' '::text), 1)) STORED,
+    tsv tsvector GENERATED ALWAYS AS (to_tsvector('english'::regconfig, message)) STORED,
+    sender_id integer NOT NULL
+);
+
+
+--
+-- Name: messages_2026_12; Type: TABLE; Schema: twitch; Owner: -
+--
+
+CREATE TABLE twitch.messages_2026_12 (
+    id bigint DEFAULT nextval('twitch.messages_id_seq'::regclass) NOT NULL,
+    message text NOT NULL,
+    sent_at timestamp with time zone DEFAULT CURRENT_TIMESTAMP NOT NULL,
+    channel_id text NOT NULL,
+    online boolean,
+    word_count integer GENERATED ALWAYS AS (array_length(string_to_array(message, ' '::text), 1)) STORED,
+    tsv tsvector GENERATED ALWAYS AS (to_tsvector('english'::regconfig, message)) STORED,
+    sender_id integer NOT NULL
+);
+
+
+--
+-- Name: messages_2027_01; Type: TABLE; Schema: twitch; Owner: -
+--
+
+CREATE TABLE twitch.messages_2027_01 (
+    id bigint DEFAULT nextval('twitch.messages_id_seq'::regclass) NOT NULL,
     message text NOT NULL,
     sent_at timestamp with time zone DEFAULT CURRENT_TIMESTAMP NOT NULL,
     channel_id text NOT NULL,
-    online boolean
+    online boolean,
+    word_count integer GENERATED ALWAYS AS (array_length(string_to_array(message, ' '::text), 1)) STORED,
+    tsv tsvector GENERATED ALWAYS AS (to_tsvector('english'::regconfig, message)) STORED,
+    sender_id integer NOT NULL
 );
 
 
@@ -408,7 +701,6 @@ CREATE TABLE twitch.messages (
 --
 
 CREATE SEQUENCE twitch.messages_id_seq
-    AS integer
     START WITH 1
     INCREMENT BY 1
     NO MINVALUE
@@ -423,6 +715,22 @@ CREATE SEQUENCE twitch.messages_id_seq
 ALTER SEQUENCE twitch.messages_id_seq OWNED BY twitch.messages.id;
 
 
+--
+-- Name: messages_legacy; Type: TABLE; Schema: twitch; Owner: -
+--
+
+CREATE TABLE twitch.messages_legacy (
+    id bigint NOT NULL,
+    message text NOT NULL,
+    sent_at timestamp with time zone DEFAULT CURRENT_TIMESTAMP NOT NULL,
+    channel_id text NOT NULL,
+    online boolean,
+    word_count integer GENERATED ALWAYS AS (array_length(string_to_array(message, ' '::text), 1)) STORED,
+    tsv tsvector GENERATED ALWAYS AS (to_tsvector('english'::regconfig, message)) STORED,
+    sender_id integer NOT NULL
+);
+
+
 --
 -- Name: old_fish; Type: TABLE; Schema: twitch; Owner: -
 --
@@ -516,15 +824,47 @@ CREATE TABLE twitch.user_config (
 );
 
 
+--
+-- Name: users; Type: TABLE; Schema: twitch; Owner: -
+--
+
+CREATE TABLE twitch.users (
+    id integer NOT NULL,
+    twitch_id text,
+    login text NOT NULL,
+    merged_into integer
+);
+
+
+--
+-- Name: users_id_seq; Type: SEQUENCE; Schema: twitch; Owner: -
+--
+
+CREATE SEQUENCE twitch.users_id_seq
+    AS integer
+    START WITH 1
+    INCREMENT BY 1
+    NO MINVALUE
+    NO MAXVALUE
+    CACHE 1;
+
+
+--
+-- Name: users_id_seq; Type: SEQUENCE OWNED BY; Schema: twitch; Owner: -
+--
+
+ALTER SEQUENCE twitch.users_id_seq OWNED BY twitch.users.id;
+
+
 --
 -- Name: watchtime; Type: TABLE; Schema: twitch; Owner: -
 --
 
 CREATE TABLE twitch.watchtime (
-    username text NOT NULL,
     online_time integer DEFAULT 0 NOT NULL,
     total_time integer DEFAULT 0 NOT NULL,
-    channel_id text NOT NULL
+    channel_id text NOT NULL,
+    user_id integer NOT NULL
 );
 
 
@@ -539,6 +879,34 @@ CREATE TABLE twitch.yt_upload_notifications (
 );
 
 
+--
+-- Name: messages_2026_11; Type: TABLE ATTACH; Schema: twitch; Owner: -
+--
+
+ALTER TABLE ONLY twitch.messages ATTACH PARTITION twitch.messages_2026_11 FOR VALUES FROM ('2026-11-01 00:00:00+00') TO ('2026-12-01 00:00:00+00');
+
+
+--
+-- Name: messages_2026_12; Type: TABLE ATTACH; Schema: twitch; Owner: -
+--
+
+ALTER TABLE ONLY twitch.messages ATTACH PARTITION twitch.messages_2026_12 FOR VALUES FROM ('2026-12-01 00:00:00+00') TO ('2027-01-01 00:00:00+00');
+
+
+--
+-- Name: messages_2027_01; Type: TABLE ATTACH; Schema: twitch; Owner: -
+--
+
+ALTER TABLE ONLY twitch.messages ATTACH PARTITION twitch.messages_2027_01 FOR VALUES FROM ('2027-01-01 00:00:00+00') TO ('2027-02-01 00:00:00+00');
+
+
+--
+-- Name: messages_legacy; Type: TABLE ATTACH; Schema: twitch; Owner: -
+--
+
+ALTER TABLE ONLY twitch.messages ATTACH PARTITION twitch.messages_legacy FOR VALUES FROM (MINVALUE) TO ('2026-11-01 00:00:00+00');
+
+
 --
 -- Name: afks id; Type: DEFAULT; Schema: twitch; Owner: -
 --
@@ -581,6 +949,13 @@ ALTER TABLE ONLY twitch.messages ALTER COLUMN id SET DEFAULT nextval('twitch.mes
 ALTER TABLE ONLY twitch.reminders ALTER COLUMN id SET DEFAULT nextval('twitch.reminders_id_seq'::regclass);
 
 
+--
+-- Name: users id; Type: DEFAULT; Schema: twitch; Owner: -
+--
+
+ALTER TABLE ONLY twitch.users ALTER COLUMN id SET DEFAULT nextval('twitch.users_id_seq'::regclass);
+
+
 --
 -- Name: schema_migrations schema_migrations_pkey; Type: CONSTRAINT; Schema: public; Owner: -
 --
@@ -605,6 +980,14 @@ ALTER TABLE ONLY twitch.blocked_terms
     ADD CONSTRAINT blocked_terms_pkey PRIMARY KEY (id);
 
 
+--
+-- Name: channel_chatter_stats channel_chatter_stats_pkey; Type: CONSTRAINT; Schema: twitch; Owner: -
+--
+
+ALTER TABLE ONLY twitch.channel_chatter_stats
+    ADD CONSTRAINT channel_chatter_stats_pkey PRIMARY KEY (channel_id, sender_id);
+
+
 --
 -- Name: channel_config channel_config_pkey; Type: CONSTRAINT; Schema: twitch; Owner: -
 --
@@ -645,6 +1028,22 @@ ALTER TABLE ONLY twitch.custom_patterns
     ADD CONSTRAINT custom_patterns_pkey PRIMARY KEY (channel_id, name);
 
 
+--
+-- Name: emote_usage emote_usage_pkey; Type: CONSTRAINT; Schema: twitch; Owner: -
+--
+
+ALTER TABLE ONLY twitch.emote_usage
+    ADD CONSTRAINT emote_usage_pkey PRIMARY KEY (channel_id, emote, day);
+
+
+--
+-- Name: emote_usage_coverage emote_usage_coverage_pkey; Type: CONSTRAINT; Schema: twitch; Owner: -
+--
+
+ALTER TABLE ONLY twitch.emote_usage_coverage
+    ADD CONSTRAINT emote_usage_coverage_pkey PRIMARY KEY (channel_id);
+
+
 --
 -- Name: fights fights_pkey; Type: CONSTRAINT; Schema: twitch; Owner: -
 --
@@ -714,7 +1113,39 @@ ALTER TABLE ONLY twitch.locations
 --
 
 ALTER TABLE ONLY twitch.messages
-    ADD CONSTRAINT messages_pkey PRIMARY KEY (id);
+    ADD CONSTRAINT messages_pkey PRIMARY KEY (id, sent_at);
+
+
+--
+-- Name: messages_2026_11 messages_2026_11_pkey; Type: CONSTRAINT; Schema: twitch; Owner: -
+--
+
+ALTER TABLE ONLY twitch.messages_2026_11
+    ADD CONSTRAINT messages_2026_11_pkey PRIMARY KEY (id, sent_at);
+
+
+--
+-- Name: messages_2026_12 messages_2026_12_pkey; Type: CONSTRAINT; Schema: twitch; Owner: -
+--
+
+ALTER TABLE ONLY twitch.messages_2026_12
+    ADD CONSTRAINT messages_2026_12_pkey PRIMARY KEY (id, sent_at);
+
+
+--
+-- Name: messages_2027_01 messages_2027_01_pkey; Type: CONSTRAINT; Schema: twitch; Owner: -
+--
+
+ALTER TABLE ONLY twitch.messages_2027_01
+    ADD CONSTRAINT messages_2027_01_pkey PRIMARY KEY (id, sent_at);
+
+
+--
+-- Name: messages_legacy messages_legacy_pkey; Type: CONSTRAINT; Schema: twitch; Owner: -
+--
+
+ALTER TABLE ONLY twitch.messages_legacy
+    ADD CONSTRAINT messages_legacy_pkey PRIMARY KEY (id, sent_at);
 
 
 --
@@ -757,12 +1188,36 @@ ALTER TABLE ONLY twitch.user_config
     ADD CONSTRAINT user_config_pkey PRIMARY KEY (user_id);
 
 
+--
+-- Name: users users_login_key; Type: CONSTRAINT; Schema: twitch; Owner: -
+--
+
+ALTER TABLE ONLY twitch.users
+    ADD CONSTRAINT users_login_key UNIQUE (login);
+
+
+--
+-- Name: users users_pkey; Type: CONSTRAINT; Schema: twitch; Owner: -
+--
+
+ALTER TABLE ONLY twitch.users
+    ADD CONSTRAINT users_pkey PRIMARY KEY (id);
+
+
+--
+-- Name: users users_twitch_id_key; Type: CONSTRAINT; Schema: twitch; Owner: -
+--
+
+ALTER TABLE ONLY twitch.users
+    ADD CONSTRAINT users_twitch_id_key UNIQUE (twitch_id);
+
+
 --
 -- Name: watchtime watchtime_pkey; Type: CONSTRAINT; Schema: twitch; Owner: -
 --
 
 ALTER TABLE ONLY twitch.watchtime
-    ADD CONSTRAINT watchtime_pkey PRIMARY KEY (channel_id, username);
+    ADD CONSTRAINT watchtime_pkey PRIMARY KEY (channel_id, user_id);
 
 
 --
@@ -774,10 +1229,297 @@ ALTER TABLE ONLY twitch.yt_upload_notifications
 
 
 --
--- Name: messages_search_idx; Type: INDEX; Schema: twitch; Owner: -
+-- Name: channel_chatter_stats_channel_id_message_count_idx; Type: INDEX; Schema: twitch; Owner: -
 --
 
-CREATE INDEX messages_search_idx ON twitch.messages USING gin (to_tsvector('english'::regconfig, message));
+CREATE INDEX channel_chatter_stats_channel_id_message_count_idx ON twitch.channel_chatter_stats USING btree (channel_id, message_count DESC);
+
+
+--
+-- Name: messages_2026_11_channel_id_sender_id_sent_at_idx; Type: INDEX; Schema: twitch; Owner: -
+--
+
+CREATE INDEX messages_2026_11_channel_id_sender_id_sent_at_idx ON twitch.messages_2026_11 USING btree (channel_id, sender_id, sent_at);
+
+
+--
+-- Name: messages_2026_11_channel_id_sent_at_idx; Type: INDEX; Schema: twitch; Owner: -
+--
+
+CREATE INDEX messages_2026_11_channel_id_sent_at_idx ON twitch.messages_2026_11 USING btree (channel_id, sent_at);
+
+
+--
+-- Name: messages_2026_11_channel_id_tsv_idx; Type: INDEX; Schema: twitch; Owner: -
+--
+
+CREATE INDEX messages_2026_11_channel_id_tsv_idx ON twitch.messages_2026_11 USING gin (channel_id, tsv);
+
+
+--
+-- Name: messages_2026_11_channel_id_word_count_idx; Type: INDEX; Schema: twitch; Owner: -
+--
+
+CREATE INDEX messages_2026_11_channel_id_word_count_idx ON twitch.messages_2026_11 USING btree (channel_id, word_count);
+
+
+--
+-- Name: messages_2026_12_channel_id_sender_id_sent_at_idx; Type: INDEX; Schema: twitch; Owner: -
+--
+
+CREATE INDEX messages_2026_12_channel_id_sender_id_sent_at_idx ON twitch.messages_2026_12 USING btree (channel_id, sender_id, sent_at);
+
+
+--
+-- Name: messages_2026_12_channel_id_sent_at_idx; Type: INDEX; Schema: twitch; Owner: -
+--
+
+CREATE INDEX messages_2026_12_channel_id_sent_at_idx ON twitch.messages_2026_12 USING btree (channel_id, sent_at);
+
+
+--
+-- Name: messages_2026_12_channel_id_tsv_idx; Type: INDEX; Schema: twitch; Owner: -
+--
+
+CREATE INDEX messages_2026_12_channel_id_tsv_idx ON twitch.messages_2026_12 USING gin (channel_id, tsv);
+
+
+--
+-- Name: messages_2026_12_channel_id_word_count_idx; Type: INDEX; Schema: twitch; Owner: -
+--
+
+CREATE INDEX messages_2026_12_channel_id_word_count_idx ON twitch.messages_2026_12 USING btree (channel_id, word_count);
+
+
+--
+-- Name: messages_2027_01_channel_id_sender_id_sent_at_idx; Type: INDEX; Schema: twitch; Owner: -
+--
+
+CREATE INDEX messages_2027_01_channel_id_sender_id_sent_at_idx ON twitch.messages_2027_01 USING btree (channel_id, sender_id, sent_at);
+
+
+--
+-- Name: messages_2027_01_channel_id_sent_at_idx; Type: INDEX; Schema: twitch; Owner: -
+--
+
+CREATE INDEX messages_2027_01_channel_id_sent_at_idx ON twitch.messages_2027_01 USING btree (channel_id, sent_at);
+
+
+--
+-- Name: messages_2027_01_channel_id_tsv_idx; Type: INDEX; Schema: twitch; Owner: -
+--
+
+CREATE INDEX messages_2027_01_channel_id_tsv_idx ON twitch.messages_2027_01 USING gin (channel_id, tsv);
+
+
+--
+-- Name: messages_2027_01_channel_id_word_count_idx; Type: INDEX; Schema: twitch; Owner: -
+--
+
+CREATE INDEX messages_2027_01_channel_id_word_count_idx ON twitch.messages_2027_01 USING btree (channel_id, word_count);
+
+
+--
+-- Name: messages_channel_id_sender_id_sent_at_idx; Type: INDEX; Schema: twitch; Owner: -
+--
+
+CREATE INDEX messages_channel_id_sender_id_sent_at_idx ON ONLY twitch.messages USING btree (channel_id, sender_id, sent_at);
+
+
+--
+-- Name: messages_channel_id_sent_at_idx; Type: INDEX; Schema: twitch; Owner: -
+--
+
+CREATE INDEX messages_channel_id_sent_at_idx ON ONLY twitch.messages USING btree (channel_id, sent_at);
+
+
+--
+-- Name: messages_channel_id_tsv_idx; Type: INDEX; Schema: twitch; Owner: -
+--
+
+CREATE INDEX messages_channel_id_tsv_idx ON ONLY twitch.messages USING gin (channel_id, tsv);
+
+
+--
+-- Name: messages_channel_id_word_count_idx; Type: INDEX; Schema: twitch; Owner: -
+--
+
+CREATE INDEX messages_channel_id_word_count_idx ON ONLY twitch.messages USING btree (channel_id, word_count);
+
+
+--
+-- Name: messages_legacy_channel_id_sender_id_sent_at_idx; Type: INDEX; Schema: twitch; Owner: -
+--
+
+CREATE INDEX messages_legacy_channel_id_sender_id_sent_at_idx ON twitch.messages_legacy USING btree (channel_id, sender_id, sent_at);
+
+
+--
+-- Name: messages_legacy_channel_id_sent_at_idx; Type: INDEX; Schema: twitch; Owner: -
+--
+
+CREATE INDEX messages_legacy_channel_id_sent_at_idx ON twitch.messages_legacy USING btree (channel_id, sent_at);
+
+
+--
+-- Name: messages_legacy_channel_id_tsv_idx; Type: INDEX; Schema: twitch; Owner: -
+--
+
+CREATE INDEX messages_legacy_channel_id_tsv_idx ON twitch.messages_legacy USING gin (channel_id, tsv);
+
+
+--
+-- Name: messages_legacy_channel_id_word_count_idx; Type: INDEX; Schema: twitch; Owner: -
+--
+
+CREATE INDEX messages_legacy_channel_id_word_count_idx ON twitch.messages_legacy USING btree (channel_id, word_count);
+
+
+--
+-- Name: users_merged_into_idx; Type: INDEX; Schema: twitch; Owner: -
+--
+
+CREATE INDEX users_merged_into_idx ON twitch.users USING btree (merged_into) WHERE (merged_into IS NOT NULL);
+
+
+--
+-- Name: messages_2026_11_channel_id_sender_id_sent_at_idx; Type: INDEX ATTACH; Schema: twitch; Owner: -
+--
+
+ALTER INDEX twitch.messages_channel_id_sender_id_sent_at_idx ATTACH PARTITION twitch.messages_2026_11_channel_id_sender_id_sent_at_idx;
+
+
+--
+-- Name: messages_2026_11_channel_id_sent_at_idx; Type: INDEX ATTACH; Schema: twitch; Owner: -
+--
+
+ALTER INDEX twitch.messages_channel_id_sent_at_idx ATTACH PARTITION twitch.messages_2026_11_channel_id_sent_at_idx;
+
+
+--
+-- Name: messages_2026_11_channel_id_tsv_idx; Type: INDEX ATTACH; Schema: twitch; Owner: -
+--
+
+ALTER INDEX twitch.messages_channel_id_tsv_idx ATTACH PARTITION twitch.messages_2026_11_channel_id_tsv_idx;
+
+
+--
+-- Name: messages_2026_11_channel_id_word_count_idx; Type: INDEX ATTACH; Schema: twitch; Owner: -
+--
+
+ALTER INDEX twitch.messages_channel_id_word_count_idx ATTACH PARTITION twitch.messages_2026_11_channel_id_word_count_idx;
+
+
+--
+-- Name: messages_2026_11_pkey; Type: INDEX ATTACH; Schema: twitch; Owner: -
+--
+
+ALTER INDEX twitch.messages_pkey ATTACH PARTITION twitch.messages_2026_11_pkey;
+
+
+--
+-- Name: messages_2026_12_channel_id_sender_id_sent_at_idx; Type: INDEX ATTACH; Schema: twitch; Owner: -
+--
+
+ALTER INDEX twitch.messages_channel_id_sender_id_sent_at_idx ATTACH PARTITION twitch.messages_2026_12_channel_id_sender_id_sent_at_idx;
+
+
+--
+-- Name: messages_2026_12_channel_id_sent_at_idx; Type: INDEX ATTACH; Schema: twitch; Owner: -
+--
+
+ALTER INDEX twitch.messages_channel_id_sent_at_idx ATTACH PARTITION twitch.messages_2026_12_channel_id_sent_at_idx;
+
+
+--
+-- Name: messages_2026_12_channel_id_tsv_idx; Type: INDEX ATTACH; Schema: twitch; Owner: -
+--
+
+ALTER INDEX twitch.messages_channel_id_tsv_idx ATTACH PARTITION twitch.messages_2026_12_channel_id_tsv_idx;
+
+
+--
+-- Name: messages_2026_12_channel_id_word_count_idx; Type: INDEX ATTACH; Schema: twitch; Owner: -
+--
+
+ALTER INDEX twitch.messages_channel_id_word_count_idx ATTACH PARTITION twitch.messages_2026_12_channel_id_word_count_idx;
+
+
+--
+-- Name: messages_2026_12_pkey; Type: INDEX ATTACH; Schema: twitch; Owner: -
+--
+
+ALTER INDEX twitch.messages_pkey ATTACH PARTITION twitch.messages_2026_12_pkey;
+
+
+--
+-- Name: messages_2027_01_channel_id_sender_id_sent_at_idx; Type: INDEX ATTACH; Schema: twitch; Owner: -
+--
+
+ALTER INDEX twitch.messages_channel_id_sender_id_sent_at_idx ATTACH PARTITION twitch.messages_2027_01_channel_id_sender_id_sent_at_idx;
+
+
+--
+-- Name: messages_2027_01_channel_id_sent_at_idx; Type: INDEX ATTACH; Schema: twitch; Owner: -
+--
+
+ALTER INDEX twitch.messages_channel_id_sent_at_idx ATTACH PARTITION twitch.messages_2027_01_channel_id_sent_at_idx;
+
+
+--
+-- Name: messages_2027_01_channel_id_tsv_idx; Type: INDEX ATTACH; Schema: twitch; Owner: -
+--
+
+ALTER INDEX twitch.messages_channel_id_tsv_idx ATTACH PARTITION twitch.messages_2027_01_channel_id_tsv_idx;
+
+
+--
+-- Name: messages_2027_01_channel_id_word_count_idx; Type: INDEX ATTACH; Schema: twitch; Owner: -
+--
+
+ALTER INDEX twitch.messages_channel_id_word_count_idx ATTACH PARTITION twitch.messages_2027_01_channel_id_word_count_idx;
+
+
+--
+-- Name: messages_2027_01_pkey; Type: INDEX ATTACH; Schema: twitch; Owner: -
+--
+
+ALTER INDEX twitch.messages_pkey ATTACH PARTITION twitch.messages_2027_01_pkey;
+
+
+--
+-- Name: messages_legacy_channel_id_sender_id_sent_at_idx; Type: INDEX ATTACH; Schema: twitch; Owner: -
+--
+
+ALTER INDEX twitch.messages_channel_id_sender_id_sent_at_idx ATTACH PARTITION twitch.messages_legacy_channel_id_sender_id_sent_at_idx;
+
+
+--
+-- Name: messages_legacy_channel_id_sent_at_idx; Type: INDEX ATTACH; Schema: twitch; Owner: -
+--
+
+ALTER INDEX twitch.messages_channel_id_sent_at_idx ATTACH PARTITION twitch.messages_legacy_channel_id_sent_at_idx;
+
+
+--
+-- Name: messages_legacy_channel_id_tsv_idx; Type: INDEX ATTACH; Schema: twitch; Owner: -
+--
+
+ALTER INDEX twitch.messages_channel_id_tsv_idx ATTACH PARTITION twitch.messages_legacy_channel_id_tsv_idx;
+
+
+--
+-- Name: messages_legacy_channel_id_word_count_idx; Type: INDEX ATTACH; Schema: twitch; Owner: -
+--
+
+ALTER INDEX twitch.messages_channel_id_word_count_idx ATTACH PARTITION twitch.messages_legacy_channel_id_word_count_idx;
+
+
+--
+-- Name: messages_legacy_pkey; Type: INDEX ATTACH; Schema: twitch; Owner: -
+--
+
+ALTER INDEX twitch.messages_pkey ATTACH PARTITION twitch.messages_legacy_pkey;
 
 
 --
@@ -801,6 +1543,48 @@ CREATE TRIGGER delete_disposable_reminder_after_complete AFTER UPDATE OF sent, c
 CREATE TRIGGER disable_timers_on_part AFTER DELETE ON twitch.joined_channels FOR EACH ROW EXECUTE FUNCTION twitch.disable_timers();
 
 
+--
+-- Name: afks notify_afk_changed; Type: TRIGGER; Schema: twitch; Owner: -
+--
+
+CREATE TRIGGER notify_afk_changed AFTER INSERT OR DELETE OR UPDATE ON twitch.afks FOR EACH ROW EXECUTE FUNCTION twitch.notify_afk_changed();
+
+
+--
+-- Name: blocked_terms notify_blocked_term_changed; Type: TRIGGER; Schema: twitch; Owner: -
+--
+
+CREATE TRIGGER notify_blocked_term_changed AFTER INSERT OR DELETE OR UPDATE ON twitch.blocked_terms FOR EACH ROW EXECUTE FUNCTION twitch.notify_blocked_term_changed();
+
+
+--
+-- Name: channel_config notify_channel_config_changed; Type: TRIGGER; Schema: twitch; Owner: -
+--
+
+CREATE TRIGGER notify_channel_config_changed AFTER INSERT OR DELETE OR UPDATE ON twitch.channel_config FOR EACH ROW EXECUTE FUNCTION twitch.notify_channel_changed();
+
+
+--
+-- Name: joined_channels notify_joined_channel_changed; Type: TRIGGER; Schema: twitch; Owner: -
+--
+
+CREATE TRIGGER notify_joined_channel_changed AFTER INSERT OR DELETE OR UPDATE ON twitch.joined_channels FOR EACH ROW EXECUTE FUNCTION twitch.notify_channel_changed();
+
+
+--
+-- Name: reminders notify_reminder_changed; Type: TRIGGER; Schema: twitch; Owner: -
+--
+
+CREATE TRIGGER notify_reminder_changed AFTER INSERT OR DELETE OR UPDATE ON twitch.reminders FOR EACH ROW EXECUTE FUNCTION twitch.notify_reminder_changed();
+
+
+--
+-- Name: user_config notify_user_config_changed; Type: TRIGGER; Schema: twitch; Owner: -
+--
+
+CREATE TRIGGER notify_user_config_changed AFTER INSERT OR DELETE OR UPDATE ON twitch.user_config FOR EACH ROW EXECUTE FUNCTION twitch.notify_user_config_changed();
+
+
 --
 -- Name: counters remove_counter_on_reset; Type: TRIGGER; Schema: twitch; Owner: -
 --
@@ -816,6 +1600,30 @@ ALTER TABLE ONLY twitch.live_notifications
     ADD CONSTRAINT live_notifications_channel_id_fkey FOREIGN KEY (channel_id) REFERENCES twitch.joined_channels(channel_id) ON DELETE CASCADE;
 
 
+--
+-- Name: messages messages_sender_id_fkey; Type: FK CONSTRAINT; Schema: twitch; Owner: -
+--
+
+ALTER TABLE twitch.messages
+    ADD CONSTRAINT messages_sender_id_fkey FOREIGN KEY (sender_id) REFERENCES twitch.users(id);
+
+
+--
+-- Name: users users_merged_into_fkey; Type: FK CONSTRAINT; Schema: twitch; Owner: -
+--
+
+ALTER TABLE ONLY twitch.users
+    ADD CONSTRAINT users_merged_into_fkey FOREIGN KEY (merged_into) REFERENCES twitch.users(id);
+
+
+--
+-- Name: watchtime watchtime_user_id_fkey; Type: FK CONSTRAINT; Schema: twitch; Owner: -
+--
+
+ALTER TABLE ONLY twitch.watchtime
+    ADD CONSTRAINT watchtime_user_id_fkey FOREIGN KEY (user_id) REFERENCES twitch.users(id);
+
+
 --
 -- Name: yt_upload_notifications yt_upload_notifications_channel_id_fkey; Type: FK CONSTRAINT; Schema: twitch; Owner: -
 --
@@ -840,4 +1648,24 @@ INSERT INTO public.schema_migrations (version) VALUES
     ('20240831210655'),
     ('20240923122022'),
     ('20240926234316'),
-    ('20241112072924');
+    ('20241112072924'),
+    ('20261017090000'),
+    ('20261017091000'),
+    ('20261017092000'),
+    ('20261017093000'),
+    ('20261017094000'),
+    ('20261017095000'),
+    ('20261017096000'),
+    ('20261017096500'),
+    ('20261017096600'),
+    ('20261017097000'),
+    ('20261017098000'),
+    ('20261017099000'),
+    ('20261017100000'),
+    ('20261017101000'),
+    ('20261017102000'),
+    ('20261017103000'),
+    ('20261017104000'),
+    ('20261017105000'),
+    ('20261017106000'),
+    ('20261017107000');
@@ -0,0 +1,150 @@
+"""
+Moves the chat logs older than a number of months out of the database into compressed files, one per channel and
+month, that the bot keeps reading the old messages from.
+
+Every month is written and synced to disk before its messages are deleted from the database, and the files remember
+the highest archived message id, so an interrupted run can simply be started again. Messages that arrive for an
+archived month later, for example from the message spool, are merged into its file on the next run. The deleted
+rows are only reclaimed by Postgres after a VACUUM, or by dropping the emptied partitions.
+
+The senders are archived by their key in the users table, so their archived messages follow them when they change
+their login. Files written before that, which hold the logins, are rewritten with the keys of those logins first.
+
+The archive is written to MESSAGE_ARCHIVE_PATH, the archive folder of the repository by default, which is what the
+bot's container mounts.
+
+Examples:
+    python scripts/twitch/archive_messages.py --all --dry-run
+    python scripts/twitch/archive_messages.py --channel forsen --older-than-months 6
+"""
+
+import argparse
+import asyncio
+from datetime import datetime, UTC
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+import asyncpg
+from dotenv import load_dotenv
+
+from shared import database
+from shared.database.twitch import channels, message_archive, messages, users
+
+
+def next_month(month: datetime) -> datetime:
+    return datetime(month.year + month.month // 12, month.month % 12 + 1, 1, tzinfo=UTC)
+
+
+def months_between(start: datetime, end: datetime) -> list[datetime]:
+    """Returns the first days of the calendar months from the one of start up to end, exclusive"""
+    months = []
+    month = datetime(start.year, start.month, 1, tzinfo=UTC)
+    while month < end:
+        months.append(month)
+        month = next_month(month)
+    return months
+
+
+async def keyed_rows(
+    pool: asyncpg.Pool, archive_file: message_archive.ArchiveFile
+) -> list[message_archive.ArchivedRow]:
+    """Returns the rows of a file, with the senders of a file that holds logins replaced by the keys of the logins"""
+    rows = archive_file.read_all()
+    if archive_file.version >= message_archive.ArchiveFile.VERSION:
+        return rows
+    logins = {str(sender) for sender, *_ in rows}
+    async with pool.acquire() as con:
+        ids = await users.user_ids(con, [(login, None) for login in logins])
+    return [(ids[(str(sender), None)], sent_at, message, word_count) for sender, sent_at, message, word_count in rows]
+
+
+async def convert_months(
+    pool: asyncpg.Pool, archive: message_archive.MessageArchive, channel_id: str, dry_run: bool
+) -> None:
+    """Rewrites the archived months of a channel that still hold the logins of the senders with their keys"""
+    for month in archive.months(channel_id):
+        archive_file = archive.file(month)
+        if archive_file.version >= message_archive.ArchiveFile.VERSION:
+            continue
+        print(f"{channel_id} {month.year:04d}-{month.month:02d}: storing the senders by their key")
+        if not dry_run:
+            rows = await keyed_rows(pool, archive_file)
+            await asyncio.to_thread(
+                message_archive.ArchiveFile.write, archive_file.path, rows, archive_file.max_message_id
+            )
+
+
+async def archive_month(
+    pool: asyncpg.Pool, archive: message_archive.MessageArchive, channel_id: str, month: datetime, dry_run: bool
+) -> int | None:
+    """Writes the messages of one month into its file and returns the highest archived id, if there are any"""
+    path = archive.month_path(channel_id, month.year, month.month)
+    existing = message_archive.ArchiveFile(path) if os.path.exists(path) else None
+    max_id = 0 if existing is None else existing.max_message_id
+
+    rows: list[message_archive.ArchivedRow] = []
+    async for chunk in messages.archivable_messages(pool, channel_id, month, next_month(month), max_id):
+        for message_id, sender_id, sent_at, message, word_count in chunk:
+            rows.append((sender_id, sent_at, message, word_count))
+            max_id = max(max_id, message_id)
+
+    print(f"{channel_id} {month:%Y-%m}: {len(rows)} messages to archive")
+    if dry_run or (existing is None and len(rows) == 0):
+        return None
+    if len(rows) > 0:
+        if existing is not None:
+            rows.extend(await keyed_rows(pool, existing))
+        await asyncio.to_thread(message_archive.ArchiveFile.write, path, rows, max_id)
+    return max_id
+
+
+async def main(args: argparse.Namespace) -> None:
+    pool = await database.init_pool(asyncio.get_event_loop(), localhost=True)
+    archive = message_archive.archive()
+    os.makedirs(archive.root, exist_ok=True)
+    channel_names = args.channel if len(args.channel) > 0 else await channels.initial_channels(pool)
+
+    now = datetime.now(UTC)
+    cutoff = datetime(now.year, now.month, 1, tzinfo=UTC)
+    for _ in range(args.older_than_months):
+        cutoff = datetime(cutoff.year - (cutoff.month == 1), (cutoff.month - 2) % 12 + 1, 1, tzinfo=UTC)
+    print(f"Archiving the messages sent before {cutoff:%Y-%m-%d}")
+
+    for channel in channel_names:
+        channel_id = await channels.channel_id(pool, channel)
+        await convert_months(pool, archive, channel_id, args.dry_run)
+        span = await messages.message_time_span(pool, channel_id)
+        if span is None:
+            continue
+        archived: dict[datetime, int] = {}
+        for month in months_between(span[0], min(span[1], cutoff)):
+            max_id = await archive_month(pool, archive, channel_id, month, args.dry_run)
+            if max_id is not None:
+                archived[month] = max_id
+        if len(archived) == 0:
+            continue
+
+        # The bot only finds the files through the index, so it's updated before the messages are deleted
+        archive.rebuild_index()
+        deleted = 0
+        for month, max_id in archived.items():
+            deleted += await messages.delete_messages(pool, channel_id, month, next_month(month), max_id)
+        print(f"#{channel}: archived {len(archived)} months and deleted {deleted} messages from the database")
+    await pool.close()
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Moves old chat logs from the database into compressed files")
+    targets = parser.add_mutually_exclusive_group(required=True)
+    targets.add_argument("--channel", action="append", default=[], help="channel to archive, can be repeated")
+    targets.add_argument("--all", action="store_true", help="archives every joined channel")
+    parser.add_argument("--older-than-months", type=int, default=12, help="whole months older than this are archived")
+    parser.add_argument("--dry-run", action="store_true", help="only prints how many messages would be archived")
+    args = parser.parse_args()
+    if args.older_than_months < 1:
+        parser.error("--older-than-months must be at least 1")
+    args.channel = [channel.lower() for channel in args.channel]
+    asyncio.run(main(args))
@@ -0,0 +1,57 @@
+"""
+Counts the 7tv emotes in the chat logs into the daily emote usage counts that the bot keeps up to date from the
+messages it receives.
+
+Only the messages logged before the bot started counting the emotes of a channel are counted, so the same
+messages aren't counted twice, and the archived months are counted with the ones still in the database. The
+channel's counts are marked complete afterwards, so a channel is only backfilled once. The emotes are taken from the current 7tv emote sets of each channel, including the global
+emotes.
+
+Example:
+    python scripts/twitch/backfill_emote_usage.py --channel forsen
+"""
+
+import argparse
+import asyncio
+from datetime import datetime
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from dotenv import load_dotenv
+
+from shared import database
+from shared.apis import seventv
+from shared.database.twitch import channels, messages
+
+
+async def backfill(channel_names: list[str]) -> None:
+    pool = await database.init_pool(asyncio.get_event_loop(), localhost=True)
+    if len(channel_names) == 0:
+        channel_names = await channels.initial_channels(pool)
+
+    for channel in channel_names:
+        channel_config = await channels.channel_config(pool, channel)
+        before = await messages.emote_usage_counted_from(pool, channel_config.channel_id)
+        if before is None:
+            print(f"{channel}: skipped, the bot hasn't counted any emotes in the channel yet")
+            continue
+        if before == datetime.min.replace(tzinfo=before.tzinfo):
+            print(f"{channel}: skipped, already backfilled")
+            continue
+        emote_names = await seventv.emote_names(channel_config.channel_id, include_global=True)
+        usage = await messages.logged_emote_usage(
+            pool, channel_config.channel_id, list(set(emote_names)), os.environ["BOT_NICK"], before
+        )
+        await messages.backfill_emote_usage(pool, channel_config.channel_id, usage)
+        print(f"{channel}: {sum(count for _, _, _, count in usage)} emote uses over {len(usage)} emote days")
+    await pool.close()
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Counts the emotes in the chat logs into the daily emote usage")
+    parser.add_argument("--channel", action="append", default=[], help="channel to backfill, defaults to all")
+    args = parser.parse_args()
+    asyncio.run(backfill([channel.lower() for channel in args.channel]))
@@ -0,0 +1,175 @@
+"""
+Writes an emote usage and chatter report for many channels at once, one file per channel into the output folder.
+
+Each channel's history is split into calendar months, the same ranges the message log is partitioned by, and the
+months are counted in parallel by a pool of worker processes that each stream their month from the database and
+read it from the message archive, for the months that have been archived. Each worker keeps one connection pool
+for all of its months. The partial counts are merged per channel once all of its months are done.
+
+Examples:
+    python scripts/twitch/channel_reports.py --all
+    python scripts/twitch/channel_reports.py --channel forsen --channel xqc --since 2026-09-01 --until 2026-10-01
+"""
+
+import argparse
+import asyncio
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, UTC
+from itertools import chain
+import multiprocessing
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from asyncpg import Pool
+from dotenv import load_dotenv
+
+from output_folder import get_output_path
+from shared import database
+from shared.apis import seventv
+from shared.database.twitch import channels, messages
+
+
+# channel, channel_id, emote names, start and end of the range
+RangeJob = tuple[str, str, frozenset[str], datetime, datetime]
+# channel, emote counts, message counts per chatter
+RangeResult = tuple[str, Counter[str], Counter[str]]
+
+
+def month_ranges(start: datetime, end: datetime) -> list[tuple[datetime, datetime]]:
+    """Splits the time between start and end into calendar months in UTC"""
+    ranges = []
+    month = datetime(start.year, start.month, 1, tzinfo=UTC)
+    while month <= end:
+        next_month = datetime(month.year + month.month // 12, month.month % 12 + 1, 1, tzinfo=UTC)
+        ranges.append((max(month, start), min(next_month, end)))
+        month = next_month
+    return [(range_start, range_end) for range_start, range_end in ranges if range_start < range_end]
+
+
+# The event loop and connection pool of a worker process, shared by all the ranges it counts
+_worker_loop: asyncio.AbstractEventLoop | None = None
+_worker_pool: Pool | None = None
+
+
+def init_worker() -> None:
+    global _worker_loop, _worker_pool
+    _worker_loop = asyncio.new_event_loop()
+    # The connections are closed with the worker process
+    _worker_pool = _worker_loop.run_until_complete(database.init_pool(_worker_loop, localhost=True))
+
+
+def _count_chunk(
+    chunk: list[tuple[str, str]], emotes: frozenset[str], emote_counts: Counter[str], chatter_counts: Counter[str]
+) -> None:
+    # Counter.update counts an iterable in C, so the words are never gathered into a list
+    chatter_counts.update(sender for sender, _ in chunk)
+    words = chain.from_iterable(message.split() for _, message in chunk)
+    emote_counts.update(filter(emotes.__contains__, words))
+
+
+async def _count_range(pool: Pool, job: RangeJob) -> RangeResult:
+    channel, channel_id, emotes, start, end = job
+    bot = os.environ["BOT_NICK"]
+    emote_counts: Counter[str] = Counter()
+    chatter_counts: Counter[str] = Counter()
+    # The chunks include the archived months
+    async for chunk in messages.message_chunks(pool, channel_id, bot, start, end):
+        _count_chunk(chunk, emotes, emote_counts, chatter_counts)
+    return channel, emote_counts, chatter_counts
+
+
+def count_range(job: RangeJob) -> RangeResult:
+    """Counts the emotes and chatters of one channel over one range in a worker process"""
+    assert _worker_loop is not None and _worker_pool is not None
+    return _worker_loop.run_until_complete(_count_range(_worker_pool, job))
+
+
+def report(channel: str, start: datetime, end: datetime, emote_counts: Counter[str], chatters: Counter[str]) -> str:
+    lines = [
+        f"#{channel} from {start:%Y-%m-%d %H:%M} to {end:%Y-%m-%d %H:%M} UTC",
+        f"Messages: {chatters.total()} from {len(chatters)} chatters",
+        "",
+        "Emote usage:",
+    ]
+    lines.extend(f"{i}. {emote} — {count}" for i, (emote, count) in enumerate(emote_counts.most_common(), 1))
+    lines.extend(["", "Top chatters:"])
+    lines.extend(f"{i}. {chatter} — {count}" for i, (chatter, count) in enumerate(chatters.most_common(100), 1))
+    return "\n".join(lines) + "\n"
+
+
+async def plan(args: argparse.Namespace) -> tuple[list[RangeJob], dict[str, tuple[datetime, datetime]]]:
+    """Splits every channel into the ranges to count and returns them with the time span of each channel"""
+    pool = await database.init_pool(asyncio.get_event_loop(), localhost=True)
+    channel_names = args.channel if len(args.channel) > 0 else await channels.initial_channels(pool)
+
+    jobs: list[RangeJob] = []
+    spans: dict[str, tuple[datetime, datetime]] = {}
+    for channel in channel_names:
+        channel_id = await channels.channel_id(pool, channel)
+        span = await messages.message_time_span(pool, channel_id)
+        if span is None:
+            print(f"#{channel} doesn't have any logged messages")
+            continue
+        start = span[0] if args.since is None else max(span[0], args.since)
+        # The end is exclusive, so it's moved just past the last message
+        end = span[1] + timedelta(microseconds=1)
+        if args.until is not None:
+            end = min(end, args.until)
+        spans[channel] = (start, end)
+        emotes = frozenset(await seventv.emote_names(channel_id, include_global=args.global_emotes))
+        for range_start, range_end in month_ranges(start, end):
+            jobs.append((channel, channel_id, emotes, range_start, range_end))
+    await pool.close()
+    return jobs, spans
+
+
+async def main(args: argparse.Namespace) -> None:
+    jobs, spans = await plan(args)
+    remaining = Counter(channel for channel, *_ in jobs)
+    emote_counts: dict[str, Counter[str]] = {channel: Counter() for channel in remaining}
+    chatter_counts: dict[str, Counter[str]] = {channel: Counter() for channel in remaining}
+    timestamp = datetime.now(UTC).strftime("%Y%m%d%H%M%S")
+
+    loop = asyncio.get_running_loop()
+    # Spawned workers don't inherit the running event loop of this process like forked ones would
+    with ProcessPoolExecutor(
+        max_workers=args.workers, mp_context=multiprocessing.get_context("spawn"), initializer=init_worker
+    ) as executor:
+        pending = [loop.run_in_executor(executor, count_range, job) for job in jobs]
+        for done, future in enumerate(asyncio.as_completed(pending), 1):
+            channel, emotes, chatters = await future
+            emote_counts[channel].update(emotes)
+            chatter_counts[channel].update(chatters)
+            remaining[channel] -= 1
+            print(f"Counted {done}/{len(jobs)} ranges")
+            if remaining[channel] > 0:
+                continue
+
+            start, end = spans[channel]
+            file_path = os.path.join(get_output_path(), f"{timestamp}_{channel}_report.txt")
+            with open(file_path, "w") as file:
+                file.write(report(channel, start, end, emote_counts.pop(channel), chatter_counts.pop(channel)))
+            print(f"Wrote the report of #{channel} to {file_path}")
+
+
+def utc_date(value: str) -> datetime:
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo is not None else parsed.replace(tzinfo=UTC)
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Writes emote usage and chatter reports for many channels")
+    targets = parser.add_mutually_exclusive_group(required=True)
+    targets.add_argument("--channel", action="append", default=[], help="channel to report on, can be repeated")
+    targets.add_argument("--all", action="store_true", help="reports on every joined channel")
+    parser.add_argument("--since", type=utc_date, help="start of the reported time, UTC unless an offset is given")
+    parser.add_argument("--until", type=utc_date, help="end of the reported time, exclusive")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("--global-emotes", action="store_true", help="counts the global 7tv emotes too")
+    args = parser.parse_args()
+    args.channel = [channel.lower() for channel in args.channel]
+    asyncio.run(main(args))
@@ -0,0 +1,311 @@
+"""
+Replays a recorded or synthetic stream of chat messages through Bot.event_message and reports the throughput,
+handling latency, database queries and allocations per message.
+
+The messages are built as real twitchio objects on top of the bot's idle websocket connection, so nothing is
+sent to or received from IRC, and the messages the bot would send are collected from its queues instead. The
+replayed messages are not logged into the database again. Chatters get synthetic user ids far above the range
+Twitch uses, so their afks and reminders can't be delivered by accident.
+
+Replayed commands still run and write into the database, so the bot runs against a separate database that has
+the schema loaded, never against its own database; restore a dump of the bot's database into it to replay
+recorded messages:
+    createdb replay_benchmark
+    pg_dump -Fc "$PGDATABASE" | pg_restore -d replay_benchmark
+
+Examples:
+    python scripts/twitch/chat_replay_benchmark.py --database replay_benchmark --channel forsen --count 20000
+    python scripts/twitch/chat_replay_benchmark.py --database replay_benchmark --channel forsen --source synthetic
+    python scripts/twitch/chat_replay_benchmark.py --database replay_benchmark --source file --file recorded.jsonl
+"""
+
+import argparse
+import asyncio
+from datetime import datetime, timedelta, UTC
+import gc
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../Twitch")))
+
+import asyncpg
+from dotenv import load_dotenv
+import twitchio
+
+from output_folder import get_output_path
+from handlers.emote_counter import EmoteCounter
+from handlers.message_logger import MessageLogger
+from handlers.message_queue import MessageQueues
+from handlers.metrics import metrics
+from shared.database.listener import listener
+from shared.database.twitch import channels, messages
+from twitchbot import Bot
+
+
+# channel, sender, message
+ChatLine = tuple[str, str, str]
+
+# Twitch user ids are far below this, so the synthetic chatters never match real users
+SYNTHETIC_USER_ID_START = 10**12
+
+
+class QueryCounter:
+    def __init__(self) -> None:
+        self.count = 0
+
+    async def install(self, con: asyncpg.Connection) -> None:
+        con.add_query_logger(self._logged)
+
+    def _logged(self, record: asyncpg.connection.LoggedQuery) -> None:
+        self.count += 1
+
+
+class DiscardingLogger(MessageLogger):
+    """Batches the messages like the real logger but doesn't write the replayed messages into the log again"""
+
+    async def _flush(self, batch: list) -> None:
+        pass
+
+
+class DiscardingEmoteCounter(EmoteCounter):
+    """Counts the emotes like the real counter but doesn't add the replayed uses to the emote usage"""
+
+    async def flush(self) -> None:
+        self._counts.clear()
+
+
+class CapturingQueues(MessageQueues):
+    """Collects the messages the bot would send instead of sending them to chat"""
+
+    def __init__(self, bot: Bot, initial_channels: list[str]) -> None:
+        self.sent: list[tuple[str, str]] = []
+        super().__init__(bot, initial_channels)
+
+    async def _clear_queue(self, channel: str) -> None:
+        while True:
+            message = await self._queues[channel].get()
+            self.sent.append((channel, message.message))
+
+
+def read_lines(path: str) -> list[ChatLine]:
+    lines = []
+    with open(path) as file:
+        for line in file:
+            if line.strip() == "":
+                continue
+            data = json.loads(line)
+            lines.append((data["channel"], data["sender"], data["message"]))
+    return lines
+
+
+def write_lines(path: str, lines: list[ChatLine]) -> None:
+    with open(path, "w") as file:
+        for channel, sender, message in lines:
+            file.write(json.dumps({"channel": channel, "sender": sender, "message": message}) + "\n")
+
+
+async def recorded_lines(bot: Bot, channel: str, hours: int, count: int) -> list[ChatLine]:
+    channel_id = await channels.channel_id(bot.con_pool, channel)
+    since = datetime.now(UTC) - timedelta(hours=hours)
+    recorded = await messages.past_messages(bot.con_pool, channel_id, since, count)
+    return [(channel, message.sender, message.message) for message in recorded]
+
+
+def synthetic_lines(channel: str, prefix: str, count: int, chatters: int, seed: int) -> list[ChatLine]:
+    rng = random.Random(seed)
+    words = ["hello", "chat", "what", "is", "this", "lol", "true", "no", "way", "game", "stream", "nice", "gg"]
+    emotes = ["KEKW", "OMEGALUL", "Clap", "LULE", "forsenE", "Stare", "xdd", "Okayge", "Sadge", "PogU"]
+    commands = ["ping", "rm", "fm", "ls", "nofm", "ecount KEKW", "remind me test", "afk", "notacommand"]
+    senders = [f"chatter{i}" for i in range(chatters)]
+
+    lines = []
+    for _ in range(count):
+        sender = rng.choice(senders)
+        kind = rng.random()
+        if kind < 0.6:
+            message = " ".join(rng.choice(words + emotes) for _ in range(rng.randint(1, 12)))
+        elif kind < 0.8:
+            message = " ".join([rng.choice(emotes)] * rng.randint(1, 4))
+        elif kind < 0.9:
+            message = f"{prefix}{rng.choice(commands)} {rng.choice(senders)}"
+        else:
+            message = f"@{rng.choice(senders)} " + " ".join(rng.choice(words) for _ in range(rng.randint(1, 8)))
+        lines.append((channel, sender, message))
+    return lines
+
+
+def build_messages(bot: Bot, lines: list[ChatLine]) -> list[twitchio.Message]:
+    channel_objects: dict[str, twitchio.Channel] = {}
+    user_ids: dict[str, str] = {}
+    built = []
+    for channel, sender, content in lines:
+        channel_object = channel_objects.get(channel)
+        if channel_object is None:
+            channel_object = channel_objects[channel] = twitchio.Channel(channel, bot._connection)
+        user_id = user_ids.setdefault(sender, str(SYNTHETIC_USER_ID_START + len(user_ids)))
+        tags = {
+            "user-id": user_id,
+            "display-name": sender,
+            "subscriber": "0",
+            "mod": "0",
+            "color": "",
+            "badges": "",
+        }
+        author = twitchio.Chatter(bot._connection, name=sender, channel=channel_object, tags=tags)
+        echo = sender == bot.nick
+        built.append(twitchio.Message(content=content, author=author, channel=channel_object, tags=tags, echo=echo))
+    return built
+
+
+async def replay(bot: Bot, chat: list[twitchio.Message], concurrency: int) -> tuple[list[float], int, float]:
+    latencies: list[float] = []
+    errors = 0
+    pending = iter(chat)
+
+    async def worker() -> None:
+        nonlocal errors
+        for message in pending:
+            started = time.perf_counter()
+            try:
+                await bot.event_message(message)
+            except Exception as e:
+                if errors == 0:
+                    print(f"First error while handling a message: {e!r}")
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - started
+
+
+async def allocations(bot: Bot, chat: list[twitchio.Message]) -> tuple[float, float, float]:
+    """
+    Replays the messages one at a time with tracemalloc on and returns the blocks and bytes still allocated
+    afterwards per message, and the peak of the memory allocated while replaying them
+    """
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    current_before, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    await replay(bot, chat, 1)
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    current_after, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename"))
+    return blocks / len(chat), (current_after - current_before) / len(chat), peak - current_before
+
+
+async def benchmark(bot: Bot, queries: QueryCounter, args: argparse.Namespace) -> str:
+    if args.source == "file":
+        lines = read_lines(args.file)
+    elif args.source == "db":
+        lines = await recorded_lines(bot, args.channel, args.hours, args.count)
+    else:
+        prefix = (await bot.prefixes(args.channel))[0]
+        lines = synthetic_lines(args.channel, prefix, args.count, args.chatters, args.seed)
+    if len(lines) == 0:
+        return "No messages to replay"
+    if args.export is not None:
+        write_lines(args.export, lines)
+
+    # Replace the logger, the emote counter and the queues before anything is replayed
+    await bot.message_logger.close()
+    bot.message_logger = DiscardingLogger(
+        bot.con_pool, bot.loop, spool_path=os.path.join(tempfile.mkdtemp(), "messages.spool")
+    )
+    await bot.emote_counter.close()
+    bot.emote_counter = DiscardingEmoteCounter(bot.con_pool, bot.loop)
+    for channel in bot.initial_channels:
+        bot.msg_q.remove_channel(channel)
+    bot.msg_q = CapturingQueues(bot, sorted(set(channel for channel, _, _ in lines)))
+
+    warmup = build_messages(bot, lines[: args.warmup])
+    await replay(bot, warmup, args.concurrency)
+    metrics.reset()
+    sent_before = len(bot.msg_q.sent)
+    queries_before = queries.count
+
+    chat = build_messages(bot, lines)
+    latencies, errors, elapsed = await replay(bot, chat, args.concurrency)
+    query_count = queries.count - queries_before
+    sent = len(bot.msg_q.sent) - sent_before
+    stages = metrics.stage_totals()
+
+    sample = build_messages(bot, lines[: args.alloc_sample])
+    blocks, retained, peak = await allocations(bot, sample)
+
+    percentiles = statistics.quantiles(latencies, n=100)
+    report = [
+        f"Messages replayed: {len(chat)} ({errors} errors) with concurrency {args.concurrency}",
+        f"Throughput: {len(chat) / elapsed:.1f} messages/s",
+        f"Latency: p50 {percentiles[49] * 1000:.2f} ms, p99 {percentiles[98] * 1000:.2f} ms, "
+        f"max {max(latencies) * 1000:.2f} ms",
+        f"Database queries: {query_count / len(chat):.2f} per message",
+        f"Messages sent by the bot: {sent}",
+        f"Allocations over {len(sample)} messages: {blocks:.1f} blocks and {retained:.0f} bytes retained "
+        f"per message, {peak / 1024:.0f} KiB peak",
+        "",
+        "Mean time per stage:",
+    ]
+    for stage, (count, total) in sorted(stages.items()):
+        report.append(f"  {stage}: {total / count * 1000:.3f} ms over {count} spans")
+    return "\n".join(report)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replays chat messages through the Twitch bot's message handler")
+    parser.add_argument("--database", required=True, help="database to run the bot against, not the bot's own")
+    parser.add_argument("--source", choices=("db", "synthetic", "file"), default="db")
+    parser.add_argument("--channel", help="channel to take the messages from or to generate them for")
+    parser.add_argument("--file", help="JSON lines file with channel, sender and message fields")
+    parser.add_argument("--export", help="saves the replayed messages into a JSON lines file")
+    parser.add_argument("--count", type=int, default=10_000, help="number of messages to read or generate")
+    parser.add_argument("--hours", type=int, default=24, help="how far back to read recorded messages from")
+    parser.add_argument("--chatters", type=int, default=500, help="number of synthetic chatters")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--concurrency", type=int, default=16, help="messages handled at the same time")
+    parser.add_argument("--warmup", type=int, default=500, help="messages replayed before measuring to fill caches")
+    parser.add_argument("--alloc-sample", type=int, default=1000, help="messages replayed with tracemalloc on")
+    parser.add_argument(
+        "--commands", action="store_true", help="loads the cogs, which also starts their background tasks"
+    )
+    args = parser.parse_args()
+    if args.source == "file" and args.file is None:
+        parser.error("--file is required with --source file")
+    if args.source != "file" and args.channel is None:
+        parser.error("--channel is required with --source db and --source synthetic")
+    if args.database == os.getenv("PGDATABASE"):
+        parser.error("--database must not be the bot's database, the replayed commands write into it")
+    if args.channel is not None:
+        args.channel = args.channel.lower()
+
+    os.environ["PGDATABASE"] = args.database
+    queries = QueryCounter()
+    bot = Bot(load_modules=args.commands, localhost=True, pool_init=queries.install)
+    report = bot.loop.run_until_complete(benchmark(bot, queries, args))
+    bot.loop.run_until_complete(bot.message_logger.close())
+    bot.loop.run_until_complete(bot.emote_counter.close())
+    bot.loop.run_until_complete(listener.stop())
+    bot.loop.run_until_complete(bot.con_pool.close())
+
+    print(report)
+    timestamp = datetime.now(UTC).strftime("%Y%m%d%H%M%S")
+    file_path = os.path.join(get_output_path(), f"{timestamp}_chat_replay_benchmark.txt")
+    with open(file_path, "w") as file:
+        file.write(report + "\n")
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    main()
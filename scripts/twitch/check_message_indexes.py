@@ -0,0 +1,143 @@
+"""
+Checks with EXPLAIN that every query shared/database/twitch/messages.py runs against twitch.messages uses an index.
+
+The functions are called with a connection that only records the queries and their arguments, so nothing is run
+against the table apart from the EXPLAINs. On a small development database the planner rightly prefers sequential
+scans; use --disable-seqscan there to check that the indexes can be used at all.
+
+Example:
+    python scripts/twitch/check_message_indexes.py --channel forsen --user forsen
+"""
+
+import argparse
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, UTC
+import json
+import os
+import sys
+from typing import Any, AsyncIterator, Awaitable, Callable
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from dotenv import load_dotenv
+
+from shared import database
+from shared.database.twitch import channels, messages
+
+
+# Tables the message log queries read; partitions and indexes are named after their table
+LOGGED_TABLES = ("messages", "channel_chatter_stats", "emote_usage")
+
+
+class RecordingConnection:
+    """Stands in for a connection and records the queries instead of running them"""
+
+    def __init__(self) -> None:
+        self.queries: list[tuple[str, tuple[Any, ...]]] = []
+
+    @asynccontextmanager
+    async def transaction(self, **kwargs) -> AsyncIterator[None]:
+        yield
+
+    async def fetch(self, query: str, *args) -> list:
+        self.queries.append((query, args))
+        return []
+
+    async def fetchrow(self, query: str, *args) -> None:
+        self.queries.append((query, args))
+        return None
+
+    async def fetchval(self, query: str, *args) -> int:
+        self.queries.append((query, args))
+        return 0
+
+
+class RecordingPool:
+    def __init__(self) -> None:
+        self.connection = RecordingConnection()
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[RecordingConnection]:
+        yield self.connection
+
+
+def read_paths(channel_id: str, user: str) -> dict[str, Callable[[Any], Awaitable[Any]]]:
+    filters: dict[str, Any] = {
+        "included_words": [],
+        "excluded_words": [],
+        "min_word_count": None,
+        "max_word_count": None,
+    }
+    prefixes = ("!",)
+    return {
+        "random_message": lambda pool: messages.random_message(pool, channel_id, None, **filters, prefixes=prefixes),
+        "random_message by sender": lambda pool: messages.random_message(
+            pool, channel_id, user, **filters, prefixes=prefixes
+        ),
+        "random_message with words": lambda pool: messages.random_message(
+            pool, channel_id, user, **{**filters, "included_words": ["hello"], "min_word_count": 3}
+        ),
+        "number_of_messages": lambda pool: messages.number_of_messages(pool, channel_id, None, **filters),
+        "number_of_messages by sender": lambda pool: messages.number_of_messages(pool, channel_id, user, **filters),
+        "past_messages": lambda pool: messages.past_messages(
+            pool, channel_id, datetime.now(UTC) - timedelta(hours=1), 100
+        ),
+        "top_chatters": lambda pool: messages.top_chatters(pool, channel_id, os.environ["BOT_NICK"], 10),
+        "emote_count": lambda pool: messages.emote_count(pool, channel_id, "Okayge"),
+        "emote_counts": lambda pool: messages.emote_counts(pool, channel_id, ["Okayge"]),
+        "first_message": lambda pool: messages.first_message(pool, channel_id, user),
+        "last_seen": lambda pool: messages.last_seen(pool, channel_id, user),
+    }
+
+
+def reads_logged_table(name: str) -> bool:
+    return any(name == table or name.startswith(f"{table}_") for table in LOGGED_TABLES)
+
+
+def scans_of_messages(plan: dict) -> list[tuple[str, str | None]]:
+    """
+    Returns the node type and index name of every plan node that reads twitch.messages, one of its partitions or
+    the statistics kept from it
+    """
+    scans = []
+    if reads_logged_table(plan.get("Relation Name", "")) or reads_logged_table(plan.get("Index Name", "")):
+        scans.append((plan["Node Type"], plan.get("Index Name")))
+    for child in plan.get("Plans", []):
+        scans.extend(scans_of_messages(child))
+    return scans
+
+
+async def check(channel: str, user: str, disable_seqscan: bool) -> bool:
+    pool = await database.init_pool(asyncio.get_event_loop(), localhost=True)
+    channel_id = await channels.channel_id(pool, channel)
+
+    all_use_index = True
+    async with pool.acquire() as con:
+        if disable_seqscan:
+            await con.execute("SET enable_seqscan = off;")
+        for name, call in read_paths(channel_id, user).items():
+            recorder = RecordingPool()
+            await call(recorder)
+            for query, args in recorder.connection.queries:
+                explained = await con.fetchval(f"EXPLAIN (FORMAT JSON) {query}", *args)
+                scans = scans_of_messages(json.loads(explained)[0]["Plan"])
+                uses_index = len(scans) > 0 and all(node_type != "Seq Scan" for node_type, _ in scans)
+                all_use_index = all_use_index and uses_index
+                used = ", ".join(f"{node_type} ({index})" if index else node_type for node_type, index in scans)
+                print(f"{'OK  ' if uses_index else 'FAIL'} {name}: {used}")
+        if disable_seqscan:
+            await con.execute("RESET enable_seqscan;")
+    await pool.close()
+    return all_use_index
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Checks that the message log queries use an index")
+    parser.add_argument("--channel", required=True, help="channel whose id is used in the queries")
+    parser.add_argument("--user", required=True, help="chatter whose name is used in the queries")
+    parser.add_argument("--disable-seqscan", action="store_true", help="makes the planner avoid sequential scans")
+    args = parser.parse_args()
+    if not asyncio.run(check(args.channel.lower(), args.user.lower(), args.disable_seqscan)):
+        sys.exit(1)
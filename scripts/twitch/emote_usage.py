@@ -1,10 +1,12 @@
 import asyncio
-from datetime import datetime, UTC
+from collections import Counter
+from datetime import datetime, timedelta, UTC
 import os
 import sys
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
 
+from asyncpg import Pool
 from dotenv import load_dotenv
 
 from output_folder import get_output_path
@@ -14,7 +16,35 @@ from shared.database.twitch import channels, messages
 from shared.util.formatting import format_timedelta
 
 
-async def emote_usage(channel: str):
+async def count_from_logs(
+    con_pool: Pool, channel_id: str, emote_names: list[str], since: datetime | None
+) -> Counter[str]:
+    """Counts the emotes while streaming the chat logs, keeping only the counts of the emotes in memory"""
+    emotes = frozenset(emote_names)
+    emote_frequency: Counter[str] = Counter({emote: 0 for emote in emotes})
+    # Includes the bot's and older messages, so it's only an upper bound for the progress
+    total = await messages.number_of_messages(
+        con_pool,
+        channel_id,
+        None,
+        included_words=[],
+        excluded_words=[],
+        min_word_count=None,
+        max_word_count=None,
+    )
+    counted = 0
+    async for chunk in messages.message_chunks(con_pool, channel_id, os.environ["BOT_NICK"], since):
+        for _, message in chunk:
+            for word in message.split():
+                if word in emotes:
+                    emote_frequency[word] += 1
+        counted += len(chunk)
+        print(f"\rCounted {counted} of at most {total} messages", end="", flush=True)
+    print()
+    return emote_frequency
+
+
+async def emote_usage(channel: str, days: int | None):
     con_pool = await database.init_pool(asyncio.get_event_loop(), localhost=True)
     try:
         channel_id = await channels.channel_id(con_pool, channel)
@@ -29,7 +59,18 @@ async def emote_usage(channel: str):
     if len(emote_names) == 0:
         print("Channel doesn't have any 7tv emotes")
         return
-    emote_frequency = await messages.emote_counts(con_pool, channel_id, emote_names)
+    since = None if days is None else datetime.now(UTC).date() - timedelta(days=days - 1)
+    start = None if since is None else datetime(since.year, since.month, since.day, tzinfo=UTC)
+    # The counts are only used when they have every use in the range, the chat logs are counted otherwise
+    counted_from = await messages.emote_usage_counted_from(con_pool, channel_id)
+    if counted_from is None:
+        print("No emote usage has been counted for the channel yet, counting it from the chat logs")
+        emote_frequency = await count_from_logs(con_pool, channel_id, emote_names, start)
+    elif (start or datetime.min.replace(tzinfo=UTC)) < counted_from:
+        print(f"Emote usage has been counted since {counted_from:%Y-%m-%d %H:%M} UTC, counting it from the chat logs")
+        emote_frequency = await count_from_logs(con_pool, channel_id, emote_names, start)
+    else:
+        emote_frequency = await messages.emote_counts(con_pool, channel_id, emote_names, since)
 
     usage = []
     for i, emote in enumerate(emote_frequency.most_common(), 1):
@@ -48,4 +89,5 @@ async def emote_usage(channel: str):
 if __name__ == "__main__":
     load_dotenv()
     channel = input("Name the channel you want to get emote usage from: ")
-    asyncio.run(emote_usage(channel.lower()))
+    days = input("Number of days to count the usage over (leave empty for all time): ")
+    asyncio.run(emote_usage(channel.lower(), int(days) if days.strip() != "" else None))
@@ -1,19 +1,37 @@
 import asyncio
 import os
+from typing import Awaitable, Callable
 
 import asyncpg
 
 
-async def init_pool(loop: asyncio.AbstractEventLoop, *, localhost: bool = False) -> asyncpg.Pool:
+def _connection_params(localhost: bool) -> dict[str, str]:
+    return {
+        "user": os.environ["PGUSER"],
+        "password": os.environ["PGPASSWORD"],
+        "database": os.environ["PGDATABASE"],
+        "host": "localhost" if localhost else os.environ["PGHOST"],
+        "port": os.environ["PGPORT"],
+    }
+
+
+async def init_pool(
+    loop: asyncio.AbstractEventLoop,
+    *,
+    localhost: bool = False,
+    init: Callable[[asyncpg.Connection], Awaitable[None]] | None = None,
+) -> asyncpg.Pool:
     pool = await asyncpg.create_pool(
-        user=os.environ["PGUSER"],
-        password=os.environ["PGPASSWORD"],
-        database=os.environ["PGDATABASE"],
-        host="localhost" if localhost else os.environ["PGHOST"],
-        port=os.environ["PGPORT"],
+        **_connection_params(localhost),
         min_size=2,
         max_size=10,
+        init=init,
         loop=loop,
     )
     assert pool is not None
     return pool
+
+
+async def connect(loop: asyncio.AbstractEventLoop, *, localhost: bool = False) -> asyncpg.Connection:
+    """Opens a standalone connection outside of the pool, e.g. for a long-lived LISTEN"""
+    return await asyncpg.connect(**_connection_params(localhost), loop=loop)
@@ -0,0 +1,111 @@
+import asyncio
+from typing import Callable
+
+import asyncpg
+
+from shared import database
+
+
+class NotificationListener:
+    """
+    Keeps a dedicated connection LISTENing to the change notifications sent by the triggers in the database.
+    In-memory caches register handlers to drop entries that changed in any process. While the listener isn't
+    connected, notifications can be missed, so caches should bypass themselves when `active` is false.
+    """
+
+    def __init__(self) -> None:
+        self._handlers: dict[str, list[Callable[[str], None]]] = {}
+        self._reset_handlers: list[Callable[[], None]] = []
+        self._connection: asyncpg.Connection | None = None
+        # The channels LISTENed to on the current connection
+        self._listening: set[str] = set()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._localhost = False
+
+    @property
+    def active(self) -> bool:
+        return (
+            self._connection is not None
+            and not self._connection.is_closed()
+            and self._listening.issuperset(self._handlers)
+        )
+
+    def subscribe(self, channel: str, handler: Callable[[str], None]) -> None:
+        """
+        Calls the handler with the payload of every notification sent to the channel. When the listener is already
+        connected, the channel is LISTENed to in the background and the listener isn't active until it is.
+        """
+        self._handlers.setdefault(channel, []).append(handler)
+        if self._connection is not None and channel not in self._listening:
+            assert self._loop is not None
+            self._loop.create_task(self._listen(self._connection, channel))
+
+    async def _listen(self, connection: asyncpg.Connection, channel: str) -> None:
+        if channel in self._listening:
+            return
+        await connection.add_listener(channel, self._dispatch)
+        if self._connection is connection:
+            self._listening.add(channel)
+            # Entries cached before the LISTEN may have missed notifications
+            self._reset()
+
+    def on_reset(self, handler: Callable[[], None]) -> None:
+        """Calls the handler whenever notifications may have been missed and caches have to start over"""
+        self._reset_handlers.append(handler)
+
+    async def start(self, loop: asyncio.AbstractEventLoop, *, localhost: bool = False) -> None:
+        self._loop = loop
+        self._localhost = localhost
+        await self._connect()
+
+    async def stop(self) -> None:
+        connection = self._connection
+        self._connection = None
+        self._listening = set()
+        if connection is not None:
+            await connection.close()
+        self._reset()
+
+    async def _connect(self) -> None:
+        assert self._loop is not None
+        connection = await database.connect(self._loop, localhost=self._localhost)
+        channels = set(self._handlers)
+        for channel in channels:
+            await connection.add_listener(channel, self._dispatch)
+        connection.add_termination_listener(self._terminated)
+        self._connection = connection
+        self._listening = channels
+        # Channels subscribed to while connecting
+        for channel in set(self._handlers) - channels:
+            self._loop.create_task(self._listen(connection, channel))
+        # Anything cached before the connection was established may have missed notifications
+        self._reset()
+
+    async def _reconnect(self) -> None:
+        delay = 1
+        while self._connection is None:
+            await asyncio.sleep(delay)
+            try:
+                await self._connect()
+            except (OSError, asyncio.TimeoutError, asyncpg.PostgresError):
+                delay = min(delay * 2, 60)
+
+    def _dispatch(self, connection: asyncpg.Connection, pid: int, channel: str, payload: str) -> None:
+        for handler in self._handlers.get(channel, []):
+            handler(payload)
+
+    def _terminated(self, connection: asyncpg.Connection) -> None:
+        if self._connection is not connection:
+            return
+        self._connection = None
+        self._listening = set()
+        self._reset()
+        assert self._loop is not None
+        self._loop.create_task(self._reconnect())
+
+    def _reset(self) -> None:
+        for handler in self._reset_handlers:
+            handler()
+
+
+listener = NotificationListener()
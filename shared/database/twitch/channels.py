@@ -1,110 +1,138 @@
+from functools import wraps
+
 from asyncpg import Pool, Record
 
 from .models import ChannelConfig
 from shared.database.exceptions import asyncpg_error_handler
+from shared.database.listener import listener
 
 
-@asyncpg_error_handler
-async def initial_channels(pool: Pool) -> list[str]:
+_CHANNEL_CONFIG_QUERY = """
+    SELECT 
+        j.channel_id, 
+        username,
+        currently_online,
+        joined_at,
+        logging,
+        emote_streaks,
+        commands_online,
+        reminds_online,
+        notifications_online,
+        outside_reminds,
+        disabled_commands,
+        banned_users,
+        prefixes
+    FROM twitch.joined_channels j JOIN twitch.channel_config c ON j.channel_id = c.channel_id
+"""
+
+# Process-wide registry of the configs of the joined channels keyed by channel id along with an index
+# from channel name to id. Entries are dropped when the triggers on joined_channels and channel_config
+# send a notification, so every process sees the changes made by the others.
+_configs: dict[str, ChannelConfig] = {}
+_channel_ids: dict[str, str] = {}
+# Incremented on every invalidation so that a result fetched before it isn't stored after it
+_version = 0
+
+
+def _forget(channel_id: str) -> None:
+    global _version
+    _version += 1
+    config = _configs.pop(channel_id, None)
+    if config is not None:
+        _channel_ids.pop(config.username, None)
+
+
+def _forget_all() -> None:
+    global _version
+    _version += 1
+    _configs.clear()
+    _channel_ids.clear()
+
+
+def _remember(config: ChannelConfig, version: int) -> None:
+    if version != _version or not listener.active:
+        return
+    _configs[config.channel_id] = config
+    _channel_ids[config.username] = config.channel_id
+
+
+listener.subscribe("channel_changed", _forget)
+listener.on_reset(_forget_all)
+
+
+def _invalidates_channel(func):
+    """Drops the channel from the registry right away instead of waiting for the notification"""
+
+    @wraps(func)
+    async def wrapper(pool: Pool, channel_id: str, *args, **kwargs):
+        try:
+            return await func(pool, channel_id, *args, **kwargs)
+        finally:
+            _forget(channel_id)
+
+    return wrapper
+
+
+async def _load_channels(pool: Pool) -> list[ChannelConfig]:
+    version = _version
     async with pool.acquire() as con:
         async with con.transaction(readonly=True):
-            results: list[Record] = await con.fetch(
-                """
-                SELECT username 
-                FROM twitch.joined_channels;
-                """
-            )
-            return [result["username"] for result in results]
+            results: list[Record] = await con.fetch(_CHANNEL_CONFIG_QUERY + ";")
+            configs = [ChannelConfig(**result) for result in results]
+    for config in configs:
+        _remember(config, version)
+    return configs
+
+
+@asyncpg_error_handler
+async def initial_channels(pool: Pool) -> list[str]:
+    return [config.username for config in await _load_channels(pool)]
 
 
 @asyncpg_error_handler
 async def initial_channel_ids(pool: Pool) -> set[str]:
-    async with pool.acquire() as con:
-        async with con.transaction(readonly=True):
-            results: list[Record] = await con.fetch(
-                """
-                SELECT channel_id 
-                FROM twitch.joined_channels;
-                """
-            )
-            return set(result["channel_id"] for result in results)
+    return set(config.channel_id for config in await _load_channels(pool))
 
 
 @asyncpg_error_handler
 async def channel_config(pool: Pool, channel: str) -> ChannelConfig:
+    channel_id = _channel_ids.get(channel)
+    if channel_id is not None and channel_id in _configs:
+        return _configs[channel_id]
+
+    version = _version
     async with pool.acquire() as con:
         async with con.transaction(readonly=True):
-            result: Record | None = await con.fetchrow(
-                """
-                SELECT 
-                    j.channel_id, 
-                    username,
-                    currently_online,
-                    joined_at,
-                    logging,
-                    emote_streaks,
-                    commands_online,
-                    reminds_online,
-                    notifications_online,
-                    outside_reminds,
-                    disabled_commands,
-                    banned_users,
-                    prefixes
-                FROM twitch.joined_channels j JOIN twitch.channel_config c ON j.channel_id = c.channel_id
-                WHERE username = $1;
-                """,
-                channel,
-            )
+            result: Record | None = await con.fetchrow(_CHANNEL_CONFIG_QUERY + "WHERE username = $1;", channel)
             assert result is not None
-            return ChannelConfig(**result)
+            config = ChannelConfig(**result)
+    _remember(config, version)
+    return config
 
 
 @asyncpg_error_handler
 async def channel_config_from_id(pool: Pool, channel_id: str) -> ChannelConfig:
+    if channel_id in _configs:
+        return _configs[channel_id]
+
+    version = _version
     async with pool.acquire() as con:
         async with con.transaction(readonly=True):
-            result: Record | None = await con.fetchrow(
-                """
-                SELECT 
-                    j.channel_id, 
-                    username,
-                    currently_online,
-                    joined_at,
-                    logging,
-                    emote_streaks,
-                    commands_online,
-                    reminds_online,
-                    notifications_online,
-                    outside_reminds,
-                    disabled_commands,
-                    banned_users,
-                    prefixes
-                FROM twitch.joined_channels j JOIN twitch.channel_config c ON j.channel_id = c.channel_id
-                WHERE j.channel_id = $1;
-                """,
-                channel_id,
-            )
+            result: Record | None = await con.fetchrow(_CHANNEL_CONFIG_QUERY + "WHERE j.channel_id = $1;", channel_id)
             assert result is not None
-            return ChannelConfig(**result)
+            config = ChannelConfig(**result)
+    _remember(config, version)
+    return config
 
 
 @asyncpg_error_handler
 async def channel_id(pool: Pool, channel: str) -> str:
-    async with pool.acquire() as con:
-        async with con.transaction(readonly=True):
-            result: str | None = await con.fetchval(
-                """
-                SELECT channel_id
-                FROM twitch.joined_channels
-                WHERE username = $1;
-                """,
-                channel,
-            )
-            assert result is not None
-            return result
+    config = await channel_config(pool, channel)
+    return config.channel_id
 
 
 @asyncpg_error_handler
+@_invalidates_channel
 async def join_channel(pool: Pool, channel_id: str, channel_name: str) -> None:
     async with pool.acquire() as con:
         async with con.transaction():
@@ -130,6 +158,7 @@ async def join_channel(pool: Pool, channel_id: str, channel_name: str) -> None:
 
 
 @asyncpg_error_handler
+@_invalidates_channel
 async def part_channel(pool: Pool, channel_id: str) -> bool:
     async with pool.acquire() as con:
         async with con.transaction():
@@ -144,6 +173,7 @@ async def part_channel(pool: Pool, channel_id: str) -> bool:
 
 
 @asyncpg_error_handler
+@_invalidates_channel
 async def set_online(pool: Pool, channel_id: str) -> None:
     async with pool.acquire() as con:
         async with con.transaction():
@@ -158,6 +188,7 @@ async def set_online(pool: Pool, channel_id: str) -> None:
 
 
 @asyncpg_error_handler
+@_invalidates_channel
 async def set_offline(pool: Pool, channel_id: str) -> None:
     async with pool.acquire() as con:
         async with con.transaction():
@@ -172,6 +203,7 @@ async def set_offline(pool: Pool, channel_id: str) -> None:
 
 
 @asyncpg_error_handler
+@_invalidates_channel
 async def enable_commands(pool: Pool, channel_id: str, commands: list[str]) -> None:
     async with pool.acquire() as con:
         async with con.transaction():
@@ -186,6 +218,7 @@ async def enable_commands(pool: Pool, channel_id: str, commands: list[str]) -> N
 
 
 @asyncpg_error_handler
+@_invalidates_channel
 async def disable_commands(pool: Pool, channel_id: str, commands: list[str]) -> None:
     async with pool.acquire() as con:
         async with con.transaction():
@@ -200,6 +233,7 @@ async def disable_commands(pool: Pool, channel_id: str, commands: list[str]) ->
 
 
 @asyncpg_error_handler
+@_invalidates_channel
 async def ban_in_channel(pool: Pool, channel_id: str, user_id: str) -> bool:
     async with pool.acquire() as con:
         async with con.transaction():
@@ -216,6 +250,7 @@ async def ban_in_channel(pool: Pool, channel_id: str, user_id: str) -> bool:
 
 
 @asyncpg_error_handler
+@_invalidates_channel
 async def unban_in_channel(pool: Pool, channel_id: str, user_id: str) -> bool:
     async with pool.acquire() as con:
         async with con.transaction():
@@ -232,6 +267,7 @@ async def unban_in_channel(pool: Pool, channel_id: str, user_id: str) -> bool:
 
 
 @asyncpg_error_handler
+@_invalidates_channel
 async def add_prefixes(pool: Pool, channel_id: str, prefixes: list[str]) -> None:
     async with pool.acquire() as con:
         async with con.transaction():
@@ -246,6 +282,7 @@ async def add_prefixes(pool: Pool, channel_id: str, prefixes: list[str]) -> None
 
 
 @asyncpg_error_handler
+@_invalidates_channel
 async def remove_prefixes(pool: Pool, channel_id: str, prefixes: list[str]) -> None:
     async with pool.acquire() as con:
         async with con.transaction():
@@ -260,6 +297,7 @@ async def remove_prefixes(pool: Pool, channel_id: str, prefixes: list[str]) -> N
 
 
 @asyncpg_error_handler
+@_invalidates_channel
 async def logging_on(pool: Pool, channel_id: str) -> bool:
     async with pool.acquire() as con:
         async with con.transaction():
@@ -275,6 +313,7 @@ async def logging_on(pool: Pool, channel_id: str) -> bool:
 
 
 @asyncpg_error_handler
+@_invalidates_channel
 async def logging_off(pool: Pool, channel_id: str) -> bool:
     async with pool.acquire() as con:
         async with con.transaction():
@@ -290,6 +329,7 @@ async def logging_off(pool: Pool, channel_id: str) -> bool:
 
 
 @asyncpg_error_handler
+@_invalidates_channel
 async def emote_streaks_on(pool: Pool, channel_id: str) -> bool:
     async with pool.acquire() as con:
         async with con.transaction():
@@ -305,6 +345,7 @@ async def emote_streaks_on(pool: Pool, channel_id: str) -> bool:
 
 
 @asyncpg_error_handler
+@_invalidates_channel
 async def emote_streaks_off(pool: Pool, channel_id: str) -> bool:
     async with pool.acquire() as con:
         async with con.transaction():
@@ -320,6 +361,7 @@ async def emote_streaks_off(pool: Pool, channel_id: str) -> bool:
 
 
 @asyncpg_error_handler
+@_invalidates_channel
 async def commands_online_on(pool: Pool, channel_id: str) -> bool:
     async with pool.acquire() as con:
         async with con.transaction():
@@ -335,6 +377,7 @@ async def commands_online_on(pool: Pool, channel_id: str) -> bool:
 
 
 @asyncpg_error_handler
+@_invalidates_channel
 async def commands_online_off(pool: Pool, channel_id: str) -> bool:
     async with pool.acquire() as con:
         async with con.transaction():
@@ -350,6 +393,7 @@ async def commands_online_off(pool: Pool, channel_id: str) -> bool:
 
 
 @asyncpg_error_handler
+@_invalidates_channel
 async def reminds_online_on(pool: Pool, channel_id: str) -> bool:
     async with pool.acquire() as con:
         async with con.transaction():
@@ -365,6 +409,7 @@ async def reminds_online_on(pool: Pool, channel_id: str) -> bool:
 
 
 @asyncpg_error_handler
+@_invalidates_channel
 async def reminds_online_off(pool: Pool, channel_id: str) -> bool:
     async with pool.acquire() as con:
         async with con.transaction():
@@ -380,6 +425,7 @@ async def reminds_online_off(pool: Pool, channel_id: str) -> bool:
 
 
 @asyncpg_error_handler
+@_invalidates_channel
 async def outside_reminds_on(pool: Pool, channel_id: str) -> bool:
     async with pool.acquire() as con:
         async with con.transaction():
@@ -395,6 +441,7 @@ async def outside_reminds_on(pool: Pool, channel_id: str) -> bool:
 
 
 @asyncpg_error_handler
+@_invalidates_channel
 async def outside_reminds_off(pool: Pool, channel_id: str) -> bool:
     async with pool.acquire() as con:
         async with con.transaction():
@@ -408,7 +455,9 @@ async def outside_reminds_off(pool: Pool, channel_id: str) -> bool:
             )
             return int(result.split()[-1]) > 0
 
+
 @asyncpg_error_handler
+@_invalidates_channel
 async def notifications_online_on(pool: Pool, channel_id: str) -> bool:
     async with pool.acquire() as con:
         async with con.transaction():
@@ -424,6 +473,7 @@ async def notifications_online_on(pool: Pool, channel_id: str) -> bool:
 
 
 @asyncpg_error_handler
+@_invalidates_channel
 async def notifications_online_off(pool: Pool, channel_id: str) -> bool:
     async with pool.acquire() as con:
         async with con.transaction():
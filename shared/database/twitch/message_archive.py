@@ -0,0 +1,575 @@
+from array import array
+from collections import OrderedDict
+from datetime import datetime, timedelta, UTC
+from functools import lru_cache
+import hashlib
+from itertools import chain
+import json
+import mmap
+import os
+import random
+import struct
+import sys
+import threading
+from typing import Callable, Collection, NamedTuple, Sequence
+import zlib
+
+
+DEFAULT_ARCHIVE_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../..", "archive"))
+
+EPOCH = datetime.fromtimestamp(0, UTC)
+# Decoded columns are kept in memory up to this size, so commands reading the same months don't decompress them again
+COLUMN_CACHE_BYTES = 256 * 1024 * 1024
+# Bits per distinct word and hashes per word of the word filter of a file, about 1% false positives
+WORD_FILTER_BITS_PER_WORD = 10
+WORD_FILTER_HASHES = 7
+# Unfiltered rows tried by a filtered random pick before every row is matched
+RANDOM_ATTEMPTS = 50
+
+# sender key, sent_at, message, word count
+ArchivedRow = tuple[int, datetime, str, int | None]
+
+
+class ArchivedMonth(NamedTuple):
+    channel_id: str
+    year: int
+    month: int
+    first_sent_at: datetime
+    last_sent_at: datetime
+    rows: int
+
+
+class ArchivedMessage(NamedTuple):
+    sender_id: int
+    sent_at: datetime
+    message: str
+
+
+class MessageFilter:
+    """
+    The filter the archived messages are matched with. Words are compared case-insensitively as whole words, without
+    the stemming of the full-text search the database uses. The included words and the word counts are exposed, so
+    the files and senders that can't hold a match are skipped.
+    """
+
+    def __init__(
+        self,
+        included_words: list[str],
+        excluded_words: list[str],
+        min_word_count: int | None,
+        max_word_count: int | None,
+        exclude_prefixes: tuple[str, ...] | None,
+    ) -> None:
+        self.included = {word.lstrip("!").lower() for word in included_words}
+        self.excluded = {word.lower() for word in excluded_words}
+        self.min_word_count = min_word_count
+        self.max_word_count = max_word_count
+        self.prefixes = exclude_prefixes or ()
+
+    def __call__(self, message: str, word_count: int | None) -> bool:
+        if len(self.prefixes) > 0 and message.startswith(self.prefixes):
+            return False
+        if self.min_word_count is not None and (word_count is None or word_count <= self.min_word_count):
+            return False
+        if self.max_word_count is not None and (word_count is None or word_count >= self.max_word_count):
+            return False
+        if len(self.included) + len(self.excluded) > 0:
+            words = set(message.lower().split())
+            if not self.included <= words or not self.excluded.isdisjoint(words):
+                return False
+        return True
+
+    def may_match_word_counts(self, lowest: int | None, highest: int | None) -> bool:
+        """Tells whether messages with word counts from lowest to highest, None without any, may match"""
+        if self.min_word_count is None and self.max_word_count is None:
+            return True
+        if lowest is None or highest is None:
+            return False
+        if self.min_word_count is not None and highest <= self.min_word_count:
+            return False
+        return self.max_word_count is None or lowest < self.max_word_count
+
+
+def _micros(time: datetime) -> int:
+    return (time - EPOCH) // timedelta(microseconds=1)
+
+
+def _time(micros: int) -> datetime:
+    return EPOCH + timedelta(microseconds=micros)
+
+
+def _word_bits(word: str, bits: int, hashes: int) -> list[int]:
+    digest = hashlib.blake2b(word.encode(), digest_size=16).digest()
+    # Double hashing; the step is odd, so it never stays on the same bit
+    first, step = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+    return [(first + i * step) % bits for i in range(hashes)]
+
+
+def _little_endian(values: array) -> bytes:
+    if sys.byteorder != "little":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_little_endian(typecode: str, data: bytes) -> array:
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+
+class _ColumnCache:
+    """The most recently used decoded columns of the archive files, evicted by their total size"""
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self._columns: OrderedDict[tuple[str, int, str], tuple[array | bytes, int]] = OrderedDict()
+        self._bytes = 0
+        # The archive is read from worker threads
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple[str, int, str], load: Callable[[], array | bytes]) -> array | bytes:
+        with self._lock:
+            cached = self._columns.get(key)
+            if cached is not None:
+                self._columns.move_to_end(key)
+                return cached[0]
+        value = load()
+        size = len(value) * value.itemsize if isinstance(value, array) else len(value)
+        with self._lock:
+            if key not in self._columns:
+                self._columns[key] = (value, size)
+                self._bytes += size
+            while self._bytes > self.max_bytes and len(self._columns) > 1:
+                _, (_, evicted) = self._columns.popitem(last=False)
+                self._bytes -= evicted
+        return value
+
+
+_column_cache = _ColumnCache(COLUMN_CACHE_BYTES)
+
+
+class ArchiveFile:
+    """
+    One channel's messages of one month stored column by column, each column compressed on its own. The rows are
+    sorted by sender and time, and the footer holds the row range of every sender together with the first and
+    last time, so reading one chatter's messages only needs the footer and the columns, never a scan for the
+    sender. Sending times are delta encoded and missing word counts are stored as -1. The highest message id
+    archived into the file is kept too, so an interrupted archiving run can be repeated without copying a message
+    twice.
+
+    The senders are stored by their key in the users table, which stays the same when they change their login.
+    Files of version 1 hold the logins instead and are rewritten with the keys by the archiver.
+
+    So that filtered reads don't match every row, the footer also holds the lowest and highest word count of every
+    sender, and a Bloom filter of the lowercased words of all messages is stored as a column of its own. A file or
+    sender that can't hold a match is skipped without decoding its messages; files written before have neither.
+    """
+
+    VERSION = 2
+    _MAGIC = b"PLMA"
+    _TAIL = struct.Struct("<I4s")
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, "rb") as file:
+            file.seek(-self._TAIL.size, os.SEEK_END)
+            footer_length, magic = self._TAIL.unpack(file.read(self._TAIL.size))
+            if magic != self._MAGIC:
+                raise ValueError(f"{path} is not a message archive")
+            file.seek(-self._TAIL.size - footer_length, os.SEEK_END)
+            footer = json.loads(file.read(footer_length))
+            self.mtime = os.fstat(file.fileno()).st_mtime_ns
+        self.version: int = footer.get("version", 1)
+        self.rows: int = footer["rows"]
+        self.max_message_id: int = footer["max_message_id"]
+        self.first_sent_at = _time(footer["first_sent_at"])
+        self.last_sent_at = _time(footer["last_sent_at"])
+        self.senders: dict[int, tuple[int, int]] = {
+            sender: (start, count) for sender, start, count, *_ in footer["senders"]
+        }
+        # The lowest and highest word count of the senders, None for a sender without counted messages
+        self.word_count_ranges: dict[int, tuple[int | None, int | None]] = {
+            sender: (word_counts[0], word_counts[1]) for sender, _, _, *word_counts in footer["senders"] if word_counts
+        }
+        self._word_filter: dict[str, int] | None = footer.get("word_filter")
+        self._columns: dict[str, tuple[int, int]] = footer["columns"]
+
+    def _column(self, name: str) -> bytes:
+        offset, length = self._columns[name]
+        with open(self.path, "rb") as file:
+            file.seek(offset)
+            return zlib.decompress(file.read(length))
+
+    def _cached(self, name: str, load: Callable[[], array | bytes]) -> array | bytes:
+        # The modification time is part of the key like in _open_file, so a month written again isn't read stale
+        return _column_cache.get((self.path, self.mtime, name), load)
+
+    def sent_at(self) -> array:
+        def load() -> array:
+            times = _from_little_endian("q", self._column("sent_at"))
+            total = 0
+            for i, delta in enumerate(times):
+                total += delta
+                times[i] = total
+            return times
+
+        return self._cached("sent_at", load)  # type: ignore
+
+    def word_counts(self) -> array:
+        return self._cached("word_count", lambda: _from_little_endian("i", self._column("word_count")))  # type: ignore
+
+    def _message_offsets(self) -> array:
+        def load() -> array:
+            offsets = array("Q", [0])
+            total = 0
+            for length in _from_little_endian("I", self._column("message_length")):
+                total += length
+                offsets.append(total)
+            return offsets
+
+        return self._cached("message_offsets", load)  # type: ignore
+
+    def message(self, row: int) -> str:
+        """Decodes a single message, without turning the rest of the column into strings"""
+        offsets = self._message_offsets()
+        blob = self._cached("message", lambda: self._column("message"))
+        return blob[offsets[row] : offsets[row + 1]].decode()  # type: ignore
+
+    def messages(self) -> list[str]:
+        return [self.message(row) for row in range(self.rows)]
+
+    def may_contain(self, words: Collection[str]) -> bool:
+        """Tells whether messages of the file may contain all of the lowercased words, without false negatives"""
+        if self._word_filter is None or len(words) == 0:
+            return True
+        bits, hashes = self._word_filter["bits"], self._word_filter["hashes"]
+        word_filter = self._cached("word_filter", lambda: self._column("word_filter"))
+        return all(
+            word_filter[bit >> 3] & (1 << (bit & 7))  # type: ignore
+            for word in words
+            for bit in _word_bits(word, bits, hashes)
+        )
+
+    def candidates(self, sender_ids: Collection[int] | None, matches: MessageFilter | None) -> Sequence[int]:
+        """Returns the rows sent by the senders, or by anyone, that the footer doesn't rule out for the filter"""
+        if matches is not None and not self.may_contain(matches.included):
+            return []
+        selected = list(self.senders) if sender_ids is None else [s for s in sender_ids if s in self.senders]
+        if matches is not None:
+            selected = [
+                sender_id
+                for sender_id in selected
+                if sender_id not in self.word_count_ranges
+                or matches.may_match_word_counts(*self.word_count_ranges[sender_id])
+            ]
+        if sender_ids is None and len(selected) == len(self.senders):
+            return range(self.rows)
+        ranges = [range(start, start + count) for start, count in (self.senders[s] for s in selected)]
+        return ranges[0] if len(ranges) == 1 else list(chain.from_iterable(ranges))
+
+    def matches(self, row: int, matches: MessageFilter) -> bool:
+        word_count = self.word_counts()[row]
+        return matches(self.message(row), word_count if word_count >= 0 else None)
+
+    def matching(self, sender_ids: Collection[int] | None, matches: MessageFilter | None) -> Sequence[int]:
+        """Returns the rows sent by the senders, or by anyone, that match the filter"""
+        rows = self.candidates(sender_ids, matches)
+        if matches is None:
+            return rows
+        return [row for row in rows if self.matches(row, matches)]
+
+    def messages_between(self, start: datetime, end: datetime) -> list[ArchivedMessage]:
+        """Returns the messages sent from start until end"""
+        times = self.sent_at()
+        first, last = _micros(start), _micros(end)
+        return [
+            ArchivedMessage(sender_id, _time(times[row]), self.message(row))
+            for sender_id, (start_row, count) in self.senders.items()
+            for row in range(start_row, start_row + count)
+            if first <= times[row] < last
+        ]
+
+    def sender_at(self, row: int) -> int:
+        for sender_id, (start, count) in self.senders.items():
+            if start <= row < start + count:
+                return sender_id
+        raise IndexError(row)
+
+    def archived_message(self, row: int) -> ArchivedMessage:
+        return ArchivedMessage(self.sender_at(row), _time(self.sent_at()[row]), self.message(row))
+
+    @classmethod
+    def write(cls, path: str, rows: list[ArchivedRow], max_message_id: int) -> None:
+        """Writes the rows into a new file, replacing an existing one only after the new one is on disk"""
+        rows = sorted(rows, key=lambda row: (row[0], row[1]))
+        senders: list[list] = []
+        for i, (sender_id, _, _, word_count) in enumerate(rows):
+            if len(senders) == 0 or senders[-1][0] != sender_id:
+                senders.append([sender_id, i, 0, None, None])
+            sender = senders[-1]
+            sender[2] += 1
+            if word_count is not None:
+                sender[3] = word_count if sender[3] is None else min(sender[3], word_count)
+                sender[4] = word_count if sender[4] is None else max(sender[4], word_count)
+
+        words = {word for _, _, message, _ in rows for word in message.lower().split()}
+        word_filter_bits = max(64, len(words) * WORD_FILTER_BITS_PER_WORD)
+        word_filter = bytearray((word_filter_bits + 7) // 8)
+        for word in words:
+            for bit in _word_bits(word, word_filter_bits, WORD_FILTER_HASHES):
+                word_filter[bit >> 3] |= 1 << (bit & 7)
+
+        deltas = array("q")
+        previous = 0
+        for _, sent_at, _, _ in rows:
+            micros = _micros(sent_at)
+            deltas.append(micros - previous)
+            previous = micros
+        encoded_messages = [message.encode() for _, _, message, _ in rows]
+        columns = {
+            "sent_at": _little_endian(deltas),
+            "word_count": _little_endian(array("i", (-1 if count is None else count for _, _, _, count in rows))),
+            "message_length": _little_endian(array("I", (len(message) for message in encoded_messages))),
+            "message": b"".join(encoded_messages),
+            "word_filter": bytes(word_filter),
+        }
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "wb") as file:
+            offsets = {}
+            for name, data in columns.items():
+                compressed = zlib.compress(data, 9)
+                offsets[name] = (file.tell(), len(compressed))
+                file.write(compressed)
+            footer = json.dumps(
+                {
+                    "version": cls.VERSION,
+                    "rows": len(rows),
+                    "max_message_id": max_message_id,
+                    "first_sent_at": min(_micros(sent_at) for _, sent_at, _, _ in rows),
+                    "last_sent_at": max(_micros(sent_at) for _, sent_at, _, _ in rows),
+                    "senders": senders,
+                    "word_filter": {"bits": word_filter_bits, "hashes": WORD_FILTER_HASHES},
+                    "columns": offsets,
+                }
+            ).encode()
+            file.write(footer)
+            file.write(cls._TAIL.pack(len(footer), cls._MAGIC))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, path)
+
+    def read_all(self) -> list[ArchivedRow]:
+        times = self.sent_at()
+        messages = self.messages()
+        word_counts = self.word_counts()
+        return [
+            (sender_id, _time(times[row]), messages[row], word_counts[row] if word_counts[row] >= 0 else None)
+            for sender_id, (start, count) in self.senders.items()
+            for row in range(start, start + count)
+        ]
+
+
+class MessageArchive:
+    """
+    Chat logs moved out of the database, one file per channel and month. A memory-mapped index with a fixed size
+    record per file, sorted by channel and month, tells which months of a channel are archived without opening
+    their files. The index is replaced as a whole by the archiver and mapped again when it changes.
+    """
+
+    _HEADER = struct.Struct("<4sI")
+    _MAGIC = b"PLMI"
+    # channel id, year, month, first and last sending time in microseconds and the number of rows
+    _RECORD = struct.Struct("<32sHBqqq")
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+        self._index_path = os.path.join(root, "index.bin")
+        self._map: mmap.mmap | None = None
+        self._mtime = 0
+
+    def month_path(self, channel_id: str, year: int, month: int) -> str:
+        return os.path.join(self.root, channel_id, f"{year:04d}_{month:02d}.arc")
+
+    def _index(self) -> mmap.mmap | None:
+        try:
+            mtime = os.stat(self._index_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        if self._map is None or mtime != self._mtime:
+            with open(self._index_path, "rb") as file:
+                self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mtime = mtime
+        return self._map
+
+    def months(self, channel_id: str) -> list[ArchivedMonth]:
+        index = self._index()
+        if index is None:
+            return []
+        magic, count = self._HEADER.unpack_from(index, 0)
+        if magic != self._MAGIC:
+            return []
+        key = channel_id.encode().ljust(32, b"\0")
+
+        # Binary search for the first record of the channel
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            if index[self._offset(middle) : self._offset(middle) + 32] < key:
+                low = middle + 1
+            else:
+                high = middle
+        months = []
+        for i in range(low, count):
+            record_channel, year, month, first, last, rows = self._RECORD.unpack_from(index, self._offset(i))
+            if record_channel != key:
+                break
+            months.append(ArchivedMonth(channel_id, year, month, _time(first), _time(last), rows))
+        return months
+
+    def _offset(self, record: int) -> int:
+        return self._HEADER.size + record * self._RECORD.size
+
+    def file(self, month: ArchivedMonth) -> ArchiveFile:
+        path = self.month_path(month.channel_id, month.year, month.month)
+        return _open_file(path, os.stat(path).st_mtime_ns)
+
+    def rebuild_index(self) -> None:
+        records = []
+        for channel_id in sorted(os.listdir(self.root)):
+            directory = os.path.join(self.root, channel_id)
+            if not os.path.isdir(directory):
+                continue
+            for name in sorted(os.listdir(directory)):
+                if not name.endswith(".arc"):
+                    continue
+                year, month = (int(part) for part in name.removesuffix(".arc").split("_"))
+                archive_file = ArchiveFile(os.path.join(directory, name))
+                records.append(
+                    (
+                        channel_id.encode().ljust(32, b"\0"),
+                        year,
+                        month,
+                        _micros(archive_file.first_sent_at),
+                        _micros(archive_file.last_sent_at),
+                        archive_file.rows,
+                    )
+                )
+        records.sort()
+
+        temporary_path = f"{self._index_path}.tmp"
+        with open(temporary_path, "wb") as file:
+            file.write(self._HEADER.pack(self._MAGIC, len(records)))
+            for record in records:
+                file.write(self._RECORD.pack(*record))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, self._index_path)
+
+    def message_count(
+        self, channel_id: str, sender_ids: Collection[int] | None, matches: MessageFilter | None = None
+    ) -> int:
+        if sender_ids is None and matches is None:
+            return sum(month.rows for month in self.months(channel_id))
+        return sum(len(self.file(month).matching(sender_ids, matches)) for month in self.months(channel_id))
+
+    def first_message(self, channel_id: str, sender_ids: Collection[int]) -> ArchivedMessage | None:
+        return self._edge_message(channel_id, sender_ids, first=True)
+
+    def last_message(self, channel_id: str, sender_ids: Collection[int]) -> ArchivedMessage | None:
+        return self._edge_message(channel_id, sender_ids, first=False)
+
+    def _edge_message(self, channel_id: str, sender_ids: Collection[int], *, first: bool) -> ArchivedMessage | None:
+        months = self.months(channel_id)
+        for month in months if first else reversed(months):
+            archive_file = self.file(month)
+            # A sender's rows are sorted by time, so only the edge row of every key of the user is compared
+            rows = [
+                start if first else start + count - 1
+                for start, count in (
+                    archive_file.senders[sender_id] for sender_id in sender_ids if sender_id in archive_file.senders
+                )
+            ]
+            if len(rows) == 0:
+                continue
+            times = archive_file.sent_at()
+            row = min(rows, key=times.__getitem__) if first else max(rows, key=times.__getitem__)
+            return archive_file.archived_message(row)
+        return None
+
+    def random_message(
+        self, channel_id: str, sender_ids: Collection[int] | None, matches: MessageFilter | None
+    ) -> ArchivedMessage | None:
+        """
+        Picks a random message of the senders, or of anyone, that matches the filter. With a filter, random rows of
+        the files and senders that aren't ruled out are tried first; an accepted one is as uniform a pick among the
+        matching rows as matching all of them, which is only done when none of the tries match.
+        """
+        files = [self.file(month) for month in self.months(channel_id)]
+        candidates = [(archive_file, archive_file.candidates(sender_ids, matches)) for archive_file in files]
+        if matches is not None:
+            for _ in range(RANDOM_ATTEMPTS):
+                picked = _pick(candidates)
+                if picked is None:
+                    return None
+                archive_file, row = picked
+                if archive_file.matches(row, matches):
+                    return archive_file.archived_message(row)
+            candidates = [(archive_file, archive_file.matching(sender_ids, matches)) for archive_file in files]
+        picked = _pick(candidates)
+        if picked is None:
+            return None
+        archive_file, row = picked
+        return archive_file.archived_message(row)
+
+
+def _pick(candidates: list[tuple[ArchiveFile, Sequence[int]]]) -> tuple[ArchiveFile, int] | None:
+    """Picks one of the rows of the files uniformly"""
+    total = sum(len(rows) for _, rows in candidates)
+    if total == 0:
+        return None
+    pick = random.randrange(total)
+    for archive_file, rows in candidates:
+        if pick < len(rows):
+            return archive_file, rows[pick]
+        pick -= len(rows)
+    return None
+
+
+@lru_cache(maxsize=64)
+def _open_file(path: str, mtime: int) -> ArchiveFile:
+    # The modification time is part of the key, so a month that is written again isn't read from a stale footer
+    return ArchiveFile(path)
+
+
+def message_filter(
+    included_words: list[str],
+    excluded_words: list[str],
+    min_word_count: int | None,
+    max_word_count: int | None,
+    exclude_prefixes: tuple[str, ...] | None,
+) -> MessageFilter | None:
+    """Builds the filter the archived messages are matched with, or None when nothing is filtered"""
+    matches = MessageFilter(included_words, excluded_words, min_word_count, max_word_count, exclude_prefixes)
+    if (
+        len(matches.included) + len(matches.excluded) == 0
+        and min_word_count is None
+        and max_word_count is None
+        and len(matches.prefixes) == 0
+    ):
+        return None
+    return matches
+
+
+_archive: MessageArchive | None = None
+
+
+def archive() -> MessageArchive:
+    global _archive
+    if _archive is None:
+        _archive = MessageArchive(os.getenv("MESSAGE_ARCHIVE_PATH") or DEFAULT_ARCHIVE_PATH)
+    return _archive
@@ -0,0 +1,79 @@
+from asyncpg import Pool, Record
+
+from . import channels, reminders, users
+from .models import AfkStatus, MessageContext, Reminder
+from shared.database.exceptions import asyncpg_error_handler
+
+
+@asyncpg_error_handler
+async def message_context(pool: Pool, channel: str, user_id: str) -> MessageContext:
+    # The configs come from the in-memory caches, so only the pending afk and reminders may need a query
+    channel_config = await channels.channel_config(pool, channel)
+    user_config = await users.user_config(pool, user_id)
+    context = MessageContext(channel_config=channel_config, user_config=user_config)
+    if not reminders.may_have_pending(channel_config.channel_id, user_id):
+        return context
+
+    async with pool.acquire() as con:
+        # A single statement is atomic by itself so it's not wrapped in a transaction to save two round-trips
+        results: list[Record] = await con.fetch(
+            """
+            SELECT
+                id,
+                channel_id,
+                NULL::text AS sender_id,
+                target_id,
+                NULL::text AS message,
+                kind,
+                created_at,
+                NULL::timestamptz AS scheduled_at
+            FROM twitch.afks
+            WHERE
+                channel_id = $1 AND
+                target_id = $2 AND
+                created_at < CURRENT_TIMESTAMP - INTERVAL '5 seconds' AND
+                processed_at IS NULL
+            UNION ALL
+            SELECT
+                id,
+                channel_id,
+                sender_id,
+                target_id,
+                message,
+                NULL::twitch.afk_type AS kind,
+                created_at,
+                scheduled_at
+            FROM twitch.reminders
+            WHERE
+                target_id = $2 AND
+                created_at < CURRENT_TIMESTAMP - INTERVAL '5 seconds' AND
+                scheduled_at IS NULL AND
+                processed_at IS NULL;
+            """,
+            channel_config.channel_id,
+            user_id,
+        )
+
+    for result in results:
+        if result["kind"] is not None:
+            if context.afk_status is None:
+                context.afk_status = AfkStatus(
+                    id=result["id"],
+                    channel_id=result["channel_id"],
+                    target_id=result["target_id"],
+                    kind=result["kind"],
+                    created_at=result["created_at"],
+                )
+        else:
+            context.reminders.append(
+                Reminder(
+                    id=result["id"],
+                    channel_id=result["channel_id"],
+                    sender_id=result["sender_id"],
+                    target_id=result["target_id"],
+                    message=result["message"],
+                    created_at=result["created_at"],
+                    scheduled_at=result["scheduled_at"],
+                )
+            )
+    return context
@@ -1,11 +1,68 @@
+import asyncio
 from collections import Counter
-from datetime import datetime
-import os
+from datetime import date, datetime, UTC
+import random
+from typing import AsyncIterator, Literal
 
-from asyncpg import Pool, Record
+from asyncpg import Connection, Pool, PostgresError, Record
 
+from . import message_archive, users
 from .models import BlockedTerm, Message
-from shared.database.exceptions import asyncpg_error_handler
+from shared.database.exceptions import asyncpg_error_handler, DatabaseError
+from shared.database.listener import listener
+
+
+# Result sets up to this size are sampled exactly with ORDER BY RANDOM()
+EXACT_SAMPLE_LIMIT = 1000
+# Random points in time tried before the last message found is taken as it is
+TIME_PROBE_ATTEMPTS = 30
+# A probe lands on a message with a probability proportional to the time since the message before it, so it's
+# only accepted with the probability min(1, GAP_FRACTION * average gap / gap); the smaller the fraction, the
+# closer the pick is to uniform and the more probes it takes
+GAP_FRACTION = 0.1
+# Percentages of the table's pages read by TABLESAMPLE before falling back to the exact sample
+TABLESAMPLE_PERCENTS = (0.05, 0.5, 5.0)
+
+
+def _message_filters(
+    channel_id: str,
+    sender: str | None,
+    included_words: list[str],
+    excluded_words: list[str],
+    min_word_count: int | None,
+    max_word_count: int | None,
+    exclude_commands: bool,
+    prefixes: tuple[str, ...] | None,
+) -> tuple[str, list]:
+    """Returns the WHERE conditions for the messages matching the filters and the parameters they use"""
+    params: list = [channel_id]
+    conditions = "channel_id = $1"
+
+    if sender is not None:
+        conditions += " AND sender_id = (SELECT id FROM twitch.users WHERE login = $2)"
+        params.append(sender)
+
+    if len(included_words) + len(excluded_words) > 0:
+        conditions += f" AND tsv @@ to_tsquery('english', ${len(params)+1})"
+        search_query = " & ".join(
+            [word.lstrip("!") for word in included_words] + [f"!{word}" for word in excluded_words]
+        )
+        params.append(search_query)
+
+    if min_word_count is not None:
+        conditions += f" AND word_count > ${len(params)+1}"
+        params.append(min_word_count)
+
+    if max_word_count is not None:
+        conditions += f" AND word_count < ${len(params)+1}"
+        params.append(max_word_count)
+
+    if exclude_commands and prefixes is not None and len(prefixes) > 0:
+        for prefix in prefixes:
+            conditions += f" AND NOT message LIKE ${len(params)+1}"
+            params.append(prefix.replace("%", r"\%") + "%")
+
+    return conditions, params
 
 
 @asyncpg_error_handler
@@ -21,49 +78,198 @@ async def random_message(
     exclude_commands: bool = True,
     prefixes: tuple[str, ...] | None = None,
 ) -> Message | None:
+    """
+    Picks a random message matching the filters without sorting all of them. Without word filters a random point
+    in time between the first and the last message is picked and the next matching message is read from the
+    index, and it's accepted or rejected by the time since the message before it, so messages sent after a quiet
+    period aren't favoured. With word filters the message is picked from a growing TABLESAMPLE of the table. Small
+    result sets and unsuccessful samples use ORDER BY RANDOM().
+
+    Archived messages are picked in proportion to their share of all messages when there are no word filters, and
+    otherwise only when none of the logged messages match.
+    """
+    conditions, params = _message_filters(
+        channel_id,
+        sender,
+        included_words,
+        excluded_words,
+        min_word_count,
+        max_word_count,
+        exclude_commands,
+        prefixes,
+    )
+    word_filters = (
+        len(included_words) + len(excluded_words) > 0
+        or min_word_count is not None
+        or max_word_count is not None
+    )
+    archive = message_archive.archive()
+    matches = message_archive.message_filter(
+        included_words, excluded_words, min_word_count, max_word_count, prefixes if exclude_commands else None
+    )
+    archived_months = await asyncio.to_thread(archive.months, channel_id)
     async with pool.acquire() as con:
         async with con.transaction(readonly=True):
-            params: list[str | int] = [channel_id]
-            query = """
-                SELECT channel_id, sender, message, sent_at 
-                FROM twitch.messages
-                WHERE channel_id = $1
-            """
-
-            if sender is None:
-                ...
+            if word_filters:
+                result = await _random_message_by_sample(con, conditions, params)
             else:
-                query += " AND sender = $2"
-                params.append(sender)
-
-            if len(included_words) + len(excluded_words) > 0:
-                query += f" AND to_tsvector('english', message) @@ to_tsquery('english', ${len(params)+1})"
-                search_query = " & ".join(
-                    [word.lstrip("!") for word in included_words] + [f"!{word}" for word in excluded_words]
+                archived_until = None
+                if len(archived_months) > 0:
+                    archived_until = archived_months[-1].last_sent_at
+                    sender_ids = None if sender is None else await users.archived_ids(con, sender)
+                    archived = await asyncio.to_thread(archive.message_count, channel_id, sender_ids)
+                    total = await _logged_message_count(con, channel_id, sender)
+                    if random.random() * total < archived:
+                        archived_message = await asyncio.to_thread(
+                            archive.random_message, channel_id, sender_ids, matches
+                        )
+                        if archived_message is not None:
+                            return await _archived_message(con, channel_id, archived_message)
+                result = await _random_message_by_time(con, channel_id, sender, conditions, params, archived_until)
+
+            if result is False:
+                result = await con.fetchrow(
+                    f"""
+                    SELECT m.channel_id, u.login AS sender, m.message, m.sent_at
+                    FROM twitch.messages m
+                    JOIN twitch.users u ON u.id = m.sender_id
+                    WHERE {conditions}
+                    ORDER BY RANDOM()
+                    LIMIT 1;
+                    """,
+                    *params,
                 )
-                params.append(search_query)
-
-            if min_word_count is not None:
-                query += f" AND ARRAY_LENGTH(STRING_TO_ARRAY(message, ' '), 1) > ${len(params)+1}"
-                params.append(min_word_count)
-
-            if max_word_count is not None:
-                query += f" AND ARRAY_LENGTH(STRING_TO_ARRAY(message, ' '), 1) < ${len(params)+1}"
-                params.append(max_word_count)
-
-            if exclude_commands and prefixes is not None and len(prefixes) > 0:
-                for prefix in prefixes:
-                    query += f" AND NOT message LIKE ${len(params)+1}"
-                    params.append(prefix.replace("%", r"\%") + "%")
-
-            query += " ORDER BY RANDOM() LIMIT 1;"
-
-            result: Record | None = await con.fetchrow(query, *params)
             if result is None:
-                return None
+                if len(archived_months) == 0:
+                    return None
+                sender_ids = None if sender is None else await users.archived_ids(con, sender)
+                return await _archived_message(
+                    con, channel_id, await asyncio.to_thread(archive.random_message, channel_id, sender_ids, matches)
+                )
             return Message(**result)
 
 
+async def _archived_message(
+    con: Connection, channel_id: str, archived: message_archive.ArchivedMessage | None
+) -> Message | None:
+    """Turns an archived message into a message with the current login of its sender"""
+    if archived is None:
+        return None
+    logins = await users.logins(con, [archived.sender_id])
+    return Message(
+        channel_id=channel_id,
+        sender=logins[archived.sender_id],
+        message=archived.message,
+        sent_at=archived.sent_at,
+    )
+
+
+async def _random_message_by_time(
+    con: Connection,
+    channel_id: str,
+    sender: str | None,
+    conditions: str,
+    params: list,
+    archived_until: datetime | None,
+) -> Record | None | Literal[False]:
+    """
+    Probes random points in time for a matching message, rejecting it by the density of the messages around it;
+    returns False when the exact sample should be used. The archived months are left out of the probed time, since
+    their messages are no longer in the table.
+    """
+    if sender is None:
+        bounds: Record | None = await con.fetchrow(
+            """
+            SELECT MIN(first_sent_at) AS first_sent_at, MAX(last_sent_at) AS last_sent_at, SUM(message_count) AS count
+            FROM twitch.channel_chatter_stats
+            WHERE channel_id = $1;
+            """,
+            channel_id,
+        )
+    else:
+        bounds = await con.fetchrow(
+            """
+            SELECT first_sent_at, last_sent_at, message_count AS count
+            FROM twitch.channel_chatter_stats
+            WHERE channel_id = $1 AND sender_id = (SELECT id FROM twitch.users WHERE login = $2);
+            """,
+            channel_id,
+            sender,
+        )
+    if bounds is None or bounds["count"] is None or bounds["count"] <= EXACT_SAMPLE_LIMIT:
+        return False
+
+    first_sent_at: datetime = bounds["first_sent_at"]
+    if archived_until is not None:
+        first_sent_at = min(max(first_sent_at, archived_until), bounds["last_sent_at"])
+    span = bounds["last_sent_at"] - first_sent_at
+    accepted_gap = span.total_seconds() / bounds["count"] * GAP_FRACTION
+    candidate: Record | None = None
+    for _ in range(TIME_PROBE_ATTEMPTS):
+        # The conditions inside the lateral subquery refer to its own rows, the previous matching message
+        result: Record | None = await con.fetchrow(
+            f"""
+            SELECT m.channel_id, u.login AS sender, m.message, m.sent_at, previous.sent_at AS previous_sent_at
+            FROM twitch.messages m
+            JOIN twitch.users u ON u.id = m.sender_id
+            LEFT JOIN LATERAL (
+                SELECT sent_at
+                FROM twitch.messages
+                WHERE {conditions} AND sent_at < m.sent_at
+                ORDER BY sent_at DESC
+                LIMIT 1
+            ) previous ON TRUE
+            WHERE {conditions} AND m.sent_at >= ${len(params)+1}
+            ORDER BY m.sent_at ASC
+            LIMIT 1;
+            """,
+            *params,
+            first_sent_at + span * random.random(),
+        )
+        if result is None:
+            continue
+        candidate = result
+        previous_sent_at = max(result["previous_sent_at"] or first_sent_at, first_sent_at)
+        gap = (result["sent_at"] - previous_sent_at).total_seconds()
+        if random.random() * gap <= accepted_gap:
+            break
+    if candidate is None:
+        return False
+    return candidate
+
+
+async def _random_message_by_sample(con: Connection, conditions: str, params: list) -> Record | None | Literal[False]:
+    """Samples a matching message from the pages of the table; returns False when the exact sample should be used"""
+    matches: int = await con.fetchval(
+        f"""
+        SELECT COUNT(*)
+        FROM (SELECT 1 FROM twitch.messages WHERE {conditions} LIMIT {EXACT_SAMPLE_LIMIT + 1}) matching;
+        """,
+        *params,
+    )
+    if matches == 0:
+        return None
+    if matches <= EXACT_SAMPLE_LIMIT:
+        return False
+
+    for percent in TABLESAMPLE_PERCENTS:
+        result: Record | None = await con.fetchrow(
+            f"""
+            SELECT m.channel_id, u.login AS sender, m.message, m.sent_at
+            FROM twitch.messages m TABLESAMPLE SYSTEM (${len(params)+1})
+            JOIN twitch.users u ON u.id = m.sender_id
+            WHERE {conditions}
+            ORDER BY RANDOM()
+            LIMIT 1;
+            """,
+            *params,
+            percent,
+        )
+        if result is not None:
+            return result
+    return False
+
+
 @asyncpg_error_handler
 async def number_of_messages(
     pool: Pool,
@@ -79,35 +285,58 @@ async def number_of_messages(
 ) -> int:
     async with pool.acquire() as con:
         async with con.transaction(readonly=True):
-            params: list[str | int] = [channel_id]
-            query = "SELECT COUNT(*) FROM twitch.messages WHERE channel_id = $1"
-
-            if sender is not None:
-                query += " AND sender = $2"
-                params.append(sender)
-
-            if len(included_words) + len(excluded_words) > 0:
-                query += f" AND to_tsvector('english', message) @@ to_tsquery('english', ${len(params)+1})"
-                search_query = " & ".join(
-                    [word.lstrip("!") for word in included_words] + [f"!{word}" for word in excluded_words]
-                )
-                params.append(search_query)
-
-            if min_word_count is not None:
-                query += f" AND ARRAY_LENGTH(STRING_TO_ARRAY(message, ' '), 1) > ${len(params)+1}"
-                params.append(min_word_count)
-
-            if max_word_count is not None:
-                query += f" AND ARRAY_LENGTH(STRING_TO_ARRAY(message, ' '), 1) < ${len(params)+1}"
-                params.append(max_word_count)
-
-            if exclude_commands and prefixes is not None and len(prefixes) > 0:
-                for prefix in prefixes:
-                    query += f" AND NOT message LIKE ${len(params)+1}"
-                    params.append(prefix.replace("%", r"\%") + "%")
+            unfiltered = (
+                len(included_words) + len(excluded_words) == 0
+                and min_word_count is None
+                and max_word_count is None
+                and not (exclude_commands and prefixes is not None and len(prefixes) > 0)
+            )
+            if unfiltered:
+                # The chatter stats already have the counts, archived messages included, so the messages don't need
+                # to be counted again
+                return await _logged_message_count(con, channel_id, sender)
 
-            result: int = await con.fetchval(query, *params)
-            return result
+            conditions, params = _message_filters(
+                channel_id,
+                sender,
+                included_words,
+                excluded_words,
+                min_word_count,
+                max_word_count,
+                exclude_commands,
+                prefixes,
+            )
+            result: int = await con.fetchval(f"SELECT COUNT(*) FROM twitch.messages WHERE {conditions};", *params)
+            sender_ids = None if sender is None else await users.archived_ids(con, sender)
+    matches = message_archive.message_filter(
+        included_words, excluded_words, min_word_count, max_word_count, prefixes if exclude_commands else None
+    )
+    archived: int = await asyncio.to_thread(message_archive.archive().message_count, channel_id, sender_ids, matches)
+    return result + archived
+
+
+async def _logged_message_count(con: Connection, channel_id: str, sender: str | None) -> int:
+    """Returns the number of messages logged in a channel, or by a sender in it, from the chatter stats"""
+    if sender is None:
+        count: int = await con.fetchval(
+            """
+            SELECT COALESCE(SUM(message_count), 0)
+            FROM twitch.channel_chatter_stats
+            WHERE channel_id = $1;
+            """,
+            channel_id,
+        )
+    else:
+        count = await con.fetchval(
+            """
+            SELECT COALESCE(MAX(message_count), 0)
+            FROM twitch.channel_chatter_stats
+            WHERE channel_id = $1 AND sender_id = (SELECT id FROM twitch.users WHERE login = $2);
+            """,
+            channel_id,
+            sender,
+        )
+    return count
 
 
 @asyncpg_error_handler
@@ -116,10 +345,11 @@ async def past_messages(pool: Pool, channel_id: str, since: datetime, max_count:
         async with con.transaction(readonly=True):
             results: list[Record] = await con.fetch(
                 """
-                SELECT channel_id, sender, message, sent_at
-                FROM twitch.messages
-                WHERE channel_id = $1 AND sent_at > $2
-                ORDER BY sent_at DESC
+                SELECT m.channel_id, u.login AS sender, m.message, m.sent_at
+                FROM twitch.messages m
+                JOIN twitch.users u ON u.id = m.sender_id
+                WHERE m.channel_id = $1 AND m.sent_at > $2
+                ORDER BY m.sent_at DESC
                 LIMIT $3;
                 """,
                 channel_id,
@@ -130,56 +360,304 @@ async def past_messages(pool: Pool, channel_id: str, since: datetime, max_count:
 
 
 @asyncpg_error_handler
-async def top_chatters(pool: Pool, channel_id: str, exclude: str) -> Counter[str]:
+async def top_chatters(pool: Pool, channel_id: str, exclude: str, limit: int) -> Counter[str]:
     async with pool.acquire() as con:
         async with con.transaction(readonly=True):
             results: list[Record] = await con.fetch(
                 """
-                SELECT sender, COUNT(*) AS count
-                FROM twitch.messages
-                WHERE channel_id = $1 AND sender != $2
-                GROUP BY sender;
+                SELECT u.login AS sender, s.message_count
+                FROM twitch.channel_chatter_stats s
+                JOIN twitch.users u ON u.id = s.sender_id
+                WHERE s.channel_id = $1 AND u.login != $2
+                ORDER BY s.message_count DESC
+                LIMIT $3;
                 """,
                 channel_id,
                 exclude,
+                limit,
             )
-            return Counter({result["sender"]: result["count"] for result in results})
+            return Counter({result["sender"]: result["message_count"] for result in results})
 
 
 @asyncpg_error_handler
-async def emote_count(pool: Pool, channel_id: str, emote: str) -> int:
+async def emote_count(pool: Pool, channel_id: str, emote: str, since: date | None = None) -> int:
     async with pool.acquire() as con:
         async with con.transaction(readonly=True):
             result: int = await con.fetchval(
                 """
-                SELECT SUM((LENGTH(message) - LENGTH(REGEXP_REPLACE(message, '\\y' || $2 || '\\y', '', 'g'))) / LENGTH($2))
-                FROM twitch.messages
-                WHERE channel_id = $1 AND sender != $3;
+                SELECT COALESCE(SUM(count), 0)
+                FROM twitch.emote_usage
+                WHERE channel_id = $1 AND emote = $2 AND ($3::date IS NULL OR day >= $3);
                 """,
                 channel_id,
                 emote,
-                os.environ["BOT_NICK"],
+                since,
             )
             return result
 
 
 @asyncpg_error_handler
-async def emote_counts(pool: Pool, channel_id: str, emotes: list[str]) -> Counter[str]:
+async def emote_counts(pool: Pool, channel_id: str, emotes: list[str], since: date | None = None) -> Counter[str]:
     async with pool.acquire() as con:
         async with con.transaction(readonly=True):
-            results = await con.fetch(
+            results: list[Record] = await con.fetch(
                 """
-                SELECT message
-                FROM twitch.messages
-                WHERE channel_id = $1 AND sender != $2;
+                SELECT emote, SUM(count) AS count
+                FROM twitch.emote_usage
+                WHERE channel_id = $1 AND emote = ANY($2::text[]) AND ($3::date IS NULL OR day >= $3)
+                GROUP BY emote;
+                """,
+                channel_id,
+                emotes,
+                since,
+            )
+            emote_frequency = Counter({emote: 0 for emote in emotes})
+            emote_frequency.update({result["emote"]: result["count"] for result in results})
+            return emote_frequency
+
+
+@asyncpg_error_handler
+async def emote_usage_counted_from(pool: Pool, channel_id: str) -> datetime | None:
+    """
+    Returns the time from which the emote usage counts of the channel are complete, or None if nothing has been
+    counted; the counts of a range that starts earlier are missing the uses before it
+    """
+    async with pool.acquire() as con:
+        async with con.transaction(readonly=True):
+            result: datetime | None = await con.fetchval(
+                """
+                SELECT counted_from
+                FROM twitch.emote_usage_coverage
+                WHERE channel_id = $1;
+                """,
+                channel_id,
+            )
+            return result
+
+
+async def _add_emote_usage(con: Connection, usage: list[tuple[str, str, date, int]]) -> None:
+    await con.executemany(
+        """
+        INSERT INTO twitch.emote_usage (channel_id, emote, day, count)
+        VALUES ($1, $2, $3, $4)
+        ON CONFLICT (channel_id, emote, day)
+        DO UPDATE SET count = twitch.emote_usage.count + EXCLUDED.count;
+        """,
+        sorted(usage),
+    )
+
+
+@asyncpg_error_handler
+async def add_emote_usage(
+    pool: Pool, usage: list[tuple[str, str, date, int]], counting_since: list[tuple[str, datetime]] | None = None
+) -> None:
+    """
+    Adds (channel_id, emote, day, count) emote uses to the daily emote usage counts. The (channel_id, time) pairs
+    in counting_since record from when the uses of a channel have been counted, unless that is already known.
+    """
+    async with pool.acquire() as con:
+        async with con.transaction():
+            await _add_emote_usage(con, usage)
+            if counting_since is not None and len(counting_since) > 0:
+                await con.executemany(
+                    """
+                    INSERT INTO twitch.emote_usage_coverage (channel_id, counted_from)
+                    VALUES ($1, $2)
+                    ON CONFLICT (channel_id) DO NOTHING;
+                    """,
+                    counting_since,
+                )
+
+
+@asyncpg_error_handler
+async def backfill_emote_usage(pool: Pool, channel_id: str, usage: list[tuple[str, str, date, int]]) -> None:
+    """Adds the emote uses counted from the chat logs from before the counts started and marks them complete"""
+    async with pool.acquire() as con:
+        async with con.transaction():
+            await _add_emote_usage(con, usage)
+            await con.execute(
+                """
+                UPDATE twitch.emote_usage_coverage
+                SET counted_from = '-infinity'
+                WHERE channel_id = $1;
+                """,
+                channel_id,
+            )
+
+
+async def message_chunks(
+    pool: Pool,
+    channel_id: str,
+    exclude: str,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    chunk_size: int = 10_000,
+) -> AsyncIterator[list[tuple[str, str]]]:
+    """
+    Streams the (sender, message) pairs of a channel in chunks through a server-side cursor, so only one chunk is
+    held in memory no matter how long the history is. The archived months come first, one month per chunk.
+    """
+    async for archived in archived_messages(pool, channel_id, exclude, since, until):
+        yield [(sender, message) for sender, _, message in archived]
+
+    # The error handler can't wrap a generator, so the errors are converted here
+    try:
+        async with pool.acquire() as con:
+            async with con.transaction(readonly=True):
+                cursor = await con.cursor(
+                    """
+                    SELECT u.login AS sender, m.message
+                    FROM twitch.messages m
+                    JOIN twitch.users u ON u.id = m.sender_id
+                    WHERE m.channel_id = $1 AND u.login != $2
+                        AND ($3::timestamptz IS NULL OR m.sent_at >= $3)
+                        AND ($4::timestamptz IS NULL OR m.sent_at < $4);
+                    """,
+                    channel_id,
+                    exclude,
+                    since,
+                    until,
+                )
+                while True:
+                    results: list[Record] = await cursor.fetch(chunk_size)
+                    if len(results) == 0:
+                        return
+                    yield [(result["sender"], result["message"]) for result in results]
+    except PostgresError as e:
+        raise DatabaseError("Postgres error", e)
+
+
+async def archived_messages(
+    pool: Pool, channel_id: str, exclude: str, since: datetime | None = None, until: datetime | None = None
+) -> AsyncIterator[list[tuple[str, datetime, str]]]:
+    """
+    Streams the archived (sender, sent_at, message) rows of a channel sent in the given time, one month at a time,
+    with the current logins of the senders
+    """
+    archive = message_archive.archive()
+    start = since or datetime.min.replace(tzinfo=UTC)
+    end = until or datetime.max.replace(tzinfo=UTC)
+    for month in await asyncio.to_thread(archive.months, channel_id):
+        if month.first_sent_at < end and month.last_sent_at >= start:
+            rows = await asyncio.to_thread(archive.file(month).messages_between, start, end)
+            # The error handler can't wrap a generator, so the errors are converted here
+            try:
+                async with pool.acquire() as con:
+                    logins = await users.logins(con, (row.sender_id for row in rows))
+            except PostgresError as e:
+                raise DatabaseError("Postgres error", e)
+            yield [
+                (logins[row.sender_id], row.sent_at, row.message)
+                for row in rows
+                if logins[row.sender_id] != exclude
+            ]
+
+
+async def archivable_messages(
+    pool: Pool, channel_id: str, since: datetime, until: datetime, after_id: int, chunk_size: int = 10_000
+) -> AsyncIterator[list[tuple[int, int, datetime, str, int | None]]]:
+    """
+    Streams the (id, sender_id, sent_at, message, word_count) rows of a channel sent in the given time with an id
+    above after_id in chunks through a server-side cursor
+    """
+    # The error handler can't wrap a generator, so the errors are converted here
+    try:
+        async with pool.acquire() as con:
+            async with con.transaction(readonly=True):
+                cursor = await con.cursor(
+                    """
+                    SELECT id, sender_id, sent_at, message, word_count
+                    FROM twitch.messages
+                    WHERE channel_id = $1 AND sent_at >= $2 AND sent_at < $3 AND id > $4;
+                    """,
+                    channel_id,
+                    since,
+                    until,
+                    after_id,
+                )
+                while True:
+                    results: list[Record] = await cursor.fetch(chunk_size)
+                    if len(results) == 0:
+                        return
+                    yield [
+                        (result["id"], result["sender_id"], result["sent_at"], result["message"], result["word_count"])
+                        for result in results
+                    ]
+    except PostgresError as e:
+        raise DatabaseError("Postgres error", e)
+
+
+@asyncpg_error_handler
+async def delete_messages(pool: Pool, channel_id: str, since: datetime, until: datetime, max_id: int) -> int:
+    """Deletes the messages of a channel sent in the given time with an id up to max_id and returns their number"""
+    async with pool.acquire() as con:
+        async with con.transaction():
+            status: str = await con.execute(
+                """
+                DELETE FROM twitch.messages
+                WHERE channel_id = $1 AND sent_at >= $2 AND sent_at < $3 AND id <= $4;
+                """,
+                channel_id,
+                since,
+                until,
+                max_id,
+            )
+            return int(status.split()[-1])
+
+
+@asyncpg_error_handler
+async def message_time_span(pool: Pool, channel_id: str) -> tuple[datetime, datetime] | None:
+    """Returns the times of the first and the last logged message of a channel"""
+    async with pool.acquire() as con:
+        async with con.transaction(readonly=True):
+            result: Record = await con.fetchrow(
+                """
+                SELECT MIN(first_sent_at) AS first_sent_at, MAX(last_sent_at) AS last_sent_at
+                FROM twitch.channel_chatter_stats
+                WHERE channel_id = $1;
                 """,
                 channel_id,
-                os.environ["BOT_NICK"],
             )
-            words = [word for sublist in [result["message"].split() for result in results] for word in sublist]
-            word_frequency = Counter(words)
-            emote_frequency = {emote: word_frequency[emote] if emote in word_frequency else 0 for emote in emotes}
-            return Counter(emote_frequency)
+            if result["first_sent_at"] is None:
+                return None
+            return result["first_sent_at"], result["last_sent_at"]
+
+
+@asyncpg_error_handler
+async def logged_emote_usage(
+    pool: Pool, channel_id: str, emotes: list[str], exclude: str, before: datetime
+) -> list[tuple[str, str, date, int]]:
+    """
+    Counts the emotes in the messages logged before the given time, the archived ones included, into
+    (channel_id, emote, day, count) tuples
+    """
+    usage: Counter[tuple[str, date]] = Counter()
+    emote_names = frozenset(emotes)
+    async for archived in archived_messages(pool, channel_id, exclude, until=before):
+        for _, sent_at, message in archived:
+            day = sent_at.date()
+            usage.update((word, day) for word in message.split() if word in emote_names)
+
+    async with pool.acquire() as con:
+        async with con.transaction(readonly=True):
+            results: list[Record] = await con.fetch(
+                """
+                SELECT (sent_at AT TIME ZONE 'UTC')::date AS day, word AS emote, COUNT(*) AS count
+                FROM twitch.messages, regexp_split_to_table(message, '\\s+') AS word
+                WHERE channel_id = $1
+                    AND sender_id IS DISTINCT FROM (SELECT id FROM twitch.users WHERE login = $2)
+                    AND sent_at < $3
+                    AND word = ANY($4::text[])
+                GROUP BY day, word;
+                """,
+                channel_id,
+                exclude,
+                before,
+                emotes,
+            )
+    for result in results:
+        usage[(result["emote"], result["day"])] += result["count"]
+    return [(channel_id, emote, day, count) for (emote, day), count in usage.items()]
 
 
 @asyncpg_error_handler
@@ -188,10 +666,31 @@ async def first_message(pool: Pool, channel_id: str, username: str) -> Message |
         async with con.transaction(readonly=True):
             result: Record | None = await con.fetchrow(
                 """
-                SELECT channel_id, sender, message, sent_at
-                FROM twitch.messages
-                WHERE channel_id = $1 AND sender = $2
-                ORDER BY sent_at ASC
+                SELECT m.channel_id, u.login AS sender, m.message, m.sent_at
+                FROM twitch.channel_chatter_stats s
+                JOIN twitch.users u ON u.id = s.sender_id
+                JOIN twitch.messages m ON m.id = s.first_message_id AND m.sent_at = s.first_sent_at
+                WHERE s.channel_id = $1 AND u.login = $2;
+                """,
+                channel_id,
+                username,
+            )
+            if result is not None:
+                return Message(**result)
+
+            # The message may have been archived or be in a partition that has been dropped since
+            sender_ids = await users.archived_ids(con, username)
+            first = await asyncio.to_thread(message_archive.archive().first_message, channel_id, sender_ids)
+            archived = await _archived_message(con, channel_id, first)
+            if archived is not None:
+                return archived
+            result = await con.fetchrow(
+                """
+                SELECT m.channel_id, u.login AS sender, m.message, m.sent_at
+                FROM twitch.messages m
+                JOIN twitch.users u ON u.id = m.sender_id
+                WHERE m.channel_id = $1 AND u.login = $2
+                ORDER BY m.sent_at ASC
                 LIMIT 1;
                 """,
                 channel_id,
@@ -208,34 +707,132 @@ async def last_seen(pool: Pool, channel_id: str, user: str) -> Message | None:
         async with con.transaction(readonly=True):
             result: Record | None = await con.fetchrow(
                 """
-                SELECT channel_id, sender, message, sent_at
-                FROM twitch.messages
-                WHERE channel_id = $1 AND sender = $2
-                ORDER BY sent_at DESC
-                LIMIT 1;
+                SELECT m.channel_id, u.login AS sender, m.message, m.sent_at
+                FROM twitch.channel_chatter_stats s
+                JOIN twitch.users u ON u.id = s.sender_id
+                JOIN twitch.messages m ON m.id = s.last_message_id AND m.sent_at = s.last_sent_at
+                WHERE s.channel_id = $1 AND u.login = $2;
                 """,
                 channel_id,
                 user,
             )
             if result is None:
-                return None
+                # The message may be in a partition that has been dropped since
+                result = await con.fetchrow(
+                    """
+                    SELECT m.channel_id, u.login AS sender, m.message, m.sent_at
+                    FROM twitch.messages m
+                    JOIN twitch.users u ON u.id = m.sender_id
+                    WHERE m.channel_id = $1 AND u.login = $2
+                    ORDER BY m.sent_at DESC
+                    LIMIT 1;
+                    """,
+                    channel_id,
+                    user,
+                )
+            if result is None:
+                # Messages are only archived once they are old, so the archive is checked last
+                sender_ids = await users.archived_ids(con, user)
+                last = await asyncio.to_thread(message_archive.archive().last_message, channel_id, sender_ids)
+                return await _archived_message(con, channel_id, last)
             return Message(**result)
 
 
 @asyncpg_error_handler
-async def log_message(pool: Pool, channel_id: str, sender: str, message: str, channel_online: bool) -> None:
+async def log_message(
+    pool: Pool, channel_id: str, sender: str, message: str, channel_online: bool, twitch_id: str | None = None
+) -> None:
     async with pool.acquire() as con:
+        sender_id = (await users.user_ids(con, [(sender, twitch_id)]))[(sender, twitch_id)]
         async with con.transaction():
-            await con.execute(
+            result: Record = await con.fetchrow(
                 """
-                INSERT INTO twitch.messages (channel_id, sender, message, online)
-                VALUES ($1, $2, $3, $4);
+                INSERT INTO twitch.messages (channel_id, sender_id, message, online)
+                VALUES ($1, $2, $3, $4)
+                RETURNING id, sent_at;
                 """,
                 channel_id,
-                sender,
+                sender_id,
                 message,
                 channel_online,
             )
+            await _update_chatter_stats(con, [(channel_id, sender_id, result["id"], result["sent_at"])])
+
+
+@asyncpg_error_handler
+async def log_messages(pool: Pool, records: list[tuple[str, str, str, bool, datetime, str | None]]) -> None:
+    """
+    Logs many messages at once with COPY; records are (channel_id, sender, message, online, sent_at, twitch_id)
+    tuples, the Twitch id of the sender being None when it isn't known
+    """
+    async with pool.acquire() as con:
+        sender_ids = await users.user_ids(con, ((record[1], record[5]) for record in records))
+        async with con.transaction():
+            # COPY can't return the ids, so they are taken from the sequence beforehand for the chatter stats
+            ids: list[Record] = await con.fetch(
+                """
+                SELECT nextval('twitch.messages_id_seq') AS id
+                FROM generate_series(1, $1);
+                """,
+                len(records),
+            )
+            await con.copy_records_to_table(
+                "messages",
+                schema_name="twitch",
+                columns=("id", "channel_id", "sender_id", "message", "online", "sent_at"),
+                records=[
+                    (id["id"], channel_id, sender_ids[(sender, twitch_id)], message, online, sent_at)
+                    for id, (channel_id, sender, message, online, sent_at, twitch_id) in zip(ids, records)
+                ],
+            )
+            await _update_chatter_stats(
+                con,
+                [
+                    (record[0], sender_ids[(record[1], record[5])], id["id"], record[4])
+                    for id, record in zip(ids, records)
+                ],
+            )
+
+
+async def _update_chatter_stats(con: Connection, logged: list[tuple[str, int, int, datetime]]) -> None:
+    """Adds logged (channel_id, sender_id, id, sent_at) messages to the per channel statistics of their senders"""
+    stats: dict[tuple[str, int], list] = {}
+    for channel_id, sender, id, sent_at in logged:
+        chatter = stats.get((channel_id, sender))
+        if chatter is None:
+            stats[(channel_id, sender)] = [1, id, sent_at, id, sent_at]
+            continue
+        chatter[0] += 1
+        if sent_at < chatter[2]:
+            chatter[1], chatter[2] = id, sent_at
+        if sent_at >= chatter[4]:
+            chatter[3], chatter[4] = id, sent_at
+
+    # Rows are locked in the same order by every batch so concurrent batches can't deadlock
+    await con.executemany(
+        """
+        INSERT INTO twitch.channel_chatter_stats (
+            channel_id, sender_id, message_count, first_message_id, first_sent_at, last_message_id, last_sent_at
+        )
+        VALUES ($1, $2, $3, $4, $5, $6, $7)
+        ON CONFLICT (channel_id, sender_id)
+        DO UPDATE SET
+            message_count = twitch.channel_chatter_stats.message_count + EXCLUDED.message_count,
+            first_message_id = CASE
+                WHEN EXCLUDED.first_sent_at < twitch.channel_chatter_stats.first_sent_at
+                THEN EXCLUDED.first_message_id
+                ELSE twitch.channel_chatter_stats.first_message_id
+            END,
+            first_sent_at = LEAST(twitch.channel_chatter_stats.first_sent_at, EXCLUDED.first_sent_at),
+            last_message_id = CASE
+                WHEN EXCLUDED.last_sent_at >= twitch.channel_chatter_stats.last_sent_at
+                THEN EXCLUDED.last_message_id
+                ELSE twitch.channel_chatter_stats.last_message_id
+            END,
+            last_sent_at = GREATEST(twitch.channel_chatter_stats.last_sent_at, EXCLUDED.last_sent_at);
+        """,
+        [(channel_id, sender, *chatter) for (channel_id, sender), chatter in sorted(stats.items())],
+    )
 
 
 @asyncpg_error_handler
@@ -257,17 +854,44 @@ async def log_command_usage(
             )
 
 
+# The blocked terms are read for every outgoing message, so they are kept in memory until the trigger on
+# blocked_terms sends a notification. The same list is returned until then, so callers can tell by its identity
+# whether anything they derived from it is still current.
+_blocked_terms: list[BlockedTerm] | None = None
+# Incremented on every invalidation so that a result fetched before it isn't stored after it
+_blocked_terms_version = 0
+
+
+def _forget_blocked_terms(_: str = "") -> None:
+    global _blocked_terms, _blocked_terms_version
+    _blocked_terms_version += 1
+    _blocked_terms = None
+
+
+listener.subscribe("blocked_term_changed", _forget_blocked_terms)
+listener.on_reset(_forget_blocked_terms)
+
+
 @asyncpg_error_handler
 async def blocked_terms(pool: Pool) -> list[BlockedTerm]:
+    global _blocked_terms
+    if _blocked_terms is not None:
+        return _blocked_terms
+
+    version = _blocked_terms_version
     async with pool.acquire() as con:
         async with con.transaction():
             results: list[Record] = await con.fetch(
                 """
                 SELECT id, pattern, regex
-                FROM twitch.blocked_terms;
+                FROM twitch.blocked_terms
+                ORDER BY id;
                 """
             )
-            return [BlockedTerm(**result) for result in results]
+            terms = [BlockedTerm(**result) for result in results]
+    if version == _blocked_terms_version and listener.active:
+        _blocked_terms = terms
+    return terms
 
 
 @asyncpg_error_handler
@@ -300,7 +924,8 @@ async def add_blocked_term(pool: Pool, pattern: str, regex: bool) -> int:
                 pattern,
                 regex,
             )
-            return result
+    _forget_blocked_terms()
+    return result
 
 
 @asyncpg_error_handler
@@ -314,4 +939,36 @@ async def delete_blocked_term(pool: Pool, id: int) -> bool:
                 """,
                 id,
             )
-            return int(result.split()[-1]) > 0
+    _forget_blocked_terms()
+    return int(result.split()[-1]) > 0
+
+
+@asyncpg_error_handler
+async def create_partitions(pool: Pool, months_ahead: int) -> list[str]:
+    """Creates the monthly partitions of the message log up to months_ahead months ahead and returns their names"""
+    async with pool.acquire() as con:
+        async with con.transaction():
+            results: list[Record] = await con.fetch(
+                """
+                SELECT twitch.create_message_partitions($1) AS name;
+                """,
+                months_ahead,
+            )
+            return [result["name"] for result in results]
+
+
+@asyncpg_error_handler
+async def drop_partitions(pool: Pool, older_than: datetime) -> list[str]:
+    """
+    Drops the partitions of the message log that only hold messages sent before older_than, taking their messages
+    out of the chatter stats
+    """
+    async with pool.acquire() as con:
+        async with con.transaction():
+            results: list[Record] = await con.fetch(
+                """
+                SELECT twitch.drop_message_partitions($1) AS name;
+                """,
+                older_than,
+            )
+            return [result["name"] for result in results]
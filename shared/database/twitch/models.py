@@ -114,6 +114,15 @@ class AfkStatus(BaseModel):
         return (message, targets)
 
 
+class MessageContext(BaseModel):
+    """Everything the handling of a chat message needs to know about its channel and author"""
+
+    channel_config: ChannelConfig
+    user_config: UserConfig
+    afk_status: AfkStatus | None = None
+    reminders: list[Reminder] = Field(default_factory=list)
+
+
 class Message(BaseModel):
     channel_id: str
     sender: str
@@ -1,10 +1,151 @@
+import asyncio
 from datetime import datetime
 from typing import Literal
 
 from asyncpg import Pool, Record
 
 from .models import Reminder, AfkStatus
-from shared.database.exceptions import asyncpg_error_handler
+from shared.database.exceptions import asyncpg_error_handler, DatabaseError
+from shared.database.listener import listener
+
+
+# In-memory index of who has something waiting to be delivered when they type in chat: ("afk", channel_id,
+# target_id) for unprocessed afks and ("reminder", target_id) for unprocessed untimed reminders. Writers add
+# entries right away and the trigger on afks and reminders notifies every process to recheck a key, which is
+# the only way entries get removed. While the index isn't loaded, everyone is assumed to have something.
+_pending: set[tuple[str, ...]] = set()
+_loaded = False
+_pool: Pool | None = None
+# Incremented whenever the index changes so that a load started before the change is redone
+_version = 0
+_refreshing: set[tuple[str, ...]] = set()
+_stale: set[tuple[str, ...]] = set()
+
+
+def may_have_pending(channel_id: str, target_id: str) -> bool:
+    if not _loaded or not listener.active:
+        return True
+    return ("afk", channel_id, target_id) in _pending or ("reminder", target_id) in _pending
+
+
+async def load_pending(pool: Pool) -> None:
+    global _loaded, _pool
+    _pool = pool
+    while True:
+        version = _version
+        pending = await _fetch_pending(pool)
+        if version == _version:
+            break
+    _pending.clear()
+    _pending.update(pending)
+    _loaded = True
+
+
+@asyncpg_error_handler
+async def _fetch_pending(pool: Pool) -> set[tuple[str, ...]]:
+    async with pool.acquire() as con:
+        async with con.transaction(readonly=True):
+            afks: list[Record] = await con.fetch(
+                """
+                SELECT channel_id, target_id
+                FROM twitch.afks
+                WHERE processed_at IS NULL;
+                """
+            )
+            reminder_targets: list[Record] = await con.fetch(
+                """
+                SELECT DISTINCT target_id
+                FROM twitch.reminders
+                WHERE scheduled_at IS NULL AND processed_at IS NULL;
+                """
+            )
+            return set(("afk", afk["channel_id"], afk["target_id"]) for afk in afks).union(
+                ("reminder", reminder["target_id"]) for reminder in reminder_targets
+            )
+
+
+@asyncpg_error_handler
+async def _has_pending(pool: Pool, key: tuple[str, ...]) -> bool:
+    async with pool.acquire() as con:
+        if key[0] == "afk":
+            result: bool = await con.fetchval(
+                """
+                SELECT EXISTS (
+                    SELECT 1
+                    FROM twitch.afks
+                    WHERE channel_id = $1 AND target_id = $2 AND processed_at IS NULL
+                );
+                """,
+                key[1],
+                key[2],
+            )
+        else:
+            result: bool = await con.fetchval(
+                """
+                SELECT EXISTS (
+                    SELECT 1
+                    FROM twitch.reminders
+                    WHERE target_id = $1 AND scheduled_at IS NULL AND processed_at IS NULL
+                );
+                """,
+                key[1],
+            )
+        return result
+
+
+def _add_pending(key: tuple[str, ...]) -> None:
+    global _version
+    _version += 1
+    _pending.add(key)
+
+
+def _recheck(key: tuple[str, ...]) -> None:
+    # Only one check per key runs at a time; changes during it make it run again
+    if key in _refreshing:
+        _stale.add(key)
+        return
+    if _pool is None:
+        return
+    _refreshing.add(key)
+    asyncio.get_running_loop().create_task(_refresh(_pool, key))
+
+
+async def _refresh(pool: Pool, key: tuple[str, ...]) -> None:
+    global _version
+    try:
+        while True:
+            _stale.discard(key)
+            try:
+                pending = await _has_pending(pool, key)
+            except DatabaseError:
+                # Better to query on the next message than to miss a delivery
+                pending = True
+            if key not in _stale:
+                break
+        _version += 1
+        if pending:
+            _pending.add(key)
+        else:
+            _pending.discard(key)
+    finally:
+        _refreshing.discard(key)
+
+
+def _pending_changed(payload: str) -> None:
+    _recheck(tuple(payload.split(":")))
+
+
+def _reset() -> None:
+    global _loaded, _version
+    _loaded = False
+    _version += 1
+    _pending.clear()
+    if _pool is not None and listener.active:
+        asyncio.get_running_loop().create_task(load_pending(_pool))
+
+
+listener.subscribe("pending_changed", _pending_changed)
+listener.on_reset(_reset)
 
 
 @asyncpg_error_handler
@@ -56,7 +197,9 @@ async def set_reminder(
                 scheduled_at,
                 delete_after,
             )
-            return id
+    if id is not None and scheduled_at is None:
+        _add_pending(("reminder", target_id))
+    return id
 
 
 @asyncpg_error_handler
@@ -138,15 +281,20 @@ async def uncancel_reminder(pool: Pool, reminder_id: int) -> None:
 async def set_reminder_as_sent(pool: Pool, reminder_id: int) -> bool:
     async with pool.acquire() as con:
         async with con.transaction():
-            result: str = await con.execute(
+            result: Record | None = await con.fetchrow(
                 """
                 UPDATE twitch.reminders
                 SET sent = TRUE, processed_at = CURRENT_TIMESTAMP
-                WHERE id = $1 AND processed_at IS NULL;
+                WHERE id = $1 AND processed_at IS NULL
+                RETURNING target_id, scheduled_at;
                 """,
                 reminder_id,
             )
-            return int(result.split()[-1]) > 0
+    if result is None:
+        return False
+    if result["scheduled_at"] is None:
+        _recheck(("reminder", result["target_id"]))
+    return True
 
 
 @asyncpg_error_handler
@@ -220,6 +368,7 @@ async def set_afk(pool: Pool, channel_id: str, target_id: str, afk_type: Literal
                 target_id,
                 afk_type,
             )
+    _add_pending(("afk", channel_id, target_id))
 
 
 @asyncpg_error_handler
@@ -253,15 +402,19 @@ async def afk_status(pool: Pool, channel_id: str, target_id: str) -> AfkStatus |
 async def set_afk_as_sent(pool: Pool, afk_id: int) -> bool:
     async with pool.acquire() as con:
         async with con.transaction():
-            result: str = await con.execute(
+            result: Record | None = await con.fetchrow(
                 """
                 UPDATE twitch.afks
                 SET processed_at = CURRENT_TIMESTAMP
-                WHERE id = $1 AND processed_at IS NULL;
+                WHERE id = $1 AND processed_at IS NULL
+                RETURNING channel_id, target_id;
                 """,
                 afk_id,
             )
-            return int(result.split()[-1]) > 0
+    if result is None:
+        return False
+    _recheck(("afk", result["channel_id"], result["target_id"]))
+    return True
 
 
 @asyncpg_error_handler
@@ -293,4 +446,7 @@ async def continue_afk(pool: Pool, channel_id: str, target_id: str) -> bool:
                 channel_id,
                 target_id,
             )
-            return int(result.split()[-1]) > 0
+    success = int(result.split()[-1]) > 0
+    if success:
+        _add_pending(("afk", channel_id, target_id))
+    return success
@@ -1,11 +1,249 @@
-from asyncpg import Pool, Record
+from collections import OrderedDict
+from functools import wraps
+from typing import Iterable
+
+from asyncpg import Connection, Pool, Record
 
 from .models import UserConfig, Watchtime
 from shared.database.exceptions import asyncpg_error_handler
+from shared.database.listener import listener
+
+
+# Bounded LRU cache of user configs. Most chatters don't have a row, so the default config returned
+# for them is cached too. Entries are dropped when the trigger on user_config sends a notification.
+_USER_CONFIG_CACHE_SIZE = 10_000
+_user_configs: OrderedDict[str, UserConfig] = OrderedDict()
+# Incremented on every invalidation so that a result fetched before it isn't stored after it
+_version = 0
+
+
+def _forget(user_id: str) -> None:
+    global _version
+    _version += 1
+    _user_configs.pop(user_id, None)
+
+
+def _forget_all() -> None:
+    global _version
+    _version += 1
+    _user_configs.clear()
+
+
+def _remember(config: UserConfig, version: int) -> None:
+    if version != _version or not listener.active:
+        return
+    _user_configs[config.user_id] = config
+    _user_configs.move_to_end(config.user_id)
+    if len(_user_configs) > _USER_CONFIG_CACHE_SIZE:
+        _user_configs.popitem(last=False)
+
+
+listener.subscribe("user_config_changed", _forget)
+listener.on_reset(_forget_all)
+
+# Bounded LRU cache of the integer keys of (login, Twitch id) pairs, the Twitch id being None when only the login
+# is known. The entries of a user are dropped when its login is taken over or changed.
+_USER_ID_CACHE_SIZE = 100_000
+# Messages moved per transaction when two users are merged, so the message log isn't locked for long
+_MERGE_BATCH_SIZE = 10_000
+_user_ids: OrderedDict[tuple[str, str | None], int] = OrderedDict()
+
+
+def _invalidates_user(func):
+    """Drops the user from the cache right away instead of waiting for the notification"""
+
+    @wraps(func)
+    async def wrapper(pool: Pool, user_id: str, *args, **kwargs):
+        try:
+            return await func(pool, user_id, *args, **kwargs)
+        finally:
+            _forget(user_id)
+
+    return wrapper
+
+
+def _forget_user_ids(ids: Iterable[int]) -> None:
+    forgotten = set(ids)
+    if len(forgotten) == 0:
+        return
+    for key in [key for key, user_id in _user_ids.items() if user_id in forgotten]:
+        del _user_ids[key]
+
+
+async def user_ids(con: Connection, users: Iterable[tuple[str, str | None]]) -> dict[tuple[str, str | None], int]:
+    """
+    Returns the keys of the given (login, Twitch id) users and adds the ones that don't have one yet; the Twitch id
+    is None when only the login is known. A user with a Twitch id keeps its key when its login changes and takes
+    its login over from any other user still holding it. It must not be called inside a transaction, so a key is
+    only cached once the user has been committed.
+    """
+    ids: dict[tuple[str, str | None], int] = {}
+    accounts: list[tuple[str, str]] = []
+    logins: list[str] = []
+    # The order is kept, so the last login of a user renamed within the batch is the one it ends up with
+    for user in dict.fromkeys(users):
+        user_id = _user_ids.get(user)
+        if user_id is not None:
+            ids[user] = user_id
+            _user_ids.move_to_end(user)
+        elif user[1] is None:
+            logins.append(user[0])
+        else:
+            accounts.append((user[0], user[1]))
+
+    # The accounts go first, since they may take logins over from the users only known by their login
+    if len(accounts) > 0:
+        account_ids = await _account_ids(con, accounts)
+        for login, twitch_id in accounts:
+            ids[(login, twitch_id)] = _user_ids[(login, twitch_id)] = account_ids[twitch_id]
+
+    # A user added by a concurrent statement isn't returned yet, so those are looked up again
+    missing = logins
+    while len(missing) > 0:
+        results: list[Record] = await con.fetch(
+            """
+            WITH added AS (
+                INSERT INTO twitch.users (login)
+                SELECT unnest($1::text[])
+                ON CONFLICT (login)
+                DO NOTHING
+                RETURNING id, login
+            )
+            SELECT id, login FROM added
+            UNION ALL
+            SELECT id, login FROM twitch.users WHERE login = ANY($1::text[]);
+            """,
+            sorted(missing),
+        )
+        for result in results:
+            ids[(result["login"], None)] = _user_ids[(result["login"], None)] = result["id"]
+        missing = [login for login in missing if (login, None) not in ids]
+
+    while len(_user_ids) > _USER_ID_CACHE_SIZE:
+        _user_ids.popitem(last=False)
+    return ids
+
+
+async def _account_ids(con: Connection, accounts: list[tuple[str, str]]) -> dict[str, int]:
+    """
+    Returns the keys of (login, Twitch id) users by their Twitch id. A user only known by its login is taken to be
+    the account that chats under it next, and a user that has given up its login keeps its key under the login
+    followed by # and its key until it chats again under its new one.
+    """
+    ids: dict[str, int] = {}
+    pending = accounts
+    while len(pending) > 0:
+        # Every Twitch id and login appears once per round, so the logins of a user renamed within the batch and
+        # a login taken over within it are handled in turn
+        logins: dict[str, str] = {}
+        twitch_ids: dict[str, str] = {}
+        later = []
+        for login, twitch_id in pending:
+            if twitch_id in twitch_ids or login in logins:
+                later.append((login, twitch_id))
+            else:
+                logins[login] = twitch_id
+                twitch_ids[twitch_id] = login
+        params = (list(logins), list(logins.values()))
+
+        changed: list[Record] = []
+        async with con.transaction():
+            await con.execute(
+                """
+                UPDATE twitch.users u
+                SET twitch_id = a.twitch_id
+                FROM unnest($1::text[], $2::text[]) AS a(login, twitch_id)
+                WHERE u.login = a.login AND u.twitch_id IS NULL
+                    AND NOT EXISTS (SELECT 1 FROM twitch.users t WHERE t.twitch_id = a.twitch_id);
+                """,
+                *params,
+            )
+            changed += await con.fetch(
+                """
+                UPDATE twitch.users u
+                SET login = u.login || '#' || u.id
+                FROM unnest($1::text[], $2::text[]) AS a(login, twitch_id)
+                WHERE u.login = a.login AND u.twitch_id IS DISTINCT FROM a.twitch_id
+                RETURNING u.id;
+                """,
+                *params,
+            )
+            changed += await con.fetch(
+                """
+                UPDATE twitch.users u
+                SET login = a.login
+                FROM unnest($1::text[], $2::text[]) AS a(login, twitch_id)
+                WHERE u.twitch_id = a.twitch_id AND u.login <> a.login
+                RETURNING u.id;
+                """,
+                *params,
+            )
+            # A login added concurrently by the watchtime is taken over in the next round
+            await con.execute(
+                """
+                INSERT INTO twitch.users (twitch_id, login)
+                SELECT a.twitch_id, a.login
+                FROM unnest($1::text[], $2::text[]) AS a(login, twitch_id)
+                ON CONFLICT DO NOTHING;
+                """,
+                *params,
+            )
+            results: list[Record] = await con.fetch(
+                """
+                SELECT id, twitch_id
+                FROM twitch.users
+                WHERE twitch_id = ANY($1::text[]);
+                """,
+                params[1],
+            )
+        _forget_user_ids(result["id"] for result in changed)
+        for result in results:
+            ids[result["twitch_id"]] = result["id"]
+        pending = later + [(login, twitch_id) for login, twitch_id in logins.items() if twitch_id not in ids]
+    return ids
+
+
+async def archived_ids(con: Connection, login: str) -> list[int]:
+    """
+    Returns the keys the archived messages of a user are stored under: its own and those of the users merged into
+    it, which the message archive still refers to
+    """
+    results: list[Record] = await con.fetch(
+        """
+        SELECT id FROM twitch.users WHERE login = $1
+        UNION ALL
+        SELECT m.id
+        FROM twitch.users u
+        JOIN twitch.users m ON m.merged_into = u.id
+        WHERE u.login = $1;
+        """,
+        login,
+    )
+    return [result["id"] for result in results]
+
+
+async def logins(con: Connection, ids: Iterable[int]) -> dict[int, str]:
+    """Returns the current logins of the given keys, the login of the user it was merged into for a merged user"""
+    results: list[Record] = await con.fetch(
+        """
+        SELECT u.id, COALESCE(m.login, u.login) AS login
+        FROM twitch.users u
+        LEFT JOIN twitch.users m ON m.id = u.merged_into
+        WHERE u.id = ANY($1::int[]);
+        """,
+        list(set(ids)),
+    )
+    return {result["id"]: result["login"] for result in results}
 
 
 @asyncpg_error_handler
 async def user_config(pool: Pool, user_id: str) -> UserConfig:
+    config = _user_configs.get(user_id)
+    if config is not None:
+        _user_configs.move_to_end(user_id)
+        return config
+
+    version = _version
     async with pool.acquire() as con:
         async with con.transaction(readonly=True):
             result: Record | None = await con.fetchrow(
@@ -17,8 +255,11 @@ async def user_config(pool: Pool, user_id: str) -> UserConfig:
                 user_id,
             )
             if result is None:
-                return UserConfig(user_id=user_id)
-            return UserConfig(**result)
+                config = UserConfig(user_id=user_id)
+            else:
+                config = UserConfig(**result)
+    _remember(config, version)
+    return config
 
 
 @asyncpg_error_handler
@@ -37,6 +278,7 @@ async def create_user_config(pool: Pool, user_id: str) -> None:
 
 
 @asyncpg_error_handler
+@_invalidates_user
 async def replies_on(pool: Pool, user_id: str) -> bool:
     async with pool.acquire() as con:
         async with con.transaction():
@@ -52,6 +294,7 @@ async def replies_on(pool: Pool, user_id: str) -> bool:
 
 
 @asyncpg_error_handler
+@_invalidates_user
 async def replies_off(pool: Pool, user_id: str) -> bool:
     async with pool.acquire() as con:
         async with con.transaction():
@@ -67,6 +310,7 @@ async def replies_off(pool: Pool, user_id: str) -> bool:
 
 
 @asyncpg_error_handler
+@_invalidates_user
 async def ban_globally(pool: Pool, user_id: str, notes: str | None = None) -> bool:
     async with pool.acquire() as con:
         async with con.transaction():
@@ -84,6 +328,7 @@ async def ban_globally(pool: Pool, user_id: str, notes: str | None = None) -> bo
 
 
 @asyncpg_error_handler
+@_invalidates_user
 async def unban_globally(pool: Pool, user_id: str, notes: str | None = None) -> bool:
     async with pool.acquire() as con:
         async with con.transaction():
@@ -100,6 +345,7 @@ async def unban_globally(pool: Pool, user_id: str, notes: str | None = None) ->
 
 
 @asyncpg_error_handler
+@_invalidates_user
 async def optin(pool: Pool, user_id: str, commands: list[str]) -> None:
     async with pool.acquire() as con:
         async with con.transaction():
@@ -114,6 +360,7 @@ async def optin(pool: Pool, user_id: str, commands: list[str]) -> None:
 
 
 @asyncpg_error_handler
+@_invalidates_user
 async def optout(pool: Pool, user_id: str, commands: list[str]) -> None:
     async with pool.acquire() as con:
         async with con.transaction():
@@ -133,9 +380,10 @@ async def watchtime(pool: Pool, channel_id: str, username: str) -> Watchtime:
         async with con.transaction(readonly=True):
             result: Record | None = await con.fetchrow(
                 """
-                SELECT channel_id, username, total_time, online_time
-                FROM twitch.watchtime
-                WHERE channel_id = $1 AND username = $2;
+                SELECT w.channel_id, u.login AS username, w.total_time, w.online_time
+                FROM twitch.watchtime w
+                JOIN twitch.users u ON u.id = w.user_id
+                WHERE w.channel_id = $1 AND u.login = $2;
                 """,
                 channel_id,
                 username,
@@ -148,74 +396,237 @@ async def watchtime(pool: Pool, channel_id: str, username: str) -> Watchtime:
 @asyncpg_error_handler
 async def add_offline_time(pool: Pool, channel_id: str, users: list[str], interval: int) -> None:
     async with pool.acquire() as con:
+        ids = await user_ids(con, [(login, None) for login in users])
         async with con.transaction():
             await con.executemany(
                 """
-                INSERT INTO twitch.watchtime (channel_id, username, total_time)
+                INSERT INTO twitch.watchtime (channel_id, user_id, total_time)
                 VALUES ($1, $2, $3)
-                ON CONFLICT (channel_id, username)
+                ON CONFLICT (channel_id, user_id)
                 DO UPDATE SET total_time = twitch.watchtime.total_time + EXCLUDED.total_time;
                 """,
-                [(channel_id, user, interval) for user in users],
+                [(channel_id, user_id, interval) for user_id in sorted(ids.values())],
             )
 
 
 @asyncpg_error_handler
 async def add_online_time(pool: Pool, channel_id: str, users: list[str], interval: int) -> None:
     async with pool.acquire() as con:
+        ids = await user_ids(con, [(login, None) for login in users])
         async with con.transaction():
             await con.executemany(
                 """
-                INSERT INTO twitch.watchtime (channel_id, username, online_time, total_time)
+                INSERT INTO twitch.watchtime (channel_id, user_id, online_time, total_time)
                 VALUES ($1, $2, $3, $3)
-                ON CONFLICT (channel_id, username)
+                ON CONFLICT (channel_id, user_id)
                 DO UPDATE SET 
                     online_time = twitch.watchtime.online_time + EXCLUDED.online_time,
                     total_time = twitch.watchtime.total_time + EXCLUDED.total_time;
                 """,
-                [(channel_id, user, interval) for user in users],
+                [(channel_id, user_id, interval) for user_id in sorted(ids.values())],
             )
 
 
 @asyncpg_error_handler
 async def rename_user(pool: Pool, old_name: str, new_name: str) -> None:
+    """
+    Renames a user by changing the login of its row, which every message and watchtime row refers to. If another
+    user holds the new login, a user with a Twitch id of its own is a different account that has given the login
+    up, so it moves to a placeholder login; a user only known by its login from the old chat logs is the same one
+    and is merged into the user with the Twitch id, or into the renamed user. Most of the messages are moved
+    beforehand in batches of their own.
+    """
     async with pool.acquire() as con:
+        found: list[Record] = await con.fetch(
+            """
+            SELECT id, twitch_id, login
+            FROM twitch.users
+            WHERE login = ANY($1::text[]);
+            """,
+            [old_name, new_name],
+        )
+        merge = _merge_direction({result["login"]: result for result in found}, old_name, new_name)
+        if merge is not None:
+            await _move_messages(con, *merge)
+
         async with con.transaction():
-            await con.execute(
+            locked: list[Record] = await con.fetch(
                 """
-                UPDATE twitch.messages
-                SET sender = $2
-                WHERE sender = $1;
+                SELECT id, twitch_id, login
+                FROM twitch.users
+                WHERE login = ANY($1::text[])
+                ORDER BY id
+                FOR UPDATE;
                 """,
-                old_name,
-                new_name,
+                [old_name, new_name],
             )
+            users = {result["login"]: result for result in locked}
+            if old_name not in users:
+                return
+            renamed_id = users[old_name]["id"]
+            merge = _merge_direction(users, old_name, new_name)
+            if merge is not None:
+                await _merge_users(con, *merge)
+                renamed_id = merge[1]
+            elif new_name in users:
+                await con.execute(
+                    """
+                    UPDATE twitch.users
+                    SET login = login || '#' || id
+                    WHERE id = $1;
+                    """,
+                    users[new_name]["id"],
+                )
 
-            watchtimes: list[Record] = await con.fetch(
+            await con.execute(
                 """
-                SELECT channel_id, username, online_time, total_time
-                FROM twitch.watchtime
-                WHERE username = $1;
+                UPDATE twitch.users
+                SET login = $2
+                WHERE id = $1;
                 """,
-                old_name,
+                renamed_id,
+                new_name,
             )
+    _forget_user_ids(user["id"] for user in users.values())
 
-            await con.executemany(
-                """
-                INSERT INTO twitch.watchtime (channel_id, username, online_time, total_time)
-                VALUES ($1, $2, $3, $4)
-                ON CONFLICT (channel_id, username)
-                DO UPDATE SET 
-                    online_time = twitch.watchtime.online_time + EXCLUDED.online_time, 
-                    total_time = twitch.watchtime.total_time + EXCLUDED.total_time;
-                """,
-                [(r["channel_id"], new_name, r["online_time"], r["total_time"]) for r in watchtimes]
-            )
 
-            await con.execute(
+def _merge_direction(users: dict[str, Record], old_name: str, new_name: str) -> tuple[int, int] | None:
+    """Returns the (from_id, into_id) of the users to merge when the new login is held by the same user"""
+    old, new = users.get(old_name), users.get(new_name)
+    if old is None or new is None:
+        return None
+    if old["twitch_id"] is not None and new["twitch_id"] is not None:
+        return None
+    if old["twitch_id"] is None and new["twitch_id"] is not None:
+        return old["id"], new["id"]
+    return new["id"], old["id"]
+
+
+async def _move_messages(con: Connection, from_id: int, into_id: int) -> None:
+    """Moves the messages of one user to another in batches, each committed on its own"""
+    channel_ids: list[Record] = await con.fetch(
+        """
+        SELECT channel_id
+        FROM twitch.channel_chatter_stats
+        WHERE sender_id = $1;
+        """,
+        from_id,
+    )
+    for result in channel_ids:
+        while True:
+            status: str = await con.execute(
                 """
-                DELETE FROM twitch.watchtime
-                WHERE username = $1;
+                WITH batch AS (
+                    SELECT id, sent_at
+                    FROM twitch.messages
+                    WHERE channel_id = $3 AND sender_id = $1
+                    LIMIT $4
+                )
+                UPDATE twitch.messages m
+                SET sender_id = $2
+                FROM batch
+                WHERE m.id = batch.id AND m.sent_at = batch.sent_at;
                 """,
-                old_name,
+                from_id,
+                into_id,
+                result["channel_id"],
+                _MERGE_BATCH_SIZE,
             )
+            if int(status.split()[-1]) < _MERGE_BATCH_SIZE:
+                break
+
+
+async def _merge_users(con: Connection, from_id: int, into_id: int) -> None:
+    """
+    Moves the messages, chatter stats and watchtime of one user to another; the messages left are the few sent since
+    _move_messages moved the rest. The first user stays as an alias under a placeholder login, since the message
+    archive still refers to its key.
+    """
+    await con.execute(
+        """
+        UPDATE twitch.messages
+        SET sender_id = $2
+        WHERE sender_id = $1 AND channel_id IN (
+            -- Narrows it down to the channels the user chatted in, so the index on channel and sender is used
+            SELECT channel_id FROM twitch.channel_chatter_stats WHERE sender_id = $1
+        );
+        """,
+        from_id,
+        into_id,
+    )
+
+    await con.execute(
+        """
+        INSERT INTO twitch.channel_chatter_stats (
+            channel_id, sender_id, message_count, first_message_id, first_sent_at, last_message_id, last_sent_at
+        )
+        SELECT channel_id, $2, message_count, first_message_id, first_sent_at, last_message_id, last_sent_at
+        FROM twitch.channel_chatter_stats
+        WHERE sender_id = $1
+        ON CONFLICT (channel_id, sender_id)
+        DO UPDATE SET
+            message_count = twitch.channel_chatter_stats.message_count + EXCLUDED.message_count,
+            first_message_id = CASE
+                WHEN EXCLUDED.first_sent_at < twitch.channel_chatter_stats.first_sent_at
+                THEN EXCLUDED.first_message_id
+                ELSE twitch.channel_chatter_stats.first_message_id
+            END,
+            first_sent_at = LEAST(twitch.channel_chatter_stats.first_sent_at, EXCLUDED.first_sent_at),
+            last_message_id = CASE
+                WHEN EXCLUDED.last_sent_at >= twitch.channel_chatter_stats.last_sent_at
+                THEN EXCLUDED.last_message_id
+                ELSE twitch.channel_chatter_stats.last_message_id
+            END,
+            last_sent_at = GREATEST(twitch.channel_chatter_stats.last_sent_at, EXCLUDED.last_sent_at);
+        """,
+        from_id,
+        into_id,
+    )
+
+    await con.execute(
+        """
+        INSERT INTO twitch.watchtime (channel_id, user_id, online_time, total_time)
+        SELECT channel_id, $2, online_time, total_time
+        FROM twitch.watchtime
+        WHERE user_id = $1
+        ON CONFLICT (channel_id, user_id)
+        DO UPDATE SET
+            online_time = twitch.watchtime.online_time + EXCLUDED.online_time,
+            total_time = twitch.watchtime.total_time + EXCLUDED.total_time;
+        """,
+        from_id,
+        into_id,
+    )
+
+    await con.execute(
+        """
+        DELETE FROM twitch.channel_chatter_stats
+        WHERE sender_id = $1;
+        """,
+        from_id,
+    )
+    await con.execute(
+        """
+        DELETE FROM twitch.watchtime
+        WHERE user_id = $1;
+        """,
+        from_id,
+    )
+    await con.execute(
+        """
+        UPDATE twitch.users
+        SET merged_into = $2
+        WHERE merged_into = $1;
+        """,
+        from_id,
+        into_id,
+    )
+    await con.execute(
+        """
+        UPDATE twitch.users
+        SET login = login || '#' || id, merged_into = $2
+        WHERE id = $1;
+        """,
+        from_id,
+        into_id,
+    )